@@ -0,0 +1,7 @@
+'''
+VAE-driven implicit parametric unit cells
+
+The modules are imported one by one (from vae_geom.helper_VAEstruc import CNN_VAE), importing the package
+imports none of them; `vae_geom.inference` is the minimal inference path, `vae_geom.cli` the command line
+entry points. The scripts are run as modules from ./src/, e.g. python -m vae_geom.main_train_on_GPU
+'''
@@ -0,0 +1,266 @@
+'''
+benchmark and check the data loading path of custom_datasets and voxel_datasets
+
+    python -m vae_geom.benchmark_data_loading rss         # peak memory vs. dataset size, in-memory and mmap mode
+    python -m vae_geom.benchmark_data_loading throughput  # samples/sec, per-sample vs. batched fetching
+    python -m vae_geom.benchmark_data_loading pipeline    # loader samples/sec per worker count vs. one training step
+    python -m vae_geom.benchmark_data_loading voxel       # HDF5 voxel I/O per chunk shape and compression
+'''
+import os
+import sys
+import time
+import json
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+import torch
+from torch.utils.data import DataLoader
+
+from .helper_load_data import custom_datasets, custom_transform, batch_loader, loader_kwargs
+from .helper_instrument import anon_rss_mb
+
+
+def write_random_dataset(path, n, channels=3, dim=90, chunk=256, seed=0):
+    '''
+    write a random [n*channels*dim*dim] float32 .npy file chunk by chunk,
+    so that datasets larger than the memory can be generated
+    '''
+    rng = np.random.default_rng(seed)
+    data = np.lib.format.open_memmap(path, mode='w+', dtype=np.float32, shape=(n, channels, dim, dim))
+    for start in range(0, n, chunk):
+        stop = min(start + chunk, n)
+        data[start:stop] = rng.random((stop - start, channels, dim, dim), dtype=np.float32)
+    data.flush()
+    del data
+    return path
+
+
+def _measure_child(data_path, mmap, shards):
+    ''' run inside a fresh process: build the dataset, touch every sample, report peak anonymous RSS '''
+    baseline = anon_rss_mb()
+    paths = data_path.split(',') if shards else data_path
+    dataset = custom_datasets(paths, transform=custom_transform, mmap=mmap)
+    peak = anon_rss_mb()
+    for i in range(len(dataset)):
+        sample, _ = dataset[i]
+        if i % 64 == 0:
+            peak = max(peak, anon_rss_mb())
+    peak = max(peak, anon_rss_mb())
+    print(json.dumps({'n': len(dataset), 'baseline_mb': baseline, 'peak_mb': peak, 'growth_mb': peak - baseline}))
+
+
+def measure_peak_rss(data_path, mmap, shards=False):
+    '''
+    measure the peak anonymous RSS of loading and iterating over a dataset in a separate process
+    Args:
+        data_path: .npy path, or comma separated .npy shards when shards is True
+        mmap: use the memory mapped mode of custom_datasets
+    Return:
+        dict with n, baseline_mb, peak_mb and growth_mb
+    '''
+    cmd = [sys.executable, '-m', __package__ + '.benchmark_data_loading', '_child', data_path]
+    if mmap:
+        cmd.append('--mmap')
+    if shards:
+        cmd.append('--shards')
+    out = subprocess.run(cmd, check=True, capture_output=True, text=True,
+                         cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def check_flat_rss(sizes=(1000, 4000, 16000), tolerance_mb=64., work_dir=None):
+    '''
+    check that the peak memory of the mmap mode does not grow with the number of samples,
+    both for a single file and for the same data split into shards.
+    The in-memory mode is measured for comparison.
+    Return:
+        list of result dicts; raises AssertionError if the mmap mode grows beyond tolerance_mb
+    '''
+    results = []
+    with tempfile.TemporaryDirectory(dir=work_dir) as tmp:
+        for n in sizes:
+            path = write_random_dataset(os.path.join(tmp, f'data_{n}.npy'), n)
+            shards = [write_random_dataset(os.path.join(tmp, f'data_{n}_{k}.npy'), n // 4, seed=k) for k in range(4)]
+            for mode, kwargs in [('in-memory', dict(mmap=False)),
+                                 ('mmap', dict(mmap=True)),
+                                 ('mmap-sharded', dict(mmap=True, shards=True))]:
+                target = ','.join(shards) if kwargs.get('shards') else path
+                res = measure_peak_rss(target, **kwargs)
+                res['mode'] = mode
+                results.append(res)
+                print(f"{mode:>14s}  N={res['n']:>7d}  peak anon RSS growth {res['growth_mb']:8.1f} MB")
+            for p in [path] + shards:
+                os.remove(p)
+    for res in results:
+        if res['mode'].startswith('mmap'):
+            assert res['growth_mb'] < tolerance_mb, f"mmap mode grew by {res['growth_mb']:.1f} MB at N={res['n']}"
+    return results
+
+
+def loader_throughput(loader, min_time=1.):
+    '''
+    samples/sec of iterating over a DataLoader, repeated for at least min_time seconds
+    '''
+    n, start = 0, time.perf_counter()
+    while True:
+        for x, _ in loader:
+            n += len(x)
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            return n / elapsed
+
+
+def compare_throughput(n=4096, batch_sizes=(32, 64, 128, 256, 512, 1024), min_time=1., work_dir=None):
+    '''
+    compare the per-sample path (__getitem__ + custom_transform + default collate) with
+    the batched path (batch_loader + __getitems__), in-memory and memory mapped
+    Return:
+        list of dicts with mode, batch_size, per_sample and batched samples/sec
+    '''
+    results = []
+    with tempfile.TemporaryDirectory(dir=work_dir) as tmp:
+        path = write_random_dataset(os.path.join(tmp, 'data.npy'), n)
+        for mmap in (False, True):
+            per_sample = custom_datasets(path, transform=custom_transform, mmap=mmap)
+            batched = custom_datasets(path, transform=custom_transform, mmap=mmap, batched=True, reuse_buffer=True)
+            for batch_size in batch_sizes:
+                res = {'mode': 'mmap' if mmap else 'in-memory', 'batch_size': batch_size,
+                       'per_sample': loader_throughput(DataLoader(per_sample, batch_size=batch_size, shuffle=True), min_time),
+                       'batched': loader_throughput(batch_loader(batched, batch_size=batch_size, shuffle=True), min_time)}
+                results.append(res)
+                print(f"{res['mode']:>9s}  B={batch_size:>5d}  per-sample {res['per_sample']:10.0f}/s"
+                      f"  batched {res['batched']:10.0f}/s  x{res['batched'] / res['per_sample']:.1f}")
+    return results
+
+
+def compare_pipeline(n=4096, batch_size=128, workers=(0, 1, 2, 4), mmap=True, prefetch_factor=4,
+                     min_time=2., train_batch_size=8, work_dir=None):
+    '''
+    loader throughput of the configurable pipeline per worker count, against the training-step
+    throughput of CNN_VAE on this host; the loader is not the bottleneck when its rate is well above the model's
+    Return:
+        dict with train_step samples/sec and a list of per-worker-count loader results
+    '''
+    from .benchmark_model import run_case
+    train = run_case('train_step', train_batch_size, 6, (32, 64, 128, 256), 90, torch.get_num_threads(), repeat=2)
+    print(f"train step: {train['samples_per_sec']:.1f} samples/s")
+    results = []
+    with tempfile.TemporaryDirectory(dir=work_dir) as tmp:
+        path = write_random_dataset(os.path.join(tmp, 'data.npy'), n)
+        dataset = custom_datasets(path, transform=custom_transform, mmap=mmap, batched=True)
+        for num_workers in workers:
+            kwargs = loader_kwargs({'num_workers': num_workers, 'persistent_workers': True,
+                                    'prefetch_factor': prefetch_factor}, seed=0)
+            rate = loader_throughput(batch_loader(dataset, batch_size=batch_size, shuffle=True, **kwargs), min_time)
+            results.append({'num_workers': num_workers, 'samples_per_sec': rate,
+                            'headroom': rate / train['samples_per_sec']})
+            print(f"num_workers={num_workers}  loader {rate:10.0f} samples/s  x{rate / train['samples_per_sec']:.0f} of the train step")
+    return {'train_step_samples_per_sec': train['samples_per_sec'], 'loader': results}
+
+
+def random_sdfs(n, dim=20, spheres=3, seed=0):
+    '''
+    random SDF-like voxel fields [n*1*dim*dim*dim] in [0,1]: the distance to the nearest of a few random spheres,
+    smooth like real SDFs so that compression behaves realistically
+    '''
+    rng = np.random.default_rng(seed)
+    grid = np.stack(np.meshgrid(*[np.linspace(0., 1., dim, dtype=np.float32)] * 3, indexing='ij'), axis=-1)
+    centers = rng.random((n, spheres, 3), dtype=np.float32)
+    radii = 0.1 + 0.2 * rng.random((n, spheres), dtype=np.float32)
+    sdfs = np.empty((n, 1, dim, dim, dim), dtype=np.float32)
+    for i in range(n):
+        distance = np.linalg.norm(grid[None] - centers[i, :, None, None, None], axis=-1) - radii[i, :, None, None, None]
+        sdfs[i, 0] = 0.5 + 0.5 * np.tanh(4. * distance.min(axis=0))
+    return sdfs
+
+
+def compare_voxel_io(n=2048, dim=20, batch_size=64, chunk_samples=(1, 8, 32), compressions=(None, 'lzf', 'gzip-1', 'gzip-4'),
+                     num_workers=0, min_time=1., cache_mb=4., work_dir=None):
+    '''
+    I/O throughput of voxel_datasets per chunk shape and compression, for shuffled (training)
+    and sequential (test / encoding, with read-ahead) access; the block cache is limited to cache_mb,
+    smaller than the file, as for datasets larger than the memory
+    Return:
+        list of dicts with chunks, compression, file size, write time and samples/sec per access order
+    '''
+    from .helper_load_data import voxel_datasets, write_voxel_dataset
+    sdfs = random_sdfs(n, dim)
+    # whole samples per chunk, and one sub-block chunk that splits every sample into 8
+    chunk_shapes = [(k, 1, dim, dim, dim) for k in chunk_samples] + [(1, 1, dim // 2, dim // 2, dim // 2)]
+    results = []
+    with tempfile.TemporaryDirectory(dir=work_dir) as tmp:
+        for chunks in chunk_shapes:
+            for compression in compressions:
+                name, _, level = (compression or 'none').partition('-')
+                path = os.path.join(tmp, 'sdfs.h5')
+                t0 = time.perf_counter()
+                write_voxel_dataset(path, sdfs, chunks=chunks, compression=None if name == 'none' else name,
+                                    compression_opts=int(level) if level else None)
+                row = {'chunks': list(chunks), 'compression': compression or 'none',
+                       'file_mb': os.path.getsize(path) / 2**20, 'write_seconds': time.perf_counter() - t0}
+                for order in ('shuffled', 'sequential'):
+                    dataset = voxel_datasets(path, transform=custom_transform, batched=True,
+                                             cache_bytes=int(cache_mb * 2**20))
+                    loader = batch_loader(dataset, batch_size=batch_size, shuffle=order == 'shuffled',
+                                          **loader_kwargs({'num_workers': num_workers}))
+                    row[order] = loader_throughput(loader, min_time)
+                    dataset.close()
+                results.append(row)
+                print(f"chunks={row['chunks']}  {row['compression']:>7s}  {row['file_mb']:7.1f} MB"
+                      f"  shuffled {row['shuffled']:9.0f}  sequential {row['sequential']:9.0f} samples/s")
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='command', required=True)
+    rss = sub.add_parser('rss', help='peak RSS vs. dataset size')
+    rss.add_argument('--sizes', type=int, nargs='+', default=[1000, 4000, 16000])
+    rss.add_argument('--tolerance-mb', type=float, default=64.)
+    rss.add_argument('--work-dir', default=None)
+    thr = sub.add_parser('throughput', help='samples/sec of per-sample vs. batched fetching')
+    thr.add_argument('--n', type=int, default=4096)
+    thr.add_argument('--batch-sizes', type=int, nargs='+', default=[32, 64, 128, 256, 512, 1024])
+    thr.add_argument('--min-time', type=float, default=1.)
+    thr.add_argument('--work-dir', default=None)
+    pipe = sub.add_parser('pipeline', help='loader samples/sec per worker count vs. one training step')
+    pipe.add_argument('--n', type=int, default=4096)
+    pipe.add_argument('--batch-size', type=int, default=128)
+    pipe.add_argument('--workers', type=int, nargs='+', default=[0, 1, 2, 4])
+    pipe.add_argument('--prefetch-factor', type=int, default=4)
+    pipe.add_argument('--min-time', type=float, default=2.)
+    pipe.add_argument('--work-dir', default=None)
+    vox = sub.add_parser('voxel', help='HDF5 voxel samples/sec per chunk shape and compression')
+    vox.add_argument('--n', type=int, default=2048)
+    vox.add_argument('--dim', type=int, default=20)
+    vox.add_argument('--batch-size', type=int, default=64)
+    vox.add_argument('--chunk-samples', type=int, nargs='+', default=[1, 8, 32])
+    vox.add_argument('--compressions', nargs='+', default=['none', 'lzf', 'gzip-1', 'gzip-4'])
+    vox.add_argument('--num-workers', type=int, default=0)
+    vox.add_argument('--min-time', type=float, default=1.)
+    vox.add_argument('--cache-mb', type=float, default=4.)
+    vox.add_argument('--work-dir', default=None)
+    vox.add_argument('--out', default=None)
+    child = sub.add_parser('_child')
+    child.add_argument('data_path')
+    child.add_argument('--mmap', action='store_true')
+    child.add_argument('--shards', action='store_true')
+    args = parser.parse_args()
+
+    if args.command == 'rss':
+        check_flat_rss(args.sizes, args.tolerance_mb, args.work_dir)
+    elif args.command == 'throughput':
+        compare_throughput(args.n, args.batch_sizes, args.min_time, args.work_dir)
+    elif args.command == 'pipeline':
+        compare_pipeline(args.n, args.batch_size, args.workers, prefetch_factor=args.prefetch_factor,
+                         min_time=args.min_time, work_dir=args.work_dir)
+    elif args.command == 'voxel':
+        results = compare_voxel_io(args.n, args.dim, args.batch_size, args.chunk_samples,
+                                   [None if c == 'none' else c for c in args.compressions],
+                                   args.num_workers, args.min_time, args.cache_mb, args.work_dir)
+        if args.out is not None:
+            with open(args.out, 'w') as f:
+                json.dump(results, f, indent=2)
+    elif args.command == '_child':
+        _measure_child(args.data_path, args.mmap, args.shards)
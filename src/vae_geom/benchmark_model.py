@@ -0,0 +1,410 @@
+'''
+benchmark harness for CNN_VAE encode / decode / forward / train-step throughput
+
+Sweeps batch size, latent_dim, hidden_dims, input resolution and torch thread count, records
+samples/sec, latency percentiles and peak memory as JSON, and compares two result files.
+
+    python -m vae_geom.benchmark_model run --batch-sizes 1 8 32 --threads 1 4 --out base.json
+    python -m vae_geom.benchmark_model run --batch-sizes 1 8 32 --threads 1 4 --out new.json
+    python -m vae_geom.benchmark_model compare base.json new.json --threshold 0.05
+    python -m vae_geom.benchmark_model decoders --steps 50   # FLOPs, latency and accuracy of the decoder variants
+    python -m vae_geom.benchmark_model training --batch-size 32   # step time, peak memory and loss of the training modes
+'''
+import sys
+import json
+import time
+import platform
+import argparse
+import itertools
+import threading
+import multiprocessing
+
+import numpy as np
+import torch
+from torch import nn
+from torch.utils.flop_counter import FlopCounterMode
+
+from .helper_VAEstruc import CNN_VAE, lossfunc, lossfunc_logits
+from .helper_instrument import anon_rss_mb
+
+OPS = ('encode', 'decode', 'forward', 'train_step')
+CASE_KEYS = ('op', 'batch_size', 'latent_dim', 'hidden_dims', 'resolution', 'threads', 'device', 'decoder')
+DECODERS = ('legacy', 'upsample')
+# training step variants of main_train_on_GPU.py, as train_params (fused_loss, checkpoint_final_layer, micro_batches)
+TRAIN_MODES = {
+    'baseline': (False, False, 1),
+    'fused': (True, False, 1),
+    'fused_checkpoint': (True, True, 1),
+    'fused_micro4': (True, False, 4),
+    'fused_checkpoint_micro4': (True, True, 4),
+}
+# value of keys missing in result files of older versions
+CASE_DEFAULTS = {'decoder': 'legacy'}
+
+
+class peak_memory:
+    """Context manager measuring the peak memory of the enclosed block in MB.
+
+    On CUDA the allocator peak is used, on the CPU the anonymous RSS of the process is sampled
+    from a background thread every `interval` seconds.
+    """
+    def __init__(self, device, interval=0.001):
+        self.device = torch.device(device)
+        self.interval = interval
+        self.peak_mb = 0.
+
+    def _sample(self):
+        while not self._done.is_set():
+            self._peak = max(self._peak, anon_rss_mb())
+            self._done.wait(self.interval)
+
+    def __enter__(self):
+        if self.device.type == 'cuda':
+            torch.cuda.synchronize(self.device)
+            torch.cuda.reset_peak_memory_stats(self.device)
+            self._base = torch.cuda.memory_allocated(self.device)
+        else:
+            self._base = self._peak = anon_rss_mb()
+            self._done = threading.Event()
+            self._thread = threading.Thread(target=self._sample, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self.device.type == 'cuda':
+            torch.cuda.synchronize(self.device)
+            self.peak_mb = (torch.cuda.max_memory_allocated(self.device) - self._base) / 2**20
+        else:
+            self._done.set()
+            self._thread.join()
+            self.peak_mb = max(self._peak, anon_rss_mb()) - self._base
+
+
+def make_step(op, model, x, z, beta=10.):
+    ''' the function timed for one op, on prepared inputs '''
+    if op == 'encode':
+        return lambda: model.encode(x)
+    if op == 'decode':
+        return lambda: model.decode(z)
+    if op == 'forward':
+        return lambda: model(x)
+    optimizer = torch.optim.Adam(model.parameters(), lr=1e-4)
+
+    def train_step(): # one optimizer step of the training loop in main_train_on_GPU.py
+        x_hat, mu, logvar = model(x)
+        loss = lossfunc(x, x_hat, mu, logvar, beta=beta)
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+    return train_step
+
+
+def run_case(op, batch_size, latent_dim, hidden_dims, resolution, threads, device='cpu', warmup=1, repeat=5,
+             decoder='legacy'):
+    '''
+    benchmark one op for one configuration
+    Return:
+        dict with the configuration, samples_per_sec, latency percentiles in ms and peak_mem_mb,
+        or the configuration with an 'error' entry if the model does not support it
+    '''
+    case = dict(zip(CASE_KEYS, (op, batch_size, latent_dim, list(hidden_dims), resolution, threads, str(device),
+                                decoder)))
+    torch.set_num_threads(threads)
+    torch.manual_seed(0)
+    try:
+        with peak_memory(device) as mem: # model, inputs, warm-up and timed steps
+            model = CNN_VAE(channel_in=2, latent_dim=latent_dim, hidden_dims=list(hidden_dims),
+                            input_size=resolution, decoder=decoder).to(device)
+            model.train(op == 'train_step')
+            x = torch.rand(batch_size, 2, resolution, resolution, device=device)
+            z = torch.randn(batch_size, latent_dim, device=device)
+            step = make_step(op, model, x, z)
+            sync = torch.cuda.synchronize if torch.device(device).type == 'cuda' else (lambda: None)
+            with torch.inference_mode(op != 'train_step'):
+                for _ in range(warmup):
+                    step()
+                sync()
+                times = []
+                for _ in range(repeat):
+                    t0 = time.perf_counter()
+                    step()
+                    sync()
+                    times.append(time.perf_counter() - t0)
+    except (RuntimeError, ValueError) as e: # e.g. a resolution the architecture cannot reach
+        case['error'] = str(e).splitlines()[0]
+        return case
+    times = np.array(times) * 1000.
+    case.update({'samples_per_sec': batch_size / np.median(times) * 1000.,
+                 'latency_p50_ms': float(np.percentile(times, 50)),
+                 'latency_p90_ms': float(np.percentile(times, 90)),
+                 'latency_p99_ms': float(np.percentile(times, 99)),
+                 'peak_mem_mb': mem.peak_mb})
+    return case
+
+
+def run_sweep(ops=OPS, batch_sizes=(1, 8), latent_dims=(6,), hidden_dims=((32, 64, 128, 256),),
+              resolutions=(90,), threads=(None,), device='cpu', warmup=1, repeat=5, decoders=('legacy',)):
+    '''
+    run the full cartesian sweep
+    Return:
+        dict with 'meta' (versions, host) and 'results' (list of run_case dicts)
+    '''
+    threads = [torch.get_num_threads() if t is None else t for t in threads]
+    results = []
+    for *cfg, decoder in itertools.product(ops, batch_sizes, latent_dims, hidden_dims, resolutions, threads, decoders):
+        res = run_case(*cfg, device=device, warmup=warmup, repeat=repeat, decoder=decoder)
+        results.append(res)
+        line = '  '.join(f'{k}={res[k]}' for k in CASE_KEYS if k != 'device')
+        if 'error' in res:
+            print(f'{line}  error: {res["error"]}', file=sys.stderr)
+        else:
+            print(f'{line}  {res["samples_per_sec"]:.2f} samples/s  p50 {res["latency_p50_ms"]:.1f} ms'
+                  f'  peak {res["peak_mem_mb"]:.0f} MB', file=sys.stderr)
+    meta = {'torch': torch.__version__, 'python': platform.python_version(), 'machine': platform.machine(),
+            'processor': platform.processor(), 'time': time.strftime('%Y-%m-%d %H:%M:%S')}
+    return {'meta': meta, 'results': results}
+
+
+def compare(base, new, threshold=0.05, memory_floor_mb=16.):
+    '''
+    compare two result files
+    Args:
+        base, new: dicts as returned by run_sweep (or paths to their JSON files)
+        threshold: relative change that counts as a regression, 0.05 = 5 %
+        memory_floor_mb: peak memory changes below this are measurement noise
+    Return:
+        list of dicts per matching case with the relative change of throughput, p50 latency and peak memory,
+        and 'regression' set if throughput dropped or latency / memory grew by more than threshold
+    '''
+    if isinstance(base, str):
+        with open(base) as f:
+            base = json.load(f)
+    if isinstance(new, str):
+        with open(new) as f:
+            new = json.load(f)
+    key = lambda res: json.dumps([res.get(k, CASE_DEFAULTS.get(k)) for k in CASE_KEYS])
+    base_by_key = {key(res): res for res in base['results'] if 'error' not in res}
+    rows = []
+    for res in new['results']:
+        old = base_by_key.get(key(res))
+        if old is None or 'error' in res:
+            continue
+        row = {k: res.get(k, CASE_DEFAULTS.get(k)) for k in CASE_KEYS}
+        row['throughput_change'] = res['samples_per_sec'] / old['samples_per_sec'] - 1.
+        row['latency_change'] = res['latency_p50_ms'] / old['latency_p50_ms'] - 1.
+        row['memory_change_mb'] = res['peak_mem_mb'] - old['peak_mem_mb']
+        row['regression'] = (row['throughput_change'] < -threshold or row['latency_change'] > threshold
+                             or (row['memory_change_mb'] > memory_floor_mb
+                                 and res['peak_mem_mb'] > old['peak_mem_mb'] * (1. + threshold)))
+        rows.append(row)
+    return rows
+
+
+def decode_flops(model, latent_dim):
+    ''' FLOPs of decoding one latent vector '''
+    with torch.no_grad(), FlopCounterMode(display=False) as counter:
+        model.decode(torch.zeros(1, latent_dim))
+    return counter.get_total_flops()
+
+
+def smooth_fields(n, channels=2, resolution=90, cells=6, seed=0):
+    ''' random smooth fields in [0, 1] [n*C*W*L], bilinear upsampling of coarse noise, a stand-in for a dataset '''
+    generator = torch.Generator().manual_seed(seed)
+    coarse = torch.randn(n, channels, cells, cells, generator=generator)
+    fields = nn.functional.interpolate(coarse, size=(resolution, resolution), mode='bilinear', align_corners=False)
+    return torch.sigmoid(2. * fields)
+
+
+def compare_decoders(decoders=DECODERS, data=None, n_train=256, n_test=64, batch_size=16, steps=50, latent_dim=6,
+                     resolution=90, lr=1e-3, beta=1., latency_batch=8, repeat=3):
+    '''
+    compare the decoder variants of CNN_VAE: decode FLOPs and parameters, decode and train-step latency,
+    and the test reconstruction error after training every variant for the same steps on the same samples
+    Args:
+        data: .npy file of fields [N*C*W*L] (first two channels used), random smooth fields if None
+    Return:
+        list of dicts, one per decoder
+    '''
+    if data is None:
+        fields = smooth_fields(n_train + n_test, resolution=resolution)
+    else:
+        fields = torch.from_numpy(np.ascontiguousarray(np.load(data, mmap_mode='r')[:n_train + n_test, :2])).float()
+        resolution = fields.shape[-1]
+    x_train, x_test = fields[:n_train], fields[n_train:]
+    rows = []
+    for decoder in decoders:
+        torch.manual_seed(0)
+        model = CNN_VAE(channel_in=2, latent_dim=latent_dim, input_size=resolution, decoder=decoder)
+        row = {'decoder': decoder, 'params': sum(p.numel() for p in model.decoder_input.parameters())
+               + sum(p.numel() for p in model.decoder.parameters())
+               + sum(p.numel() for p in model.final_layer.parameters()),
+               'decode_gflops': decode_flops(model.eval(), latent_dim) / 1e9}
+        for op in ('decode', 'train_step'):
+            res = run_case(op, latency_batch, latent_dim, (32, 64, 128, 256), resolution, torch.get_num_threads(),
+                           repeat=repeat, decoder=decoder)
+            row[f'{op}_p50_ms'] = res['latency_p50_ms']
+            row[f'{op}_peak_mem_mb'] = res['peak_mem_mb']
+        optimizer = torch.optim.Adam(model.parameters(), lr=lr)
+        generator = torch.Generator().manual_seed(0)
+        model.train()
+        for _ in range(steps):
+            x = x_train[torch.randint(n_train, (batch_size,), generator=generator)]
+            x_hat, mu, logvar = model(x)
+            loss = lossfunc(x, x_hat, mu, logvar, beta=beta)
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+        model.eval()
+        with torch.no_grad():
+            x_hat = torch.cat([model(x)[0] for x in x_test.split(batch_size)])
+        row['test_bce_per_pixel'] = nn.functional.binary_cross_entropy(x_hat, x_test).item()
+        row['test_mean_abs_error'] = (x_hat - x_test).abs().mean().item()
+        rows.append(row)
+        print(f"{decoder:>10s}  {row['decode_gflops']:7.3f} GFLOP/sample  {row['params']:>9d} params"
+              f"  decode p50 {row['decode_p50_ms']:8.1f} ms  train step p50 {row['train_step_p50_ms']:8.1f} ms"
+              f"  test BCE {row['test_bce_per_pixel']:.4f}  MAE {row['test_mean_abs_error']:.4f}", file=sys.stderr)
+    return rows
+
+
+def accumulated_step(model, optimizer, x, beta=10., fused_loss=False, micro_batches=1):
+    ''' one optimizer step of the training loop in main_train_on_GPU.py, return the summed batch loss '''
+    optimizer.zero_grad()
+    total = 0.
+    for x_micro in x.tensor_split(min(micro_batches, len(x))):
+        x_hat, mu, logvar = model(x_micro, logits=fused_loss)
+        loss = (lossfunc_logits if fused_loss else lossfunc)(x_micro, x_hat, mu, logvar, beta=beta)
+        loss.backward()
+        total += loss.item()
+    optimizer.step()
+    return total
+
+
+def saved_activations_mb(model, x, fused_loss=False):
+    ''' MB of the tensors saved for backward by the forward pass and loss of one batch x '''
+    storages = {}
+
+    def pack(t):
+        storages[t.untyped_storage().data_ptr()] = t.untyped_storage().nbytes()
+        return t
+    with torch.autograd.graph.saved_tensors_hooks(pack, lambda t: t):
+        x_hat, mu, logvar = model(x, logits=fused_loss)
+        (lossfunc_logits if fused_loss else lossfunc)(x, x_hat, mu, logvar, beta=1.)
+    return sum(storages.values()) / 2**20
+
+
+def _train_mode_case(mode, batch_size, resolution, decoder, warmup, repeat, queue):
+    ''' child process of compare_train_modes, a fresh process so that the peak RSS is the one of this mode '''
+    fused_loss, checkpoint_final, micro_batches = TRAIN_MODES[mode]
+    torch.manual_seed(0)
+    model = CNN_VAE(channel_in=2, latent_dim=6, input_size=resolution, decoder=decoder)
+    model.checkpoint_final = checkpoint_final
+    model.train()
+    optimizer = torch.optim.Adam(model.parameters(), lr=1e-4)
+    x = smooth_fields(batch_size, resolution=resolution)
+    activations_mb = saved_activations_mb(model, x.tensor_split(min(micro_batches, batch_size))[0], fused_loss)
+    torch.manual_seed(0) # same weights and running statistics in every mode
+    model.load_state_dict(CNN_VAE(channel_in=2, latent_dim=6, input_size=resolution, decoder=decoder).state_dict())
+    times = []
+    with peak_memory('cpu') as mem:
+        for i in range(warmup + repeat):
+            torch.manual_seed(i) # the same reparameterization noise in every mode
+            t0 = time.perf_counter()
+            loss = accumulated_step(model, optimizer, x, fused_loss=fused_loss, micro_batches=micro_batches)
+            times.append(time.perf_counter() - t0)
+            if i == 0:
+                first_loss = loss
+    queue.put({'mode': mode, 'fused_loss': fused_loss, 'checkpoint_final_layer': checkpoint_final,
+               'micro_batches': micro_batches, 'batch_size': batch_size, 'decoder': decoder,
+               'step_p50_ms': float(np.median(times[warmup:])) * 1000., 'peak_mem_mb': mem.peak_mb,
+               'saved_activations_mb': activations_mb,
+               'first_loss': first_loss})
+
+
+def compare_train_modes(modes=tuple(TRAIN_MODES), batch_size=32, resolution=90, decoder='legacy', warmup=1, repeat=5):
+    '''
+    step time, peak memory and loss of the training step variants on the same weights, batch and noise,
+    every mode in its own process; saved_activations_mb is the memory kept for backward by one micro-batch
+    Return:
+        list of dicts, one per mode, first_loss_rel_diff relative to the first mode
+    '''
+    context = multiprocessing.get_context('fork')
+    rows = []
+    for mode in modes:
+        queue = context.Queue()
+        process = context.Process(target=_train_mode_case,
+                                  args=(mode, batch_size, resolution, decoder, warmup, repeat, queue))
+        process.start()
+        rows.append(queue.get())
+        process.join()
+    for row in rows:
+        row['first_loss_rel_diff'] = abs(row['first_loss'] - rows[0]['first_loss']) / abs(rows[0]['first_loss'])
+        print(f"{row['mode']:>24s}  step p50 {row['step_p50_ms']:8.1f} ms  peak memory {row['peak_mem_mb']:7.0f} MB"
+              f"  saved activations {row['saved_activations_mb']:6.0f} MB"
+              f"  first loss {row['first_loss']:.4f} ({row['first_loss_rel_diff']:.1e})", file=sys.stderr)
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='command', required=True)
+    run = sub.add_parser('run', help='run a sweep and write the results as JSON')
+    run.add_argument('--ops', nargs='+', default=list(OPS), choices=OPS)
+    run.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 8])
+    run.add_argument('--latent-dims', type=int, nargs='+', default=[6])
+    run.add_argument('--hidden-dims', nargs='+', default=['32,64,128,256'],
+                     help='comma separated encoder channels, one entry per configuration')
+    run.add_argument('--resolutions', type=int, nargs='+', default=[90])
+    run.add_argument('--threads', type=int, nargs='+', default=[None])
+    run.add_argument('--decoders', nargs='+', default=['legacy'], choices=DECODERS)
+    run.add_argument('--device', default='cpu')
+    run.add_argument('--warmup', type=int, default=1)
+    run.add_argument('--repeat', type=int, default=5)
+    run.add_argument('--out', default=None, help='JSON file, stdout if omitted')
+    cmp = sub.add_parser('compare', help='compare two result files and flag regressions')
+    cmp.add_argument('base')
+    cmp.add_argument('new')
+    cmp.add_argument('--threshold', type=float, default=0.05)
+    dec = sub.add_parser('decoders', help='FLOPs, latency and accuracy of the decoder variants')
+    dec.add_argument('--decoders', nargs='+', default=list(DECODERS), choices=DECODERS)
+    dec.add_argument('--data', default=None, help='.npy fields, random smooth fields if omitted')
+    dec.add_argument('--n-train', type=int, default=256)
+    dec.add_argument('--n-test', type=int, default=64)
+    dec.add_argument('--batch-size', type=int, default=16)
+    dec.add_argument('--steps', type=int, default=50)
+    dec.add_argument('--out', default=None)
+    trn = sub.add_parser('training', help='step time, peak memory and loss of the training step variants')
+    trn.add_argument('--modes', nargs='+', default=list(TRAIN_MODES), choices=TRAIN_MODES)
+    trn.add_argument('--batch-size', type=int, default=32)
+    trn.add_argument('--decoder', default='legacy', choices=DECODERS)
+    trn.add_argument('--warmup', type=int, default=1)
+    trn.add_argument('--repeat', type=int, default=5)
+    trn.add_argument('--out', default=None)
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        hidden_dims = [tuple(int(h) for h in dims.split(',')) for dims in args.hidden_dims]
+        out = run_sweep(args.ops, args.batch_sizes, args.latent_dims, hidden_dims, args.resolutions,
+                        args.threads, args.device, args.warmup, args.repeat, args.decoders)
+        if args.out is None:
+            print(json.dumps(out, indent=2))
+        else:
+            with open(args.out, 'w') as f:
+                json.dump(out, f, indent=2)
+    elif args.command in ('decoders', 'training'):
+        if args.command == 'decoders':
+            rows = compare_decoders(args.decoders, args.data, args.n_train, args.n_test, args.batch_size, args.steps)
+        else:
+            rows = compare_train_modes(args.modes, args.batch_size, decoder=args.decoder, warmup=args.warmup,
+                                       repeat=args.repeat)
+        if args.out is not None:
+            with open(args.out, 'w') as f:
+                json.dump(rows, f, indent=2)
+    else:
+        rows = compare(args.base, args.new, args.threshold)
+        for row in rows:
+            flag = 'REGRESSION' if row['regression'] else 'ok'
+            print(f"{flag:>10s}  {row['op']:>10s}  B={row['batch_size']}  latent={row['latent_dim']}"
+                  f"  hidden={row['hidden_dims']}  res={row['resolution']}  threads={row['threads']}"
+                  f"  decoder={row['decoder']}  throughput {row['throughput_change']:+.1%}  p50 {row['latency_change']:+.1%}"
+                  f"  memory {row['memory_change_mb']:+.0f} MB")
+        sys.exit(1 if any(row['regression'] for row in rows) else 0)
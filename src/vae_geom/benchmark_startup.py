@@ -0,0 +1,104 @@
+'''
+import-time and cold-start benchmark of the inference path
+
+Every measurement runs in a fresh interpreter, as a newly started inference worker:
+    imports   wall time of `python -c "import <module>"` per module
+    startup   wall time from interpreter start to the first decoded batch, for the notebook path
+              (torch, torchvision, matplotlib, helper_load_data, helper_VAEstruc) and the minimal
+              path of the package (vae_geom.inference.load_model)
+
+    python -m vae_geom.benchmark_startup --repeat 5
+'''
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+# folder containing the vae_geom package, the working directory of the measured interpreters
+SRC = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULES = ('torch', 'torchvision', 'matplotlib.pyplot', 'vae_geom.helper_VAEstruc', 'vae_geom.helper_load_data',
+           'vae_geom.inference')
+
+# model construction, state dict loading and one decoded batch
+STARTUP = {
+    'notebook': '''
+import torch
+import torchvision
+import numpy as np
+from torch import nn
+from torch.utils.data import DataLoader
+from matplotlib import pyplot as plt
+from vae_geom.helper_load_data import custom_datasets, custom_transform
+from vae_geom.helper_VAEstruc import CNN_VAE
+model = CNN_VAE(channel_in=2, latent_dim={latent_dim}, decoder='{decoder}')
+model.load_state_dict(torch.load('{model}', map_location='cpu'))
+model.eval()
+with torch.no_grad():
+    model.decode(torch.zeros({batch}, {latent_dim}))
+''',
+    'minimal': '''
+import torch
+from vae_geom.inference import load_model
+model = load_model('{config}', '{model}')
+with torch.inference_mode():
+    model.decode(torch.zeros({batch}, {latent_dim}))
+''',
+}
+
+
+def cold_seconds(code, repeat=5):
+    ''' median wall time of a fresh interpreter running code in the folder of the package '''
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        subprocess.run([sys.executable, '-c', code], cwd=SRC, check=True, stdout=subprocess.DEVNULL)
+        times.append(time.perf_counter() - t0)
+    return statistics.median(times)
+
+
+def import_times(modules=MODULES, repeat=5):
+    ''' seconds per module import in a fresh interpreter, the bare interpreter start as 'python' '''
+    times = {'python': cold_seconds('pass', repeat)}
+    for module in modules:
+        try:
+            times[module] = cold_seconds(f'import {module}', repeat)
+        except subprocess.CalledProcessError:
+            times[module] = None # not installed
+    return times
+
+
+def startup_times(latent_dim=6, decoder='legacy', batch=1, repeat=5):
+    ''' seconds to the first decoded batch per startup path, with a saved random state dict '''
+    import torch
+    from .inference import load_model
+
+    with tempfile.TemporaryDirectory() as tmp:
+        config = os.path.join(tmp, 'config.json')
+        with open(config, 'w') as f:
+            json.dump({'model_params': {'latent_dim': latent_dim, 'decoder': decoder},
+                       'Path': {'train_data_path': 'train.npy'}}, f)
+        model = os.path.join(tmp, 'model.pt')
+        torch.save(load_model(config).state_dict(), model)
+        return {name: cold_seconds(code.format(config=config, model=model, latent_dim=latent_dim,
+                                               decoder=decoder, batch=batch), repeat)
+                for name, code in STARTUP.items()}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--decoder', default='legacy', choices=('legacy', 'upsample'))
+    parser.add_argument('--out', default=None, help='optional JSON file of the results')
+    args = parser.parse_args()
+
+    results = {'imports': import_times(repeat=args.repeat), 'startup': startup_times(decoder=args.decoder, repeat=args.repeat)}
+    for kind, times in results.items():
+        for name, seconds in times.items():
+            print(f'{kind:8s} {name:28s} ' + ('not installed' if seconds is None else f'{seconds:7.3f} s'))
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,72 @@
+'''
+command line entry points of the installed package, all reading the config format of config_cluster.json
+
+    vae-train  [--config config_cluster.json]                                   # vae_geom.main_train_on_GPU
+    vae-encode --config config_cluster.json --model VAEmodel_last.pt --out ./latent_index/
+    vae-decode --config config_cluster.json --model VAEmodel_last.pt --latents mesh_latents.npy --out mesh_fields.npy
+
+Only the standard library and the inference module are imported here, torch and the helper modules
+are imported by the command that needs them; `vae_geom.inference.load_model` is the minimal inference
+path (model construction, state dict, decode).
+'''
+import sys
+import argparse
+
+from .inference import read_config, load_model
+
+
+def train(argv=None):
+    ''' run main_train_on_GPU.main on a config, relative paths of the config are relative to the working directory '''
+    parser = argparse.ArgumentParser(description='train the VAE, see vae_geom.main_train_on_GPU')
+    parser.add_argument('--config', default='config_cluster.json')
+    args = parser.parse_args(argv)
+    from .main_train_on_GPU import main
+    main(args.config)
+
+
+def encode(argv=None):
+    ''' encode a dataset into a latent index folder (latents.npy, ids.npy, norms.npy, meta.json) '''
+    parser = argparse.ArgumentParser(description='encode a dataset to its mean latent vectors')
+    parser.add_argument('--config', default='config_cluster.json')
+    parser.add_argument('--model', required=True, help='state dict (.pt) or artifact (.tensors) saved by the training script')
+    parser.add_argument('--data', default=None, help='.npy file, quantized folder or .h5 file, default the training data')
+    parser.add_argument('--out', required=True, help='output folder')
+    parser.add_argument('--batch-size', type=int, default=None, help='default model_params.batch_size')
+    parser.add_argument('--device', default='cpu')
+    parser.add_argument('--num-workers', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    from .helper_latent_index import encode_dataset
+    config = read_config(args.config)
+    data = config['Path']['train_data_path'] if args.data is None else args.data
+    model = load_model(config, args.model, map_location=args.device)
+    encode_dataset(model, data, args.out, batch_size=args.batch_size or config['model_params']['batch_size'],
+                   device=args.device, num_workers=args.num_workers)
+    print(args.out)
+
+
+def decode(argv=None):
+    ''' decode a latent array [N*latent_dim] into a memory-mapped field array, chunked and restartable '''
+    parser = argparse.ArgumentParser(description='decode latent vectors to fields, see vae_geom.helper_stream_decode')
+    parser.add_argument('--config', default='config_cluster.json')
+    parser.add_argument('--model', required=True, help='state dict (.pt) or artifact (.tensors) saved by the training script')
+    parser.add_argument('--latents', required=True, help='.npy or .tensors file [N*latent_dim]')
+    parser.add_argument('--out', required=True, help='output .npy file')
+    parser.add_argument('--chunk-size', type=int, default=256)
+    parser.add_argument('--workers', type=int, default=0)
+    parser.add_argument('--float16', action='store_true', help='store the fields as float16')
+    args = parser.parse_args(argv)
+
+    import numpy as np
+    from .helper_stream_decode import stream_decode
+    from .helper_latent_index import load_latents
+    model = load_model(args.config, args.model)
+    print(stream_decode(model.decode, load_latents(args.latents), args.out, chunk_size=args.chunk_size,
+                        workers=args.workers, dtype=np.float16 if args.float16 else np.float32, verbose=True))
+
+
+if __name__ == '__main__':
+    commands = {'train': train, 'encode': encode, 'decode': decode}
+    if len(sys.argv) < 2 or sys.argv[1] not in commands:
+        sys.exit(f'usage: python -m vae_geom.cli {{{",".join(commands)}}} ...')
+    commands[sys.argv[1]](sys.argv[2:])
@@ -0,0 +1,445 @@
+# define the VAE model
+from contextlib import contextmanager, nullcontext
+
+import torch
+from torch import nn
+from torch.utils.checkpoint import checkpoint
+
+
+
+# %% DEMO TO DESIGN SIMPLE VAE MODEL
+class VAE(nn.Module):
+    '''
+    Variational Autoencoder (VAE) implemented using linear layers.
+    It encodes input data to a latent space representation and then decodes it back to the original input space.
+    The VAE consists of two main parts: an encoder and a decoder. Use dense layers to connect them.
+    '''
+    def __init__(self):
+        super().__init__()
+        d = 20 # Dimension of latent space vector
+        # Encoder network: Maps inputs to the latent space representation.
+        # The encoder outputs two things: mean (mu) and log variance (logvar) of the latent space distribution.
+        self.encoder = nn.Sequential(
+            nn.Linear(784, d ** 2),
+            nn.ReLU(),
+            nn.Linear(d ** 2, d * 2)
+        )
+        # Decoder network: Maps latent space representations back to the input space.
+        self.decoder = nn.Sequential(
+            nn.Linear(d, d ** 2),
+            nn.ReLU(),
+            nn.Linear(d ** 2, 784),
+            nn.Sigmoid(),
+        )
+
+    def reparameterise(self, mu, logvar):
+        '''
+        Reparameterizes the latent space vector to allow backpropagation through random operations.
+        This is done by sampling from the distribution defined by mu and logvar using the reparameterization trick.
+        
+        Parameters:
+        - mu: Mean of the latent space distribution.
+        - logvar: Log variance of the latent space distribution.
+        
+        Returns:
+        - A sampled latent vector (z).
+        '''
+        if self.training: # Only add randomness during training.
+            std = logvar.mul(0.5).exp_()# Calculates the standard deviation.
+            eps = std.new_empty(std.size()).normal_() # Samples epsilon from a standard normal distribution.
+            return eps.mul_(std).add_(mu)  # Returns z = mu + epsilon*std.
+        else:
+            return mu # During evaluation, just use the mean.
+
+    def forward(self, x):
+        '''
+        Defines the forward pass of the VAE.
+        
+        Parameters:
+        - x: Input tensor.
+        
+        Returns:
+        - Reconstructed input, mean and log variance of the latent space distribution.
+        '''
+        mu_logvar = self.encoder(x.view(-1, 784)).view(-1, 2, d)
+        mu = mu_logvar[:, 0, :]
+        logvar = mu_logvar[:, 1, :]
+        z = self.reparameterise(mu, logvar)
+        return self.decoder(z), mu, logvar
+
+
+
+        
+
+                     
+# %% DEMO TO DESIGN CNN VAE MODEL
+class CNN_VAE(nn.Module):
+    '''
+    Convolutional Variational Autoencoder (CNN-VAE) for encoding input data to a latent space representation
+    and decoding it back to the original input space. This class uses convolutional layers for the encoder
+    and convolutional transpose layers for the decoder, with dense layers to connect the latent space representation.
+
+    Two decoders are available:
+        'legacy': transposed convolutions and a final kernel_size=31 transposed convolution; it only reconstructs
+                  input_size == 32*s + 26, s the spatial size of the encoder output, which with the default four
+                  encoder layers holds for 90 only
+        'upsample': nearest upsampling + 3x3 convolutions up to the input size, derived from input_size,
+                    a fraction of the FLOPs and memory of 'legacy' (not compatible with its state dicts)
+
+    Args:
+        channel_in: number of channels of the input fields
+        latent_dim: dimension of the latent space vector
+        hidden_dims: encoder channels, default [32, 64, 128, 256]
+        input_size: width (= length) of the square input fields, default 90
+        decoder: 'legacy' or 'upsample', default 'legacy'
+
+    Attributes:
+        checkpoint_final: recompute final_layer in the backward pass instead of keeping its full-resolution
+                          activations, only while training with gradients, default False
+    '''
+
+    def __init__(self, channel_in, latent_dim, hidden_dims=None, input_size=90, decoder='legacy'):
+        super(CNN_VAE, self).__init__()
+        self.latent_dim = latent_dim # latent space vector 
+        self.channel_in = channel_in # number of colors
+        self.input_size = input_size
+        self.decoder_type = decoder
+        self.checkpoint_final = False
+
+        if hidden_dims is None:
+            hidden_dims = [32, 64, 128, 256]
+        self.hidden_dims = list(hidden_dims) # channels of the encoder layers
+        if decoder not in ('legacy', 'upsample'):
+            raise ValueError(f"unknown decoder {decoder}, use 'legacy' or 'upsample'")
+
+        # Encoder: Convolutional layers to encode input into a latent representation
+        modules = []
+        for h_dim in hidden_dims:
+            modules.append(
+                nn.Sequential(
+                    nn.Conv2d(channel_in, h_dim, kernel_size=7, stride=2, padding=1),
+                    nn.BatchNorm2d(h_dim),
+                    nn.LeakyReLU())
+            )
+            channel_in = h_dim
+        self.encoder = nn.Sequential(*modules)
+        # spatial size of the encoder output, 90 -> 43 -> 19 -> 7 -> 2 for the default input
+        encoded_size = input_size
+        for _ in hidden_dims:
+            encoded_size = (encoded_size + 2 * 1 - 7) // 2 + 1
+        if encoded_size < 1:
+            raise ValueError(f'input_size {input_size} is too small for {len(hidden_dims)} encoder layers')
+        # shape the decoder input is viewed as [C*W*L]
+        self.decoder_shape = (hidden_dims[-1], encoded_size, encoded_size)
+        n_features = hidden_dims[-1] * encoded_size**2
+
+        # Transition between encoder and decoder: Dense layers for mu and log variance of latent space
+        self.fc_mu = nn.Linear(n_features, self.latent_dim)
+        self.fc_logvar = nn.Linear(n_features, self.latent_dim)
+
+
+        # Decoder Input: Prepares latent dimension for decoding process
+        self.decoder_input = nn.Linear(self.latent_dim, n_features)
+        if decoder == 'upsample':
+            self.decoder, self.final_layer = self._upsample_decoder(hidden_dims, encoded_size)
+            return
+        if 32 * encoded_size + 26 != input_size: # size reached by the transposed convolutions below
+            raise ValueError(f"decoder='legacy' does not reconstruct input_size {input_size}, use decoder='upsample'")
+        modules = []
+        hidden_dims=[hidden_dims[-1],128,64,64,64]
+        for i in range(len(hidden_dims) - 1):
+            modules.append(
+                nn.Sequential(
+                    nn.ConvTranspose2d(hidden_dims[i], hidden_dims[i + 1], kernel_size=3, stride=2, padding=1, output_padding=1),
+                    nn.BatchNorm2d(hidden_dims[i + 1]),
+                    nn.LeakyReLU()
+                )
+            )
+
+        self.decoder = nn.Sequential(*modules)
+
+
+        # Final layer: Convolutional transpose layer to match the original input's shape and channel
+        self.final_layer = nn.Sequential(
+            nn.ConvTranspose2d(hidden_dims[-1], hidden_dims[-1], kernel_size=31, stride=2, padding=1, output_padding=0),
+            nn.BatchNorm2d(hidden_dims[-1]),
+            nn.LeakyReLU(),
+            nn.Conv2d(hidden_dims[-1], out_channels=self.channel_in, kernel_size=2   , stride=1,padding=0),
+            nn.Sigmoid()
+            # nn.Tanh()
+        )
+
+    def _upsample_decoder(self, hidden_dims, encoded_size):
+        ''' decoder and final layer of the 'upsample' variant: each block doubles the size with nearest upsampling
+        followed by a 3x3 convolution, the final layer resizes bilinearly to input_size and maps to channel_in
+        '''
+        channels = list(reversed(hidden_dims))
+        modules = []
+        size, i = encoded_size, 0
+        while size * 2 < self.input_size:
+            c_in, c_out = channels[min(i, len(channels) - 1)], channels[min(i + 1, len(channels) - 1)]
+            modules.append(
+                nn.Sequential(
+                    nn.Upsample(scale_factor=2, mode='nearest'),
+                    nn.Conv2d(c_in, c_out, kernel_size=3, padding=1),
+                    nn.BatchNorm2d(c_out),
+                    nn.LeakyReLU())
+            )
+            size, i = size * 2, i + 1
+        c = channels[min(i, len(channels) - 1)]
+        final_layer = nn.Sequential(
+            nn.Upsample(size=(self.input_size, self.input_size), mode='bilinear', align_corners=False),
+            nn.Conv2d(c, c, kernel_size=3, padding=1),
+            nn.BatchNorm2d(c),
+            nn.LeakyReLU(),
+            nn.Conv2d(c, out_channels=self.channel_in, kernel_size=3, padding=1),
+            nn.Sigmoid()
+        )
+        return nn.Sequential(*modules), final_layer
+
+    def encode(self, x):
+        ''' Encodes input tensor into a latent space representation (mu and log_var).
+        Args: 
+            x: input tensor [B*C*W*L] 
+        Return:
+            mu: mean of latent space vector [B*latent_dim]
+            log_var: log variance of latent space vector [B*latent_dim]
+        '''
+        x = self.encoder(x) #[B*C*W*L]
+        x = torch.flatten(x, start_dim=1) #[B*hidden_dims[-1]*W*L]
+        mu = self.fc_mu(x) 
+        log_var = self.fc_logvar(x)
+        return mu, log_var
+        
+    def decode(self,z, logits=False):
+        '''  Decodes latent space vectors back into reconstructed images.
+        Args:
+            z: latent space vector [B*latent_dim]
+            logits: return the input of the final sigmoid, for lossfunc_logits
+        Return:
+            x_hat: reconstructed images [B*C*W*L], logits if logits is True
+        '''
+        result = self.decoder_input(z)
+        result = result.view(-1, *self.decoder_shape)  # [B*hidden_dims[-1]*W*L] of the encoder output
+        result = self.decoder(result)
+        x_hat = self._final(result, logits)
+        return x_hat
+
+    def _final(self, result, logits=False):
+        ''' final_layer without its sigmoid if logits, checkpointed if checkpoint_final while training '''
+        head, sigmoid = self.final_layer[:-1], self.final_layer[-1]
+        if self.checkpoint_final and self.training and torch.is_grad_enabled():
+            calls = []
+
+            def run(x):
+                # the recomputation in backward must not update the batch norm statistics a second time
+                with _keep_running_stats(head) if calls else nullcontext():
+                    calls.append(1)
+                    return head(x)
+            result = checkpoint(run, result, use_reentrant=False)
+        else:
+            result = head(result)
+        return result if logits else sigmoid(result)
+        
+    def rereparameterize(self, mu,log_var, eps=None):
+        '''Reparameterization trick to sample from N(mu, var) from N(0,1),
+        for training purpose, add a random noise log_var to the latent space vector,
+        for evaluation purpose, only use the mean of latent space vector
+
+        Args: 
+            mu: mean of latent space vector [B*latent_dim]
+            log_var: log variance of latent space vector [B*latent_dim]
+            eps: the N(0,1) noise [B*latent_dim], drawn from the global generator if None
+        Return:
+            a latent space tesnor [B*latent_dim]
+
+        '''
+        if  self.training: # only for training purpose
+            std = torch.exp(0.5*log_var)
+            eps = torch.randn_like(std) if eps is None else eps.to(std)
+            return eps.mul(std).add_(mu)
+        else:
+            return mu
+        
+    def forward(self,inputs, logits=False, eps=None):
+        """  connection of encoder and decoder inputs x and output x_hat
+        Args:
+            inputs: input tensor [B*C*W*L]
+            logits: return the logits of x_hat instead of x_hat, for lossfunc_logits
+            eps: reparameterization noise [B*latent_dim] while training, see rereparameterize
+        Return:
+            x_hat: reconstructed images [B*C*W*L]
+            mu: mean of latent space vector [B*latent_dim]
+            log_var: log variance of latent space vector [B*latent_dim]
+        """
+        mu, log_var = self.encode(inputs)
+        z = self.rereparameterize(mu, log_var, eps)
+        x_hat = self.decode(z, logits)
+
+        return x_hat,mu,log_var
+
+
+# %% 3D CNN VAE MODEL FOR VOXEL FIELDS
+class CNN_VAE3D(nn.Module):
+    '''
+    3D counterpart of CNN_VAE for voxel fields [B*C*D*W*L], e.g. SDFs normalized to [0,1].
+    The encoder uses strided 3x3x3 convolutions, the decoder nearest upsampling + 3x3x3 convolutions
+    up to the input size and a final trilinear resize, all shapes are derived from input_size.
+
+    Args:
+        channel_in: number of channels of the voxel fields, default 1
+        latent_dim: dimension of the latent space vector
+        hidden_dims: encoder channels, default [32, 64, 128]
+        input_size: size of the cubic voxel grid, default 20
+
+    Attributes:
+        checkpoint_final: see CNN_VAE
+    '''
+
+    def __init__(self, channel_in=1, latent_dim=6, hidden_dims=None, input_size=20):
+        super(CNN_VAE3D, self).__init__()
+        self.latent_dim = latent_dim
+        self.channel_in = channel_in
+        self.input_size = input_size
+        self.checkpoint_final = False
+
+        if hidden_dims is None:
+            hidden_dims = [32, 64, 128]
+
+        # Encoder: every layer halves the grid, 20 -> 10 -> 5 -> 3 for the default input
+        modules = []
+        encoded_size = input_size
+        for h_dim in hidden_dims:
+            modules.append(
+                nn.Sequential(
+                    nn.Conv3d(channel_in, h_dim, kernel_size=3, stride=2, padding=1),
+                    nn.BatchNorm3d(h_dim),
+                    nn.LeakyReLU())
+            )
+            channel_in = h_dim
+            encoded_size = (encoded_size - 1) // 2 + 1
+        self.encoder = nn.Sequential(*modules)
+        # shape the decoder input is viewed as [C*D*W*L]
+        self.decoder_shape = (hidden_dims[-1], encoded_size, encoded_size, encoded_size)
+        n_features = hidden_dims[-1] * encoded_size**3
+
+        # Transition between encoder and decoder: Dense layers for mu and log variance of latent space
+        self.fc_mu = nn.Linear(n_features, self.latent_dim)
+        self.fc_logvar = nn.Linear(n_features, self.latent_dim)
+        self.decoder_input = nn.Linear(self.latent_dim, n_features)
+
+        # Decoder: each block doubles the grid until the next doubling would exceed input_size
+        channels = list(reversed(hidden_dims))
+        modules = []
+        size, i = encoded_size, 0
+        while size * 2 < input_size:
+            c_in, c_out = channels[min(i, len(channels) - 1)], channels[min(i + 1, len(channels) - 1)]
+            modules.append(
+                nn.Sequential(
+                    nn.Upsample(scale_factor=2, mode='nearest'),
+                    nn.Conv3d(c_in, c_out, kernel_size=3, padding=1),
+                    nn.BatchNorm3d(c_out),
+                    nn.LeakyReLU())
+            )
+            size, i = size * 2, i + 1
+        self.decoder = nn.Sequential(*modules)
+
+        # Final layer: resize to the input grid and map to the input channels
+        c = channels[min(i, len(channels) - 1)]
+        self.final_layer = nn.Sequential(
+            nn.Upsample(size=(input_size,) * 3, mode='trilinear', align_corners=False),
+            nn.Conv3d(c, c, kernel_size=3, padding=1),
+            nn.BatchNorm3d(c),
+            nn.LeakyReLU(),
+            nn.Conv3d(c, out_channels=self.channel_in, kernel_size=3, padding=1),
+            nn.Sigmoid()
+        )
+
+    def encode(self, x):
+        ''' Encodes voxel fields into a latent space representation (mu and log_var).
+        Args:
+            x: input tensor [B*C*D*W*L]
+        Return:
+            mu, log_var: [B*latent_dim]
+        '''
+        x = torch.flatten(self.encoder(x), start_dim=1)
+        return self.fc_mu(x), self.fc_logvar(x)
+
+    def decode(self, z, logits=False):
+        ''' Decodes latent space vectors back into voxel fields.
+        Args:
+            z: latent space vector [B*latent_dim]
+            logits: return the input of the final sigmoid, for lossfunc_logits
+        Return:
+            x_hat: reconstructed fields [B*C*D*W*L], logits if logits is True
+        '''
+        result = self.decoder_input(z).view(-1, *self.decoder_shape)
+        return self._final(self.decoder(result), logits)
+
+    _final = CNN_VAE._final
+    rereparameterize = CNN_VAE.rereparameterize
+    forward = CNN_VAE.forward
+
+
+def lossfunc(x,x_hat,mu,logvar,beta,terms=False):
+    """
+    Computes the Variational Autoencoder (VAE) loss function, combining reconstruction loss and KL divergence.
+
+    Args:
+        x (torch.Tensor): Original input images.
+        x_hat (torch.Tensor): Reconstructed images.
+        mu (torch.Tensor): Mean of the latent variables.
+        logvar (torch.Tensor): Log variance of the latent variables.
+        beta (float): Weight for the KL divergence part of the loss.
+        terms (bool): Also return the reconstruction loss, a metric that does not depend on beta.
+
+    Returns:
+        torch.Tensor: The computed loss value, (loss, reconstruction loss) if terms is True.
+    """
+    recons_loss = nn.functional.binary_cross_entropy(x_hat, x, reduction='sum')
+
+    kl_loss = -0.5 * torch.sum(1 + logvar - mu.pow(2) - logvar.exp())
+    # kl_loss = torch.mean(-0.5 * torch.sum(1 + logvar - mu.pow(2) - logvar.exp(), dim = 1), dim = 0)
+    if terms:
+        return recons_loss + beta* kl_loss, recons_loss
+    return recons_loss + beta* kl_loss
+
+
+def lossfunc_logits(x,logits,mu,logvar,beta,terms=False):
+    """
+    lossfunc computed from the logits of the reconstruction, x_hat = sigmoid(logits): the binary cross entropy
+    is fused with the sigmoid (binary_cross_entropy_with_logits), stable for saturated outputs and without a
+    second full-resolution activation kept for backward. Equal to lossfunc(x, sigmoid(logits), ...) up to
+    rounding, as long as no log(x_hat) is clamped at -100 by binary_cross_entropy.
+
+    Args:
+        x (torch.Tensor): Original input images.
+        logits (torch.Tensor): Logits of the reconstructed images, model(x, logits=True)[0].
+        mu (torch.Tensor): Mean of the latent variables.
+        logvar (torch.Tensor): Log variance of the latent variables.
+        beta (float): Weight for the KL divergence part of the loss.
+        terms (bool): Also return the reconstruction loss, a metric that does not depend on beta.
+
+    Returns:
+        torch.Tensor: The computed loss value, (loss, reconstruction loss) if terms is True.
+    """
+    recons_loss = nn.functional.binary_cross_entropy_with_logits(logits, x, reduction='sum')
+    kl_loss = 0.5 * torch.sum(mu * mu + logvar.exp() - logvar - 1)
+    if terms:
+        return recons_loss + beta * kl_loss, recons_loss
+    return recons_loss + beta * kl_loss
+
+
+@contextmanager
+def _keep_running_stats(module):
+    ''' restore the running statistics of the batch norm layers of module on exit '''
+    norms = [m for m in module.modules() if isinstance(m, nn.modules.batchnorm._BatchNorm) and m.track_running_stats]
+    saved = [[b.clone() for b in (m.running_mean, m.running_var, m.num_batches_tracked)] for m in norms]
+    try:
+        yield
+    finally:
+        with torch.no_grad():
+            for m, (mean, var, n) in zip(norms, saved):
+                m.running_mean.copy_(mean)
+                m.running_var.copy_(var)
+                m.num_batches_tracked.copy_(n)
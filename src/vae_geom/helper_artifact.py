@@ -0,0 +1,297 @@
+'''
+flat, memory-mappable tensor artifacts for model weights and latent tables
+
+An artifact (.tensors) is a header followed by the raw tensor bytes:
+    8 bytes   magic b'VAETNSR1'
+    8 bytes   header length H, little-endian uint64
+    H bytes   JSON header, padded with spaces so the data starts at a multiple of ALIGN
+              {"format_version": 1, "data_bytes": ..., "meta": {...},
+               "tensors": {name: {"dtype": "float32", "shape": [...], "offset": ..., "nbytes": ..., "crc32": ...}}}
+    data      the C-contiguous little-endian bytes of every tensor, each at an offset (from the start of
+              the data) that is a multiple of ALIGN
+Loading memory maps the file copy-on-write and wraps every tensor without copying, so all processes
+of a host that load the same artifact share one copy in the page cache.
+
+    state = load_artifact('VAEmodel_last.tensors')
+    model.load_state_dict(state, assign=True)       # parameters are views of the page cache
+
+    python -m vae_geom.helper_artifact convert VAEmodel_last.pt VAEmodel_last.tensors
+    python -m vae_geom.helper_artifact check VAEmodel_last.tensors
+    python -m vae_geom.helper_artifact bench VAEmodel_last.pt --processes 4
+'''
+import os
+import json
+import time
+import zlib
+import struct
+import argparse
+
+import numpy as np
+import torch
+
+MAGIC = b'VAETNSR1'
+FORMAT_VERSION = 1
+ALIGN = 64
+SUFFIX = '.tensors'
+SEPARATOR = '/' # joins the keys of nested dicts, the keys of a state dict contain '.'
+
+DTYPES = {torch.float32: 'float32', torch.float64: 'float64', torch.float16: 'float16', torch.bfloat16: 'bfloat16',
+          torch.int64: 'int64', torch.int32: 'int32', torch.int16: 'int16', torch.int8: 'int8',
+          torch.uint8: 'uint8', torch.bool: 'bool'}
+# numpy type of the stored bytes, bfloat16 is stored as its 16 bits
+STORAGE = {'float32': np.float32, 'float64': np.float64, 'float16': np.float16, 'bfloat16': np.uint16,
+           'int64': np.int64, 'int32': np.int32, 'int16': np.int16, 'int8': np.int8, 'uint8': np.uint8, 'bool': np.bool_}
+
+
+class ArtifactError(ValueError):
+    ''' a file that is not a valid artifact: wrong magic or version, inconsistent header, truncated or corrupted data '''
+
+
+def is_artifact(path):
+    return isinstance(path, str) and path.endswith(SUFFIX)
+
+
+def _as_tensor(value):
+    if isinstance(value, np.ndarray):
+        value = torch.from_numpy(np.require(value, requirements=['C', 'W'])) # copies read-only memory maps only
+    return value.detach().to('cpu').contiguous()
+
+
+def _storage_bytes(tensor):
+    ''' the bytes of a CPU tensor as a numpy array without copying '''
+    if tensor.dtype == torch.bfloat16:
+        tensor = tensor.view(torch.int16)
+    return tensor.numpy().reshape(-1).view(np.uint8)
+
+
+def flatten(state, prefix=''):
+    '''
+    split a (nested) dict into tensors and JSON values, nested keys joined with SEPARATOR
+    Return:
+        tensors dict name -> tensor, values dict name -> JSON value
+    '''
+    tensors, values = {}, {}
+    for key, value in state.items():
+        name = prefix + str(key)
+        if isinstance(value, dict):
+            t, v = flatten(value, name + SEPARATOR)
+            tensors.update(t)
+            values.update(v)
+        elif torch.is_tensor(value) or isinstance(value, np.ndarray):
+            tensors[name] = _as_tensor(value)
+        else:
+            json.dumps(value) # raises for values that are neither tensors nor JSON
+            values[name] = value
+    return tensors, values
+
+
+def save_artifact(path, tensors, meta=None):
+    '''
+    write tensors to an artifact, atomically (temporary file, fsync, rename)
+    Args:
+        tensors: dict name -> torch tensor or numpy array (e.g. a state dict), or a single tensor saved as 'data'
+        meta: optional JSON-serializable dict stored in the header
+    Return:
+        path
+    '''
+    if not isinstance(tensors, dict):
+        tensors = {'data': tensors}
+    tensors = {name: _as_tensor(t) for name, t in tensors.items()}
+    entries, offset = {}, 0
+    for name, t in tensors.items():
+        if t.dtype not in DTYPES:
+            raise TypeError(f'{name}: unsupported dtype {t.dtype}')
+        data = _storage_bytes(t)
+        entries[name] = {'dtype': DTYPES[t.dtype], 'shape': list(t.shape), 'offset': offset,
+                         'nbytes': int(data.nbytes), 'crc32': zlib.crc32(data)}
+        offset += -(-data.nbytes // ALIGN) * ALIGN
+    header = json.dumps({'format_version': FORMAT_VERSION, 'data_bytes': offset, 'meta': meta or {},
+                         'tensors': entries}).encode()
+    header += b' ' * (-(len(MAGIC) + 8 + len(header)) % ALIGN)
+
+    folder = os.path.dirname(path) or '.'
+    os.makedirs(folder, exist_ok=True)
+    tmp = os.path.join(folder, f'.{os.path.basename(path)}.tmp{os.getpid()}')
+    try:
+        with open(tmp, 'wb') as f:
+            f.write(MAGIC + struct.pack('<Q', len(header)) + header)
+            for name, t in tensors.items():
+                data = _storage_bytes(t)
+                f.write(data.tobytes())
+                f.write(b'\0' * (-data.nbytes % ALIGN))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return path
+
+
+def read_header(path):
+    '''
+    header of an artifact, checked against the file size
+    Return:
+        header dict, byte offset of the data in the file
+    '''
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        prefix = f.read(len(MAGIC) + 8)
+        if len(prefix) < len(MAGIC) + 8 or prefix[:len(MAGIC)] != MAGIC:
+            raise ArtifactError(f'{path} is not an artifact (magic {prefix[:len(MAGIC)]!r})')
+        length, = struct.unpack('<Q', prefix[len(MAGIC):])
+        if len(prefix) + length > size:
+            raise ArtifactError(f'{path}: truncated header')
+        try:
+            header = json.loads(f.read(length))
+        except (json.JSONDecodeError, UnicodeDecodeError) as e:
+            raise ArtifactError(f'{path}: corrupted header') from e
+    if header.get('format_version') != FORMAT_VERSION:
+        raise ArtifactError(f'{path}: unsupported format version {header.get("format_version")}')
+    start = len(MAGIC) + 8 + length
+    if start % ALIGN or start + header['data_bytes'] != size:
+        raise ArtifactError(f'{path}: {size} bytes, the header describes {start + header["data_bytes"]}')
+    for name, entry in header['tensors'].items():
+        expected = int(np.prod(entry['shape'], dtype=np.int64)) * np.dtype(STORAGE[entry['dtype']]).itemsize
+        if entry['offset'] % ALIGN or entry['nbytes'] != expected or entry['offset'] + entry['nbytes'] > header['data_bytes']:
+            raise ArtifactError(f'{path}: inconsistent entry of {name}')
+    return header, start
+
+
+def load_artifact(path, verify=True, names=None, meta=False):
+    '''
+    memory map an artifact, the tensors are views of the file (copy-on-write: writing to a tensor changes
+    the private copy of its pages, never the file)
+    Args:
+        verify: check the crc32 of every tensor loaded, reads the whole data once
+        names: tensors loaded, default all
+        meta: also return the header meta
+    Return:
+        dict name -> CPU tensor (and the meta dict)
+    '''
+    header, start = read_header(path)
+    data = np.memmap(path, dtype=np.uint8, mode='c', offset=start) if header['data_bytes'] else np.empty(0, np.uint8)
+    tensors = {}
+    for name in header['tensors'] if names is None else names:
+        entry = header['tensors'][name]
+        raw = data[entry['offset']:entry['offset'] + entry['nbytes']]
+        if verify and zlib.crc32(raw) != entry['crc32']:
+            raise ArtifactError(f'{path}: checksum mismatch of {name}')
+        array = raw.view(STORAGE[entry['dtype']]).reshape(entry['shape'])
+        tensor = torch.from_numpy(array)
+        tensors[name] = tensor.view(torch.bfloat16) if entry['dtype'] == 'bfloat16' else tensor
+    return (tensors, header['meta']) if meta else tensors
+
+
+def unflatten(tensors, values=None):
+    ''' the nested dict of flatten '''
+    state = {}
+    for name, value in list(tensors.items()) + list((values or {}).items()):
+        *parents, key = name.split(SEPARATOR)
+        target = state
+        for parent in parents:
+            target = target.setdefault(parent, {})
+        target[key] = value
+    return state
+
+
+def load_state_dict(path, map_location='cpu', verify=True):
+    '''
+    state dict of a model file: an artifact is memory mapped (load it with model.load_state_dict(state, assign=True)
+    to keep the parameters in the page cache), anything else is read with torch.load
+    '''
+    if is_artifact(path):
+        state = load_artifact(path, verify=verify)
+        return state if map_location in (None, 'cpu') else {k: v.to(map_location) for k, v in state.items()}
+    return torch.load(path, map_location=map_location)
+
+
+def convert(src, dst=None, verify=True):
+    '''
+    convert a torch.save file (state dict, checkpoint dict, tensor) or a .npy array to an artifact;
+    nested dicts are flattened with SEPARATOR, their non-tensor values are kept in the meta
+    Return:
+        path of the artifact
+    '''
+    dst = dst or os.path.splitext(src)[0] + SUFFIX
+    if src.endswith('.npy'):
+        obj = np.load(src, mmap_mode='r')
+    else:
+        obj = torch.load(src, map_location='cpu', weights_only=False)
+    if isinstance(obj, dict):
+        tensors, values = flatten(obj)
+    else:
+        tensors, values = {'data': _as_tensor(np.asarray(obj) if isinstance(obj, np.memmap) else obj)}, {}
+    save_artifact(dst, tensors, {'source': os.path.basename(src), 'values': values})
+    if verify: # the round trip is exact
+        loaded = load_artifact(dst)
+        for name, t in tensors.items():
+            if not torch.equal(loaded[name], t):
+                raise ArtifactError(f'{dst}: {name} differs from {src}')
+    return dst
+
+
+def _rss_mb():
+    ''' anonymous (private heap) and file-backed (page cache, shared) resident memory in MB, Linux only '''
+    rss = {}
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(('RssAnon:', 'RssFile:')):
+                rss[line.split(':')[0]] = int(line.split()[1]) / 1024.
+    return rss['RssAnon'], rss['RssFile']
+
+
+def _rss_child(path, conn):
+    ''' loads a model file in a separate process and reports the load time and the memory it added '''
+    anon, file = _rss_mb()
+    t0 = time.perf_counter()
+    state = load_state_dict(path, verify=False)
+    for t in state.values(): # touch every page, as a forward pass does
+        if t.numel():
+            float(t.reshape(-1)[::max(1, 4096 // t.element_size())].float().sum())
+    seconds = time.perf_counter() - t0
+    anon_after, file_after = _rss_mb()
+    conn.send((seconds, anon_after - anon, file_after - file))
+    conn.recv() # keep the mapping alive until all processes have reported
+    conn.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='command', required=True)
+    conv = sub.add_parser('convert', help='convert .pt / .npy files to artifacts')
+    conv.add_argument('src', nargs='+')
+    conv.add_argument('--out', default=None, help='output path, only with a single source')
+    check = sub.add_parser('check', help='verify the header and checksums of artifacts')
+    check.add_argument('paths', nargs='+')
+    bench = sub.add_parser('bench', help='load time and memory of N processes, torch.load against the artifact')
+    bench.add_argument('src', help='.pt file, converted to a temporary artifact')
+    bench.add_argument('--processes', type=int, default=4)
+    args = parser.parse_args()
+
+    if args.command == 'convert':
+        for src in args.src:
+            print(convert(src, args.out if len(args.src) == 1 else None))
+    elif args.command == 'check':
+        for path in args.paths:
+            tensors, meta = load_artifact(path, meta=True)
+            print(f'{path}: ok, {len(tensors)} tensors, {sum(t.numel() * t.element_size() for t in tensors.values())} bytes')
+    else:
+        import tempfile
+        import multiprocessing
+        with tempfile.TemporaryDirectory() as tmp:
+            artifact = convert(args.src, os.path.join(tmp, 'model' + SUFFIX))
+            for path in (args.src, artifact):
+                context = multiprocessing.get_context('spawn')
+                pipes = [context.Pipe() for _ in range(args.processes)]
+                procs = [context.Process(target=_rss_child, args=(path, child)) for _, child in pipes]
+                for p in procs:
+                    p.start()
+                reports = [parent.recv() for parent, _ in pipes]
+                for parent, _ in pipes:
+                    parent.send(None)
+                for p in procs:
+                    p.join()
+                seconds, private, shared = (np.mean([r[k] for r in reports]) for k in range(3))
+                print(f'{os.path.basename(path):24s} load {1000 * seconds:7.1f} ms   per process: private +{private:7.1f} MB'
+                      f'   page cache (shared) +{shared:7.1f} MB   ({args.processes} processes)')
@@ -0,0 +1,182 @@
+'''
+asynchronous, atomic checkpoint and artifact writing
+
+State is snapshotted to the CPU on the training thread and written by a background thread, so the
+training loop only blocks for the device-to-host copy. Every file is written to a temporary file in the
+same folder and renamed into place, so a crash never leaves a truncated checkpoint behind.
+'''
+import os
+import re
+import glob
+import queue
+import threading
+
+import torch
+
+CHECKPOINT_PATTERN = 'checkpoint_{epoch:06d}.tar'
+
+
+def to_cpu(obj):
+    '''
+    snapshot of a (nested) state: every tensor is copied to the CPU, containers are copied
+    '''
+    if torch.is_tensor(obj):
+        return obj.detach().to('cpu', copy=True)
+    if isinstance(obj, dict):
+        return type(obj)((k, to_cpu(v)) for k, v in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(to_cpu(v) for v in obj)
+    return obj
+
+
+def atomic_save(obj, path):
+    '''
+    torch.save to a temporary file next to path, fsync, then rename it to path
+    '''
+    folder = os.path.dirname(path) or '.'
+    os.makedirs(folder, exist_ok=True)
+    tmp = os.path.join(folder, f'.{os.path.basename(path)}.tmp{os.getpid()}')
+    try:
+        with open(tmp, 'wb') as f:
+            torch.save(obj, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def list_checkpoints(folder):
+    '''
+    Return:
+        list of (epoch, path) of the periodic checkpoints in folder, newest first
+    '''
+    found = []
+    for path in glob.glob(os.path.join(folder, 'checkpoint_*.tar')):
+        match = re.fullmatch(r'checkpoint_(\d+)\.tar', os.path.basename(path))
+        if match:
+            found.append((int(match.group(1)), path))
+    return sorted(found, reverse=True)
+
+
+def load_latest_checkpoint(folder, map_location='cpu', legacy='checkpoint.tar'):
+    '''
+    load the newest checkpoint of folder that can be read and has model and optimizer states;
+    the single checkpoint.tar of older runs is used as fallback
+    Return:
+        the checkpoint dict, or None if there is no valid checkpoint
+    '''
+    candidates = [path for _, path in list_checkpoints(folder)]
+    if legacy is not None:
+        candidates.append(os.path.join(folder, legacy))
+    for path in candidates:
+        if not os.path.exists(path):
+            continue
+        try:
+            checkpoint = torch.load(path, map_location=map_location)
+        except Exception as e: # unreadable file, try the next older one
+            print(f'skipping checkpoint {path}: {e}')
+            continue
+        if isinstance(checkpoint, dict) and {'model_state_dict', 'optimizer_state_dict', 'epoch'} <= set(checkpoint):
+            checkpoint['path'] = path
+            return checkpoint
+    return None
+
+
+class CheckpointWriter:
+    """Background writer of checkpoints and artifacts with keep-last-K retention.
+
+    `save` and `save_checkpoint` snapshot their state to the CPU immediately and return; the files are
+    written atomically by one background thread, in submission order. Errors of the writer thread are
+    raised by the next call to `save`, `save_checkpoint`, `wait` or `close`.
+
+    Attributes:
+        folder (str): Folder of the periodic checkpoints.
+        keep_last (int): Number of periodic checkpoints kept, older ones are deleted. None keeps all.
+
+    Args:
+        folder (str): Folder of the periodic checkpoints.
+        keep_last (int, optional): Default is 3.
+        max_pending (int): Maximum number of queued writes before `save` blocks, bounds the memory
+            held by snapshots. Default is 2.
+    """
+    def __init__(self, folder, keep_last=3, max_pending=2):
+        self.folder = folder
+        self.keep_last = keep_last
+        os.makedirs(folder, exist_ok=True)
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._error = None
+        self._thread = threading.Thread(target=self._loop, name='CheckpointWriter', daemon=True)
+        self._thread.start()
+
+    def _loop(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                save_fn, obj, path, prune = job
+                if self._error is None:
+                    save_fn(obj, path)
+                    if prune:
+                        self._prune()
+            except Exception as e:
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _prune(self):
+        if self.keep_last is None:
+            return
+        for _, path in list_checkpoints(self.folder)[self.keep_last:]:
+            os.remove(path)
+
+    def _raise(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise RuntimeError('background checkpoint write failed') from error
+
+    def save(self, obj, path):
+        '''
+        write obj to path in the background (torch.save format), tensors are snapshotted to the CPU first
+        '''
+        self._raise()
+        self._queue.put((atomic_save, to_cpu(obj), path, False))
+
+    def save_artifact(self, tensors, path, meta=None):
+        '''
+        write a dict of tensors (e.g. a state dict) to a memory-mappable artifact in the background, see helper_artifact
+        '''
+        from .helper_artifact import save_artifact
+        self._raise()
+        self._queue.put((lambda obj, path: save_artifact(path, obj, meta), to_cpu(tensors), path, False))
+
+    def save_checkpoint(self, epoch, model_state, optimizer_state, **extra):
+        '''
+        write a periodic checkpoint of a completed epoch and apply the retention
+        Args:
+            epoch: the completed epoch
+            model_state: model.state_dict()
+            optimizer_state: optimizer.state_dict()
+            extra: further entries, e.g. loss
+        Return:
+            path of the checkpoint
+        '''
+        state = {'epoch': epoch, 'model_state_dict': model_state, 'optimizer_state_dict': optimizer_state,
+                 'rng_state': torch.get_rng_state()}
+        state.update(extra)
+        path = os.path.join(self.folder, CHECKPOINT_PATTERN.format(epoch=epoch))
+        self._raise()
+        self._queue.put((atomic_save, to_cpu(state), path, True))
+        return path
+
+    def wait(self):
+        ''' block until every queued write is on disk '''
+        self._queue.join()
+        self._raise()
+
+    def close(self):
+        self.wait()
+        self._queue.put(None)
+        self._thread.join()
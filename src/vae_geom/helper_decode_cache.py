@@ -0,0 +1,149 @@
+'''
+LRU cache of decoded unit cells in front of CNN_VAE.decode
+
+Latent vectors are quantized to a grid of spacing `tolerance`; all vectors in one grid cell share
+one decoded field, which is decoded at the cell center so the result does not depend on the order
+of the requests.
+'''
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import torch
+
+
+def quantize_latent(z, tolerance):
+    '''
+    Args:
+        z: latent vectors [B*latent_dim]
+        tolerance: grid spacing of the quantization
+    Return:
+        integer grid codes [B*latent_dim] as int64 numpy array
+    '''
+    z = torch.as_tensor(z).detach().to('cpu', torch.float64).numpy()
+    return np.round(z / tolerance).astype(np.int64)
+
+
+class DecodeCache:
+    """Byte-budgeted LRU cache of decoded fields, keyed on quantized latent vectors.
+
+    A batch is split into hits and misses, only the distinct misses are decoded in one call,
+    and the results are scattered back to the positions of the batch.
+
+    Attributes:
+        decode_fn (callable): Decodes latent vectors [B*latent_dim] to fields [B*C*W*L].
+        tolerance (float): Grid spacing used to quantize the latent vectors.
+        max_bytes (int): Upper bound of the memory held by the cached fields.
+        hits, misses, evictions (int): Counters since the last `reset_stats`.
+
+    Args:
+        decode_fn (callable): e.g. `model.decode` of an eval-mode CNN_VAE, or `DecodeServer.decode`.
+        tolerance (float): Default is 1e-3.
+        max_bytes (int): Default is 256 MB.
+        device: Device the cached fields are kept on. Default is the CPU.
+    """
+    def __init__(self, decode_fn, tolerance=1e-3, max_bytes=256 * 2**20, device='cpu'):
+        self.decode_fn = decode_fn
+        self.tolerance = tolerance
+        self.max_bytes = max_bytes
+        self.device = torch.device(device)
+        self._store = OrderedDict()
+        self._lock = threading.Lock()
+        self.nbytes = 0
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = self.misses = self.evictions = 0
+
+    def clear(self):
+        with self._lock:
+            self._store.clear()
+            self.nbytes = 0
+
+    def __len__(self):
+        return len(self._store)
+
+    def stats(self):
+        '''
+        Return:
+            dict with hits, misses, evictions, hit_rate, entries and bytes
+        '''
+        with self._lock:
+            total = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'hit_rate': self.hits / total if total else 0.,
+                    'entries': len(self._store), 'bytes': self.nbytes}
+
+    def decode(self, z):
+        '''
+        decode through the cache
+        Args:
+            z: latent vectors [B*latent_dim]
+        Return:
+            decoded fields [B*C*W*L] on the cache device
+        '''
+        z = torch.as_tensor(z)
+        codes = quantize_latent(z, self.tolerance)
+        keys = [row.tobytes() for row in codes]
+        found = [None] * len(keys)
+        with self._lock:
+            for i, key in enumerate(keys):
+                value = self._store.get(key)
+                if value is not None:
+                    self._store.move_to_end(key)
+                    found[i] = value
+            miss = [i for i, value in enumerate(found) if value is None]
+            self.hits += len(keys) - len(miss)
+            self.misses += len(miss)
+
+        if miss:
+            # decode every distinct missing grid cell once, at its center
+            unique_codes, inverse = np.unique(codes[miss], axis=0, return_inverse=True)
+            inverse = inverse.reshape(-1)
+            z_center = torch.from_numpy(unique_codes * self.tolerance).to(z.device, torch.float32)
+            with torch.inference_mode():
+                decoded = self.decode_fn(z_center).to(self.device)
+            for i, j in zip(miss, inverse):
+                found[i] = decoded[j]
+            with self._lock:
+                for j, row in enumerate(unique_codes):
+                    self._insert(row.tobytes(), decoded[j].clone())
+        return torch.stack(found)
+
+    __call__ = decode
+
+    def _insert(self, key, value):
+        if key in self._store:
+            self._store.move_to_end(key)
+            return
+        size = value.element_size() * value.nelement()
+        if size > self.max_bytes:
+            return
+        self._store[key] = value
+        self.nbytes += size
+        while self.nbytes > self.max_bytes:
+            _, old = self._store.popitem(last=False)
+            self.nbytes -= old.element_size() * old.nelement()
+            self.evictions += 1
+
+
+def tolerance_error(decode_fn, z, tolerances):
+    '''
+    accuracy lost by quantizing the latent vectors, to choose the cache tolerance
+    Args:
+        decode_fn: decodes latent vectors [B*latent_dim] to fields [B*C*W*L]
+        z: representative latent vectors [B*latent_dim], e.g. from mu_list
+        tolerances: list of grid spacings
+    Return:
+        list of dicts with tolerance, max and mean absolute field error against the exact decode
+    '''
+    z = torch.as_tensor(z, dtype=torch.float32)
+    with torch.inference_mode():
+        exact = decode_fn(z)
+        out = []
+        for tol in tolerances:
+            z_q = torch.from_numpy(quantize_latent(z, tol) * tol).to(z.device, torch.float32)
+            err = (decode_fn(z_q) - exact).abs()
+            out.append({'tolerance': tol, 'max_error': err.max().item(), 'mean_error': err.mean().item()})
+    return out
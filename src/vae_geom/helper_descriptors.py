@@ -0,0 +1,268 @@
+'''
+batched geometric descriptors of decoded unit cells
+
+The descriptors of the optimizer constraints are computed in torch for a whole batch of fields
+[B*C*W*L] (or voxel fields [B*C*D*W*L]) on the device they were decoded on, the solid phase of
+a channel is where the field is above the isovalue:
+    volume_fraction   fraction of solid cells                           differentiable variant
+    perimeter         interface length (surface area in 3D), unit cell side = 1   differentiable variant
+    min_feature_size  diameter in pixels of the largest disc that fits everywhere in the solid
+    components        number of connected solid regions (face connectivity)
+
+    desc = descriptors(model.decode(z), isovalue=0.5)             # dict of [B*C] tensors
+    vf = volume_fraction(model.decode(z), differentiable=True)    # gradients w.r.t. z
+
+    python -m vae_geom.helper_descriptors --batch-size 64 256   # compare with the per-cell numpy baseline
+'''
+import time
+import argparse
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+DESCRIPTORS = ('volume_fraction', 'perimeter', 'min_feature_size', 'components')
+
+
+def solid(x, isovalue=0.5, differentiable=False, sharpness=50.):
+    '''
+    indicator of the solid phase
+    Args:
+        x: fields [B*C*...]
+        differentiable: smooth indicator sigmoid(sharpness * (x - isovalue)) instead of the step
+    '''
+    if differentiable:
+        return torch.sigmoid(sharpness * (x - isovalue))
+    return (x > isovalue).to(x.dtype)
+
+
+def volume_fraction(x, isovalue=0.5, differentiable=False, sharpness=50.):
+    ''' fraction of solid cells [B*C] '''
+    return solid(x, isovalue, differentiable, sharpness).flatten(2).mean(dim=2)
+
+
+def perimeter(x, isovalue=0.5, differentiable=False, sharpness=50., periodic=False):
+    '''
+    interface length (surface area for voxel fields) in units of the unit cell side, the number of
+    neighbouring cell pairs of different phase times the cell face size; with the smooth indicator it
+    is the total variation of the indicator
+    Args:
+        periodic: count the faces across the boundary of the unit cell as well
+    Return:
+        [B*C]
+    '''
+    s = solid(x, isovalue, differentiable, sharpness)
+    total = 0.
+    for d in range(2, x.dim()):
+        diff = s - torch.roll(s, 1, dims=d) if periodic else torch.diff(s, dim=d)
+        total = total + diff.abs().flatten(2).sum(dim=2)
+    return total / x.shape[-1] ** (x.dim() - 3) # a face is (1/W)^(dim-1), W cells of size 1/W per side
+
+
+def _ball(radius, dim, device):
+    ''' mask of the cells within radius + 1/2 of the center, [2r+1]*dim '''
+    r = torch.arange(-radius, radius + 1, device=device, dtype=torch.float32)
+    grids = torch.meshgrid(*([r] * dim), indexing='ij')
+    return (sum(g ** 2 for g in grids) <= radius ** 2 + radius).float() # the r + 1/2 digital ball, r=1 is the full 3x3
+
+
+def _opening(s, radius):
+    ''' morphological opening of the indicator s [N*1*...] with a ball, erosion and dilation as convolutions '''
+    dim = s.dim() - 2
+    conv = F.conv2d if dim == 2 else F.conv3d
+    kernel = _ball(radius, dim, s.device)[None, None]
+    eroded = (conv(s, kernel, padding=radius) >= kernel.sum() - 0.5).float()
+    return (conv(eroded, kernel, padding=radius) > 0.5).float()
+
+
+def min_feature_size(x, isovalue=0.5, max_radius=8, tol=0.01):
+    '''
+    minimum feature size of the solid phase in cells: the diameter 2r+1 of the largest ball for which the
+    opening removes at most tol of the solid, i.e. every solid cell is covered by a ball of that size
+    inside the solid; the solid outside the field counts as void. Not differentiable.
+    Args:
+        max_radius: largest ball radius tested, cells with thicker features get 2*max_radius+1
+        tol: fraction of the solid the opening may remove, the corners of the pixel staircase; with 0 nearly
+             every cell has size 1
+    Return:
+        [B*C], 0 for cells without solid
+    '''
+    shape = x.shape[:2]
+    s = solid(x, isovalue).flatten(0, 1).unsqueeze(1).float()
+    area = s.flatten(1).sum(dim=1)
+    size = torch.where(area > 0, torch.ones_like(area), torch.zeros_like(area))
+    active = area > 0 # cells whose features fit all balls so far
+    for radius in range(1, max_radius + 1):
+        if not active.any():
+            break
+        idx = active.nonzero().squeeze(1)
+        removed = (s[idx] - _opening(s[idx], radius)).clamp(min=0).flatten(1).sum(dim=1)
+        fits = removed <= tol * area[idx]
+        size[idx[fits]] = 2 * radius + 1
+        active[idx[~fits]] = False
+    return size.view(shape)
+
+
+def _runs(mask, d):
+    '''
+    id of the run of solid cells along dimension d every cell belongs to, 0 for void, [rows*length]
+    with dimension d moved last
+    '''
+    m = mask.movedim(d, -1).reshape(-1, mask.shape[d])
+    start = m.clone()
+    start[:, 1:] &= ~m[:, :-1] # a run starts at a solid cell without a solid predecessor in its row
+    return torch.cumsum(start.flatten(), 0).view(m.shape) * m
+
+
+def _run_max(labels, run, d):
+    '''
+    maximum label of every run of solid cells along dimension d (run ids of _runs), written to all
+    cells of the run, one scatter for the whole batch
+    '''
+    moved = labels.movedim(d, -1)
+    flat = moved.reshape(run.shape)
+    run_max = torch.zeros(int(run.max()) + 1, device=labels.device, dtype=labels.dtype)
+    run_max = run_max.scatter_reduce(0, run.flatten(), flat.flatten(), 'amax')
+    out = torch.where(run > 0, run_max[run], flat)
+    return out.view(moved.shape).movedim(-1, d)
+
+
+def components(x, isovalue=0.5, periodic=False, max_iters=None):
+    '''
+    number of face-connected solid regions, by propagating the largest cell index through every region
+    for the whole batch at once, along whole runs of solid cells per step, so the number of steps grows
+    with the number of turns of a region rather than its length; a region is counted at the cell that
+    keeps its own index. Not differentiable.
+    Args:
+        periodic: regions connected across the unit cell boundary are one region
+        max_iters: bound of the propagation steps, default the number of cells (always converges)
+    Return:
+        [B*C] counts (float)
+    '''
+    shape = x.shape[:2]
+    mask = (x > isovalue).flatten(0, 1)
+    index = torch.arange(1, mask[0].numel() + 1, device=x.device, dtype=torch.float32).view(mask.shape[1:])
+    own = torch.where(mask, index, torch.zeros((), device=x.device))
+    labels = own
+    runs = [_runs(mask, d) for d in range(1, mask.dim())]
+    for _ in range(max_iters or mask[0].numel()):
+        new = labels
+        for d, run in enumerate(runs, 1):
+            new = _run_max(new, run, d)
+            if periodic: # runs touching both sides of the unit cell
+                for shift in (1, -1):
+                    neighbour = torch.roll(new, shift, dims=d) * torch.roll(mask, shift, dims=d)
+                    new = torch.where(mask, torch.maximum(new, neighbour), new)
+        if torch.equal(new, labels):
+            break
+        labels = new
+    return ((labels == own) & mask).flatten(1).sum(dim=1).float().view(shape)
+
+
+def descriptors(x, isovalue=0.5, names=DESCRIPTORS, differentiable=False, sharpness=50., periodic=False, max_radius=8,
+                tol=0.01):
+    '''
+    descriptors of a batch of decoded fields in one call, e.g. descriptors(model.decode(z))
+    Args:
+        x: fields [B*C*W*L] or [B*C*D*W*L], any device
+        names: descriptors computed, subset of DESCRIPTORS
+        differentiable: smooth volume fraction and perimeter, the others stay exact
+        sharpness, periodic, max_radius, tol: see solid, perimeter and min_feature_size
+    Return:
+        dict name -> [B*C] tensor
+    '''
+    fns = {'volume_fraction': lambda: volume_fraction(x, isovalue, differentiable, sharpness),
+           'perimeter': lambda: perimeter(x, isovalue, differentiable, sharpness, periodic),
+           'min_feature_size': lambda: min_feature_size(x.detach(), isovalue, max_radius, tol),
+           'components': lambda: components(x.detach(), isovalue, periodic)}
+    unknown = set(names) - set(fns)
+    if unknown:
+        raise ValueError(f'unknown descriptors {sorted(unknown)}, use {DESCRIPTORS}')
+    return {name: fns[name]() for name in names}
+
+
+def _cell_descriptors(field, isovalue=0.5, max_radius=8, tol=0.01):
+    '''
+    per-cell numpy baseline of one field [W*L]: volume fraction, perimeter, minimum feature size, components,
+    the same definitions (non-periodic) as the batched functions
+    '''
+    s = field > isovalue
+    vf = s.mean()
+    per = (np.abs(np.diff(s.astype(np.int8), axis=0)).sum() + np.abs(np.diff(s.astype(np.int8), axis=1)).sum()) / s.shape[-1]
+    area = s.sum()
+    size = 1 if area else 0
+    for radius in range(1, max_radius + 1):
+        if not area:
+            break
+        ball = _ball(radius, 2, 'cpu').numpy().astype(bool)
+        offsets = np.argwhere(ball) - radius
+        padded = np.pad(s, radius)
+        h, w = s.shape
+        eroded = np.ones_like(s)
+        for dy, dx in offsets:
+            eroded &= padded[radius + dy:radius + dy + h, radius + dx:radius + dx + w]
+        padded = np.pad(eroded, radius)
+        opened = np.zeros_like(s)
+        for dy, dx in offsets:
+            opened |= padded[radius + dy:radius + dy + h, radius + dx:radius + dx + w]
+        if (s & ~opened).sum() > tol * area:
+            break
+        size = 2 * radius + 1
+    # flood fill labelling
+    labels = np.zeros(s.shape, dtype=np.int32)
+    count = 0
+    for i, j in zip(*np.nonzero(s)):
+        if labels[i, j]:
+            continue
+        count += 1
+        stack = [(i, j)]
+        labels[i, j] = count
+        while stack:
+            a, b = stack.pop()
+            for c, d in ((a + 1, b), (a - 1, b), (a, b + 1), (a, b - 1)):
+                if 0 <= c < s.shape[0] and 0 <= d < s.shape[1] and s[c, d] and not labels[c, d]:
+                    labels[c, d] = count
+                    stack.append((c, d))
+    return vf, per, size, count
+
+
+def baseline_descriptors(x, isovalue=0.5, max_radius=8, tol=0.01):
+    ''' the per-cell loop: every field is copied to the host and measured in numpy, [B*C*4] array '''
+    out = np.empty(tuple(x.shape[:2]) + (4,))
+    for b in range(x.shape[0]):
+        for c in range(x.shape[1]):
+            out[b, c] = _cell_descriptors(x[b, c].detach().cpu().numpy(), isovalue, max_radius, tol)
+    return out
+
+
+if __name__ == '__main__':
+    from .benchmark_model import smooth_fields
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--batch-size', type=int, nargs='+', default=[64, 256])
+    parser.add_argument('--resolution', type=int, default=90)
+    parser.add_argument('--isovalue', type=float, default=0.5)
+    parser.add_argument('--max-radius', type=int, default=8)
+    parser.add_argument('--device', default='cuda' if torch.cuda.is_available() else 'cpu')
+    args = parser.parse_args()
+
+    for batch_size in args.batch_size:
+        x = smooth_fields(batch_size, resolution=args.resolution).to(args.device)
+        t0 = time.perf_counter()
+        desc = descriptors(x, args.isovalue, max_radius=args.max_radius)
+        if x.is_cuda:
+            torch.cuda.synchronize()
+        t_batched = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        ref = baseline_descriptors(x, args.isovalue, args.max_radius)
+        t_baseline = time.perf_counter() - t0
+        mismatch = {name: float(np.abs(desc[name].cpu().numpy() - ref[..., k]).max()) for k, name in enumerate(DESCRIPTORS)}
+        print(f'B={batch_size}  batched {1000 * t_batched:9.1f} ms   per-cell baseline {1000 * t_baseline:9.1f} ms'
+              f'   speed-up {t_baseline / t_batched:6.1f}x   max difference {mismatch}')
+        # gradient of the smooth constraints through the fields
+        x.requires_grad_(True)
+        smooth = descriptors(x, args.isovalue, names=('volume_fraction', 'perimeter'), differentiable=True)
+        (smooth['volume_fraction'].sum() + smooth['perimeter'].sum()).backward()
+        vf_error = (smooth['volume_fraction'] - desc['volume_fraction']).detach().abs().max()
+        print(f'      smooth volume fraction error {float(vf_error):.4f}'
+              f'   gradient norm {float(x.grad.norm()):.3f}')
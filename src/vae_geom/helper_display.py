@@ -0,0 +1,269 @@
+'''
+display and headless rendering of unit-cell fields
+
+`montage` composes input / reconstruction grids of a whole batch into one RGB image with numpy only,
+`save_png` writes it without matplotlib or a display, so both can be called from the training loop:
+
+    save_montage(x, x_hat, './checkpoints/montage/epoch_40.png', n=16)
+
+    python -m vae_geom.helper_display --batch-size 16 64  # time montage + PNG against the matplotlib figures
+'''
+import os
+import zlib
+import time
+import struct
+import argparse
+
+import numpy as np
+
+# '1,0,0 red' '0,0,1 blue' '1,1,1 white ' '0,1,0' green,'0,0,0' black
+CHANNEL_COLORS = np.array([[1, 0, 0], [0, 0, 1], [1, 1, 1], [0, 1, 0], [0, 0, 0]], dtype=np.float32)
+
+
+def make_bitmap2(image):
+    """
+    Converts digital image data into a bitmap with a specific color map.
+
+    Args:
+        image (numpy.ndarray): An image represented as a 3D numpy array of shape (n, n, p), where n is the
+                               dimension of the image, and p is the number of color channels.
+
+    Returns:
+        numpy.ndarray: The color-mapped image data as a numpy array.
+    """
+    # the first three channels weighted by red, blue and white in one product, transposed as before
+    return (image[:, :, :3] @ CHANNEL_COLORS[:3].astype(np.float64)).transpose(1, 0, 2)
+
+
+def normalize(data):
+    ''' data is the W*H*C numpy data
+    '''
+    min_vals = np.min(data, axis=(0, 1), keepdims=True)
+    max_vals = np.max(data, axis=(0, 1), keepdims=True)
+    data_scaled = (data - min_vals) / (max_vals - min_vals)
+
+    return data_scaled
+
+
+def to_numpy(images):
+    ''' [B*C*H*W] torch tensor (any device) or numpy array as a float32 numpy array '''
+    if hasattr(images, 'detach'):
+        images = images.detach().float().cpu().numpy()
+    return np.asarray(images, dtype=np.float32)
+
+
+def colorize(images, normalize_samples=False):
+    '''
+    channel color map of a batch in one vectorized op: channel j is weighted by CHANNEL_COLORS[j] and the
+    weighted channels are summed (as make_bitmap2); a single channel is shown in gray
+    Args:
+        images: [B*C*H*W] values in [0,1], torch tensor or numpy array
+        normalize_samples: rescale every channel of every sample to [0,1] first
+    Return:
+        uint8 RGB images [B*H*W*3]
+    '''
+    images = to_numpy(images)
+    if normalize_samples:
+        lo = images.min(axis=(2, 3), keepdims=True)
+        hi = images.max(axis=(2, 3), keepdims=True)
+        images = (images - lo) / np.maximum(hi - lo, 1e-12)
+    if images.shape[1] == 1:
+        colors = np.ones((1, 3), dtype=np.float32)
+    else:
+        colors = CHANNEL_COLORS[:min(images.shape[1], len(CHANNEL_COLORS))]
+    rgb = np.einsum('bchw,ck->bhwk', images[:, :len(colors)], colors)
+    return (np.clip(rgb, 0., 1.) * 255. + 0.5).astype(np.uint8)
+
+
+def montage(x, x_hat=None, n=None, ncols=8, pad=2, pad_value=255, error=False, normalize_samples=False):
+    '''
+    one RGB image of a batch: rows of ncols inputs, each followed by the row of their reconstructions
+    (and optionally the absolute error, in gray); of voxel fields the middle slice along D is shown
+    Args:
+        x: inputs [B*C*H*W] or voxel fields [B*C*D*H*W], torch tensor or numpy array
+        x_hat: reconstructions of the same shape, optional
+        n: number of samples shown, default all
+        ncols: samples per row
+        pad: pixels between the tiles
+        error: add a row with the absolute error averaged over the channels, only with x_hat
+    Return:
+        uint8 image [nrows*panels*(H+pad)+pad, ncols*(W+pad)+pad, 3] with nrows = ceil(n/ncols) and
+        panels = 1 for x alone, 2 with x_hat, 3 with x_hat and error
+    '''
+    if x.ndim == 5: # [B*C*D*H*W], middle slice
+        x = x[:, :, x.shape[2] // 2]
+        x_hat = None if x_hat is None else x_hat[:, :, x_hat.shape[2] // 2]
+    n = len(x) if n is None else min(n, len(x))
+    x = to_numpy(x[:n])
+    panels = [colorize(x, normalize_samples)]
+    if x_hat is not None:
+        x_hat = to_numpy(x_hat[:n])
+        panels.append(colorize(x_hat, normalize_samples))
+        if error:
+            panels.append(colorize(np.abs(x - x_hat).mean(axis=1, keepdims=True)))
+    ncols = min(ncols, n)
+    nrows = -(-n // ncols)
+    h, w = x.shape[2:]
+    tiles = np.full((nrows * ncols, len(panels), h + pad, w + pad, 3), pad_value, dtype=np.uint8)
+    for p, panel in enumerate(panels):
+        tiles[:n, p, pad:, pad:] = panel
+    # [row, col, panel, H, W, 3] -> [row, panel, H, col, W, 3]: every grid row holds one panel row per kind
+    grid = tiles.reshape(nrows, ncols, len(panels), h + pad, w + pad, 3).transpose(0, 2, 3, 1, 4, 5)
+    grid = grid.reshape(nrows * len(panels) * (h + pad), ncols * (w + pad), 3)
+    return np.pad(grid, ((0, pad), (0, pad), (0, 0)), constant_values=pad_value)
+
+
+def save_png(image, path, level=1):
+    '''
+    write an RGB [H*W*3] or gray [H*W] uint8 image as PNG, with zlib only (no matplotlib, no display)
+    Args:
+        level: zlib compression level 0-9, the fast level 1 by default
+    Return:
+        path
+    '''
+    image = np.ascontiguousarray(image, dtype=np.uint8)
+    color_type = 2 if image.ndim == 3 else 0
+    h, w = image.shape[:2]
+    raw = np.zeros((h, 1 + image[0].size), dtype=np.uint8) # filter type 0 at the start of every scanline
+    raw[:, 1:] = image.reshape(h, -1)
+
+    def chunk(tag, data):
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff)
+
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        f.write(chunk(b'IHDR', struct.pack('>IIBBBBB', w, h, 8, color_type, 0, 0, 0)))
+        f.write(chunk(b'IDAT', zlib.compress(raw.tobytes(), level)))
+        f.write(chunk(b'IEND', b''))
+    return path
+
+
+def save_montage(x, x_hat, path, n=16, ncols=8, error=True):
+    '''
+    montage of inputs versus reconstructions written as PNG, see `montage`
+    Return:
+        path
+    '''
+    return save_png(montage(x, x_hat, n=n, ncols=ncols, error=error), path)
+
+
+def imshow_compare(in_,
+                    out,
+                    N,
+                    label_in=None,
+                    label_out = None,
+                    count=False,
+                    save_path=None,
+                    epoch=None,
+                    show=True):
+    """
+    Displays a comparison between original and reconstructed images side by side.
+
+    Args:
+        in_ (torch.Tensor): The input images as a PyTorch tensor of shape [B, C, H, W].
+        out (torch.Tensor): The reconstructed images as a PyTorch tensor of shape [B, C, H, W].
+        N (int): The number of images to display.
+        label_in (str, optional): The label for the input images. Defaults to None.
+        label_out (str, optional): The label for the output images. Defaults to None.
+        count (bool, optional): If True, displays a count on the images. Defaults to False.
+        save_path (str, optional): Folder to save the comparison images in. Defaults to None, not saved.
+        epoch (int, optional): The current epoch, used in naming the saved file. Defaults to None.
+        show (bool, optional): Show the figures. Defaults to True.
+
+    Returns:
+        None
+    """
+    from matplotlib import pyplot as plt
+
+    n = N//4
+    if epoch is None:
+        epoch = 0
+    if save_path is not None:
+        # create a folder to save the images
+        os.makedirs(save_path, exist_ok=True)
+    for N in range(n):
+        figures = []
+        if in_ is not None:
+            # channel color map, [B, C, H, W] to RGB [B, H, W, 3]
+            in_pic = colorize(in_)
+
+            figures.append(plt.figure(figsize=(18, 4)))
+            # plt.suptitle(label + ' – real test data / reconstructions', color='w', fontsize=16)
+
+            for i in range(4):
+                plt.subplot(1,4,i+1,)
+                plt.imshow(in_pic[i+4*N])
+                plt.axis('off')
+            if label_in is not None:
+                plt.title(label_in)
+            plt.axis('off')
+
+        if out is not None:
+            # Similar handling for the output pictures
+            out_pic = colorize(out)
+
+            figures.append(plt.figure(figsize=(18, 6)))
+            for i in range(4):
+                plt.subplot(1,4,i+1)
+                plt.imshow(out_pic[i+4*N])
+                plt.axis('off')
+                if count: plt.title(str(4 * N + i), color='w')
+        if label_out is not None:
+            plt.title(label_out)
+        if save_path is not None: # save before show, show clears the figures
+            for k, fig in enumerate(figures):
+                kind = 'in' if in_ is not None and k == 0 else 'out'
+                fig.savefig(os.path.join(save_path, f'compare_epoch_{epoch}_{4 * N}_{kind}.png'))
+        if show:
+            plt.show()
+        for fig in figures:
+            plt.close(fig)
+
+
+
+def display_one_row(inputs_tensor):
+    """
+    Displays a row of images from the provided input tensor.
+
+    Args:
+        inputs_tensor (torch.Tensor): The input images as a PyTorch tensor of shape [N, C, H, W].
+
+    Returns:
+        None
+    """
+    from matplotlib import pyplot as plt
+
+    n = inputs_tensor.shape[0]
+    # one normalized, color-mapped row in a single image instead of one subplot per image
+    row = montage(inputs_tensor, ncols=n, pad=0, normalize_samples=True)
+    plt.figure(figsize=(4*n, 4))
+    plt.imshow(row)
+    plt.axis('off')
+    plt.tight_layout()
+
+
+if __name__ == '__main__':
+    import torch
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--batch-size', type=int, nargs='+', default=[16, 64])
+    parser.add_argument('--resolution', type=int, default=90)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--out', default='./montage_bench/')
+    args = parser.parse_args()
+
+    import matplotlib
+    matplotlib.use('Agg')
+    for batch_size in args.batch_size:
+        x = torch.rand(batch_size, 2, args.resolution, args.resolution)
+        x_hat = torch.rand(batch_size, 2, args.resolution, args.resolution)
+        t0 = time.perf_counter()
+        for _ in range(args.repeat):
+            save_montage(x, x_hat, os.path.join(args.out, f'montage_{batch_size}.png'), n=batch_size)
+        t_montage = (time.perf_counter() - t0) / args.repeat
+        t0 = time.perf_counter()
+        imshow_compare(x, x_hat, batch_size, save_path=os.path.join(args.out, 'matplotlib'), show=False)
+        t_figures = time.perf_counter() - t0
+        print(f'B={batch_size}  montage + PNG {1000 * t_montage:8.1f} ms   matplotlib figures {1000 * t_figures:8.1f} ms')
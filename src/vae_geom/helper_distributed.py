@@ -0,0 +1,179 @@
+'''
+helpers of the multi-process DistributedDataParallel training mode
+
+The training script is started once per process by torchrun, e.g. one process per GPU or per CPU socket:
+
+    torchrun --nproc_per_node=2 -m vae_geom.main_train_on_GPU
+
+Without the torchrun environment (WORLD_SIZE unset or 1) every helper falls back to single-process behaviour.
+'''
+import os
+import numpy as np
+import torch
+import torch.distributed as dist
+from torch import nn
+
+
+def init_distributed(backend='auto'):
+    '''
+    initialize the default process group from the torchrun environment variables
+    Args:
+        backend: 'gloo', 'nccl' or 'auto' (nccl if CUDA is available, gloo otherwise)
+    Return:
+        rank, local_rank, world_size
+    '''
+    world_size = int(os.environ.get('WORLD_SIZE', 1))
+    if world_size <= 1:
+        return 0, 0, 1
+    if backend == 'auto':
+        backend = 'nccl' if torch.cuda.is_available() else 'gloo'
+    dist.init_process_group(backend=backend)
+    return dist.get_rank(), int(os.environ.get('LOCAL_RANK', 0)), dist.get_world_size()
+
+
+def is_distributed():
+    return dist.is_available() and dist.is_initialized()
+
+
+def is_main_process():
+    ''' rank 0 (or no process group), the only process writing artifacts and logs '''
+    return not is_distributed() or dist.get_rank() == 0
+
+
+def all_reduce_sum(tensor):
+    ''' in-place sum over all processes, returns the tensor '''
+    if is_distributed():
+        dist.all_reduce(tensor, op=dist.ReduceOp.SUM)
+    return tensor
+
+
+def gather_rows(idx, values):
+    '''
+    gather the sample indices and per-sample rows of the current batch from all processes;
+    every process must pass a batch of the same size (DistributedSampler pads the datasets to equal length)
+    Return:
+        idx [world_size*B] and values [world_size*B*...]
+    '''
+    if not is_distributed():
+        return idx, values
+    idx = idx.to(values.device)
+    idx_list = [torch.empty_like(idx) for _ in range(dist.get_world_size())]
+    value_list = [torch.empty_like(values) for _ in range(dist.get_world_size())]
+    dist.all_gather(idx_list, idx)
+    dist.all_gather(value_list, values.contiguous())
+    return torch.cat(idx_list), torch.cat(value_list)
+
+
+def padding_mask(start, n, n_samples, rank=0, world_size=1):
+    '''
+    DistributedSampler pads the sample sequence to a multiple of world_size by repeating its first samples,
+    process rank takes the positions rank, rank + world_size, ... of the padded sequence
+    Args:
+        start, n: the n samples of the process from its start-th sample on, e.g. one batch
+        n_samples: length of the dataset
+    Return:
+        bool tensor [n], False for the repeated samples, None if there are none
+    '''
+    keep = rank + world_size * (start + torch.arange(n)) < n_samples
+    return None if bool(keep.all()) else keep
+
+
+def drop_padding(keep, *tensors):
+    ''' the rows of the tensors selected by keep (see padding_mask), the tensors themselves if keep is None '''
+    if keep is None:
+        return tensors
+    return tuple(t[keep.to(t.device)] for t in tensors)
+
+
+def sample_noise(idx, dim, seed, epoch=0):
+    '''
+    N(0,1) noise of the samples idx, drawn from a generator seeded by (seed, epoch, sample index);
+    a sample gets the same noise whatever the process, batch and number of processes it is trained in
+    Args:
+        idx: dataset indices of the samples [B]
+        dim: noise dimension per sample, e.g. latent_dim
+    Return:
+        float tensor [B*dim] on the CPU
+    '''
+    noise = torch.empty(len(idx), dim)
+    generator = torch.Generator()
+    for row, i in zip(noise, idx.tolist()):
+        generator.manual_seed(int(np.random.SeedSequence([seed, epoch, i]).generate_state(1, np.uint64)[0]))
+        torch.randn(dim, generator=generator, out=row)
+    return noise
+
+
+class _AllReduceSum(torch.autograd.Function):
+    ''' sum over all processes, the gradient of every summand is the sum of the gradients of all processes '''
+
+    @staticmethod
+    def forward(ctx, tensor):
+        return all_reduce_sum(tensor.clone())
+
+    @staticmethod
+    def backward(ctx, grad):
+        return all_reduce_sum(grad.clone())
+
+
+class AllReduceBatchNorm(nn.modules.batchnorm._BatchNorm):
+    """Batch norm over the batches of all processes for the gloo backend, which nn.SyncBatchNorm does not support.
+
+    In training mode with a process group, the per-channel mean and variance are summed over the processes
+    with a differentiable all-reduce, so the normalization, the running statistics and the gradients are
+    the ones of the global batch. Without a process group or in eval mode it is the plain batch norm.
+    """
+
+    def _check_input_dim(self, input):
+        if input.dim() < 2:
+            raise ValueError(f'expected at least 2D input (got {input.dim()}D input)')
+
+    def forward(self, input):
+        if not (self.training and is_distributed()):
+            return super().forward(input)
+        dims = [0] + list(range(2, input.dim()))
+        shape = [1, -1] + [1] * (input.dim() - 2)
+        count = all_reduce_sum(torch.tensor(float(input.numel() // input.shape[1])))
+        mean = _AllReduceSum.apply(input.sum(dims)) / count
+        var = _AllReduceSum.apply(((input - mean.view(shape)) ** 2).sum(dims)) / count
+        if self.track_running_stats:
+            with torch.no_grad():
+                self.num_batches_tracked.add_(1)
+                momentum = 1. / float(self.num_batches_tracked) if self.momentum is None else self.momentum
+                self.running_mean.lerp_(mean, momentum)
+                self.running_var.lerp_(var * count / max(count - 1, 1), momentum)
+        result = (input - mean.view(shape)) * torch.rsqrt(var.view(shape) + self.eps)
+        if self.affine:
+            result = result * self.weight.view(shape) + self.bias.view(shape)
+        return result
+
+
+def convert_sync_batchnorm(module):
+    '''
+    the batch norm layers of module replaced by AllReduceBatchNorm layers with the same parameters and
+    statistics, see nn.SyncBatchNorm.convert_sync_batchnorm for CUDA
+    '''
+    result = module
+    if isinstance(module, nn.modules.batchnorm._BatchNorm) and not isinstance(module, AllReduceBatchNorm):
+        result = AllReduceBatchNorm(module.num_features, module.eps, module.momentum, module.affine,
+                                    module.track_running_stats)
+        if module.affine:
+            with torch.no_grad():
+                result.weight = module.weight
+                result.bias = module.bias
+        result.running_mean = module.running_mean
+        result.running_var = module.running_var
+        result.num_batches_tracked = module.num_batches_tracked
+        result.train(module.training)
+    for name, child in module.named_children():
+        result.add_module(name, convert_sync_batchnorm(child))
+    return result
+
+
+def barrier():
+    if is_distributed():
+        dist.barrier()
+
+
+def cleanup():
+    if is_distributed():
+        dist.destroy_process_group()
@@ -0,0 +1,201 @@
+'''
+export a trained CNN_VAE decoder to a frozen, inference-only module
+
+    BatchNorm2d layers are folded into the weights of the preceding (transposed) convolution
+    activations use the channels_last memory layout
+    optional reduced precision variant 'bf16' (bfloat16 weights and activations)
+
+    python -m vae_geom.helper_export --model ./save_model/VAEmodel_last.pt --out ./save_model/decoder_folded.pt
+    decoder = load_inference_decoder('./save_model/decoder_folded.pt')
+'''
+import copy
+import time
+import json
+import argparse
+
+import torch
+from torch import nn
+
+PRECISIONS = ('fp32', 'bf16')
+
+
+def fold_conv_bn(conv, bn):
+    '''
+    fold an eval-mode BatchNorm2d into the preceding Conv2d or ConvTranspose2d
+    Return:
+        a new convolution computing bn(conv(x))
+    '''
+    scale = bn.weight / torch.sqrt(bn.running_var + bn.eps)
+    bias = conv.bias if conv.bias is not None else torch.zeros_like(bn.running_mean)
+    folded = copy.deepcopy(conv)
+    if isinstance(conv, nn.ConvTranspose2d): # weight [C_in * C_out/groups * k * k]
+        if conv.groups != 1:
+            raise NotImplementedError('folding grouped transposed convolutions is not supported')
+        weight = conv.weight * scale[None, :, None, None]
+    else: # weight [C_out * C_in/groups * k * k]
+        weight = conv.weight * scale[:, None, None, None]
+    folded.weight = nn.Parameter(weight.detach())
+    folded.bias = nn.Parameter(((bias - bn.running_mean) * scale + bn.bias).detach())
+    return folded
+
+
+def fold_batchnorm(module):
+    '''
+    fold every (Conv2d | ConvTranspose2d, BatchNorm2d) pair inside nn.Sequential containers, in place;
+    the BatchNorm2d is replaced by nn.Identity
+    Return:
+        the module
+    '''
+    for child in module.children():
+        fold_batchnorm(child)
+    if isinstance(module, nn.Sequential):
+        layers = list(module)
+        for i in range(len(layers) - 1):
+            if isinstance(layers[i], (nn.Conv2d, nn.ConvTranspose2d)) and isinstance(layers[i + 1], nn.BatchNorm2d):
+                module[i] = fold_conv_bn(layers[i], layers[i + 1])
+                module[i + 1] = nn.Identity()
+    return module
+
+
+class InferenceDecoder(nn.Module):
+    """Frozen decoder of a trained CNN_VAE, with BatchNorm folded into the convolutions.
+
+    `forward(z)` and `decode(z)` both map latent vectors [B*latent_dim] to fields [B*C*W*L]
+    (always returned as float32, contiguous).
+
+    Args:
+        model (CNN_VAE): The trained model, it is not modified.
+        channels_last (bool): Run the convolutions in the channels_last memory layout. Default is True.
+        precision (str): 'fp32' or 'bf16'.
+    """
+    def __init__(self, model, channels_last=True, precision='fp32'):
+        super(InferenceDecoder, self).__init__()
+        if precision not in PRECISIONS:
+            raise ValueError(f"unknown precision {precision}, use one of {PRECISIONS}")
+        folded = fold_batchnorm(copy.deepcopy(model).eval())
+        self.latent_dim = model.latent_dim
+        self.decoder_input = folded.decoder_input
+        self.decoder = folded.decoder
+        self.final_layer = folded.final_layer
+        self.decoder_shape = model.decoder_shape # [hidden_dims[-1]*W*L] of the encoder output
+        # arguments of the CNN_VAE the module is rebuilt from by load_inference_decoder
+        self.model_kwargs = {'channel_in': model.channel_in, 'latent_dim': model.latent_dim,
+                             'hidden_dims': model.hidden_dims, 'input_size': model.input_size,
+                             'decoder': model.decoder_type}
+        self.channels_last = channels_last
+        self.precision = precision
+        self.dtype = torch.bfloat16 if precision == 'bf16' else torch.float32
+        if channels_last:
+            self.to(memory_format=torch.channels_last)
+        if precision == 'bf16':
+            self.to(torch.bfloat16)
+        self.eval()
+        for p in self.parameters():
+            p.requires_grad_(False)
+
+    def decode(self, z):
+        z = z.to(self.dtype)
+        result = self.decoder_input(z).view(-1, *self.decoder_shape)
+        if self.channels_last:
+            result = result.contiguous(memory_format=torch.channels_last)
+        result = self.decoder(result)
+        x_hat = self.final_layer(result)
+        return x_hat.float().contiguous()
+
+    def forward(self, z):
+        return self.decode(z)
+
+    def save(self, path):
+        ''' save the state dict with the arguments load_inference_decoder needs to rebuild the module '''
+        torch.save({'model_kwargs': self.model_kwargs, 'channels_last': self.channels_last,
+                    'precision': self.precision, 'state_dict': self.state_dict()}, path)
+
+
+def load_inference_decoder(path, map_location='cpu'):
+    '''
+    load an InferenceDecoder written by InferenceDecoder.save (or python -m vae_geom.helper_export --out)
+    Return:
+        the InferenceDecoder, in eval mode
+    '''
+    from .helper_VAEstruc import CNN_VAE
+    saved = torch.load(path, map_location=map_location, weights_only=False)
+    # same layers as the saved module, the random weights are replaced by the saved ones
+    decoder = InferenceDecoder(CNN_VAE(**saved['model_kwargs']).eval(), channels_last=saved['channels_last'],
+                               precision=saved['precision'])
+    decoder.load_state_dict(saved['state_dict'])
+    return decoder
+
+
+def export_decoder(model_path, latent_dim=6, channel_in=2, channels_last=True, precision='fp32', input_size=90,
+                   decoder='legacy'):
+    '''
+    turn a state dict saved by the training script into a frozen InferenceDecoder
+    Return:
+        the InferenceDecoder and the fp32 CNN_VAE it was built from
+    '''
+    from .helper_inference_server import load_decoder
+    model = load_decoder(model_path, latent_dim=latent_dim, channel_in=channel_in, input_size=input_size, decoder=decoder)
+    return InferenceDecoder(model, channels_last=channels_last, precision=precision), model
+
+
+def accuracy_report(reference, variant, z, batch_size=64):
+    '''
+    field error of a decoder variant against the fp32 reference decode
+    Return:
+        dict with max and mean absolute error
+    '''
+    max_err, abs_sum, count = 0., 0., 0
+    with torch.inference_mode():
+        for chunk in z.split(batch_size):
+            err = (variant.decode(chunk) - reference.decode(chunk)).abs()
+            max_err = max(max_err, err.max().item())
+            abs_sum += err.sum().item()
+            count += err.numel()
+    return {'max_error': max_err, 'mean_error': abs_sum / count}
+
+
+def decode_throughput(decoder, latent_dim, batch_size=32, repeat=3):
+    '''
+    samples/sec of decoder.decode on random latent vectors, best of repeat after one warm-up call
+    '''
+    z = torch.randn(batch_size, latent_dim)
+    with torch.inference_mode():
+        decoder.decode(z)
+        best = float('inf')
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            decoder.decode(z)
+            best = min(best, time.perf_counter() - t0)
+    return batch_size / best
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', default=None, help='state dict of CNN_VAE, random weights if omitted')
+    parser.add_argument('--latent-dim', type=int, default=6)
+    parser.add_argument('--decoder', default='legacy', choices=('legacy', 'upsample'), help='decoder variant of the model')
+    parser.add_argument('--input-size', type=int, default=90)
+    parser.add_argument('--variants', nargs='+', default=list(PRECISIONS), choices=PRECISIONS)
+    parser.add_argument('--no-channels-last', action='store_true')
+    parser.add_argument('--samples', type=int, default=64, help='random latent vectors of the accuracy report')
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--threads', type=int, default=None)
+    parser.add_argument('--out', default=None, help='save the first variant here, see load_inference_decoder')
+    args = parser.parse_args()
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+
+    torch.manual_seed(0)
+    report = {}
+    for k, precision in enumerate(args.variants):
+        decoder, model = export_decoder(args.model, args.latent_dim, channels_last=not args.no_channels_last,
+                                        precision=precision, input_size=args.input_size, decoder=args.decoder)
+        if k == 0:
+            z = torch.randn(args.samples, args.latent_dim)
+            report['reference_samples_per_sec'] = decode_throughput(model, args.latent_dim, args.batch_size, args.repeat)
+            if args.out is not None:
+                decoder.save(args.out)
+        report[precision] = accuracy_report(model, decoder, z, args.batch_size)
+        report[precision]['samples_per_sec'] = decode_throughput(decoder, args.latent_dim, args.batch_size, args.repeat)
+    print(json.dumps(report, indent=2))
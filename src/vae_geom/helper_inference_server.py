@@ -0,0 +1,385 @@
+'''
+dynamic-batching inference server for CNN_VAE.decode
+
+One eval-mode model is shared by all callers. Concurrent latent requests are queued and coalesced
+into large batches, which are decoded under torch.inference_mode.
+Callers in the same process use `DecodeServer.decode`/`submit`, other processes connect through a
+Unix socket with `DecodeClient`.
+
+    python -m vae_geom.helper_inference_server serve --socket /tmp/vae.sock --model ./save_model/VAEmodel_last.pt
+    python -m vae_geom.helper_inference_server bench --clients 8 --requests 20 --rows 4
+'''
+import os
+import time
+import json
+import queue
+import struct
+import socket
+import argparse
+import threading
+import socketserver
+from collections import deque
+from concurrent.futures import Future
+
+import numpy as np
+import torch
+
+from .helper_VAEstruc import CNN_VAE
+from .helper_artifact import is_artifact, load_state_dict
+
+
+def load_decoder(model_path=None, latent_dim=6, channel_in=2, map_location='cpu', input_size=90, decoder='legacy'):
+    '''
+    build a CNN_VAE in eval mode for decoding
+    Args:
+        model_path: state dict saved by the training script, random weights if None; a .tensors artifact is
+                    memory mapped, shared by all processes that load it
+        latent_dim: dimension of the latent space vector
+        channel_in: number of channels of the unit cell fields
+        input_size, decoder: input size and decoder variant the model was trained with
+    Return:
+        CNN_VAE in eval mode, gradients disabled
+    '''
+    model = CNN_VAE(channel_in=channel_in, latent_dim=latent_dim, input_size=input_size, decoder=decoder)
+    if model_path is not None:
+        model.load_state_dict(load_state_dict(model_path, map_location), assign=is_artifact(model_path))
+    model.eval()
+    for p in model.parameters():
+        p.requires_grad_(False)
+    return model
+
+
+class _request:
+    ''' one queued decode request '''
+    __slots__ = ('z', 'future', 't_submit')
+
+    def __init__(self, z):
+        self.z = z
+        self.future = Future()
+        self.t_submit = time.perf_counter()
+
+
+class DecodeServer:
+    """Coalesces concurrent `decode` requests into large batches for one eval-mode model.
+
+    A single worker thread takes the first queued request, then keeps collecting requests until
+    `max_batch_size` latent vectors are gathered or `max_wait_ms` has passed, decodes them in one
+    call and hands every caller its slice of the result.
+
+    Attributes:
+        model (nn.Module): The model, its `decode` method is called in eval mode.
+        max_batch_size (int): Maximum number of latent vectors decoded in one call.
+        max_wait_ms (float): Maximum time the first request of a batch waits for more requests.
+        num_threads (int): torch intra-op threads, None keeps the current setting.
+
+    Args:
+        model (nn.Module): A model with a `decode(z)` method, e.g. from `load_decoder`.
+        max_batch_size (int): Default is 256.
+        max_wait_ms (float): Default is 2 ms.
+        num_threads (int, optional): torch.set_num_threads for the process.
+        latency_window (int): Number of most recent requests kept for the latency percentiles.
+    """
+    def __init__(self, model, max_batch_size=256, max_wait_ms=2., num_threads=None, latency_window=100000):
+        self.model = model.eval()
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.num_threads = num_threads
+        self._queue = queue.Queue()
+        self._thread = None
+        self._running = False
+        self._latencies = deque(maxlen=latency_window)
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def start(self):
+        if self._running:
+            return self
+        if self.num_threads is not None:
+            torch.set_num_threads(self.num_threads)
+        self._running = True
+        self._thread = threading.Thread(target=self._loop, name='DecodeServer', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if not self._running:
+            return
+        self._running = False
+        self._queue.put(None) # wake up the worker
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def submit(self, z):
+        '''
+        queue latent vectors for decoding
+        Args:
+            z: latent vectors [B*latent_dim] (tensor or numpy array), or a single vector [latent_dim]
+        Return:
+            concurrent.futures.Future resolving to the decoded fields [B*C*W*L];
+            raises ValueError if z is not of the latent dimension of the model
+        '''
+        if not self._running:
+            raise RuntimeError('DecodeServer is not running, call start() first.')
+        z = torch.as_tensor(z, dtype=torch.float32)
+        if z.dim() == 1:
+            z = z.unsqueeze(0)
+        # a malformed request is rejected here, it would fail the whole batch it is coalesced into
+        latent_dim = getattr(self.model, 'latent_dim', None)
+        if z.dim() != 2 or (latent_dim is not None and z.shape[1] != latent_dim):
+            raise ValueError(f'expected latent vectors [B*{latent_dim}] or [{latent_dim}], got {tuple(z.shape)}')
+        req = _request(z)
+        self._queue.put(req)
+        return req.future
+
+    def decode(self, z):
+        ''' blocking `submit` '''
+        return self.submit(z).result()
+
+    def _collect(self):
+        ''' block for the first request, then gather more until the batch is full or the wait time is up '''
+        first = self._queue.get()
+        if first is None:
+            return []
+        batch, rows = [first], len(first.z)
+        deadline = time.perf_counter() + self.max_wait_ms / 1000.
+        while rows < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            try:
+                req = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if req is None:
+                self._running = False
+                break
+            batch.append(req)
+            rows += len(req.z)
+        return batch
+
+    def _loop(self):
+        while self._running or not self._queue.empty():
+            batch = self._collect()
+            if not batch:
+                continue
+            try:
+                z = torch.cat([req.z for req in batch], dim=0)
+                with torch.inference_mode():
+                    x_hat = torch.cat([self.model.decode(chunk) for chunk in z.split(self.max_batch_size)], dim=0)
+            except Exception as e: # hand the error to every caller of this batch
+                for req in batch:
+                    req.future.set_exception(e)
+                continue
+            t_done = time.perf_counter()
+            start = 0
+            for req in batch:
+                req.future.set_result(x_hat[start:start + len(req.z)])
+                start += len(req.z)
+            with self._lock:
+                self._batches += 1
+                self._samples += len(z)
+                self._requests += len(batch)
+                self._latencies.extend(t_done - req.t_submit for req in batch)
+
+    def reset_stats(self):
+        with self._lock:
+            self._batches = self._samples = self._requests = 0
+            self._latencies.clear()
+            self._t_start = time.perf_counter()
+
+    def stats(self):
+        '''
+        Return:
+            dict with requests, samples, batches, mean batch size, samples/sec since the last
+            reset_stats and request latency percentiles in ms (submit to result)
+        '''
+        with self._lock:
+            elapsed = time.perf_counter() - self._t_start
+            latencies = np.array(self._latencies) * 1000.
+            out = {'requests': self._requests,
+                   'samples': self._samples,
+                   'batches': self._batches,
+                   'mean_batch_size': self._samples / max(self._batches, 1),
+                   'samples_per_sec': self._samples / elapsed if elapsed > 0 else 0.}
+        for q in (50, 90, 99):
+            out[f'latency_p{q}_ms'] = float(np.percentile(latencies, q)) if len(latencies) else float('nan')
+        return out
+
+
+# %% Unix socket transport
+# request:  <II rows, latent_dim> + float32 [rows*latent_dim]
+# response: <I status> + (status 0) <I ndim> + <I>*ndim shape + float32 payload
+#                      + (status 1) <I length> + utf-8 error message
+def _recv_exact(sock, n):
+    buf = bytearray(n)
+    view = memoryview(buf)
+    got = 0
+    while got < n:
+        k = sock.recv_into(view[got:], n - got)
+        if k == 0:
+            raise ConnectionError('connection closed')
+        got += k
+    return bytes(buf)
+
+
+class _decode_handler(socketserver.BaseRequestHandler):
+    ''' serves decode requests of one client connection until it disconnects '''
+    def handle(self):
+        server = self.server.decode_server
+        while True:
+            try:
+                rows, dim = struct.unpack('<II', _recv_exact(self.request, 8))
+            except ConnectionError:
+                return
+            z = np.frombuffer(_recv_exact(self.request, rows * dim * 4), dtype=np.float32).reshape(rows, dim)
+            try:
+                x_hat = server.decode(torch.from_numpy(z.copy())).numpy()
+            except Exception as e:
+                msg = repr(e).encode()
+                self.request.sendall(struct.pack('<II', 1, len(msg)) + msg)
+                continue
+            header = struct.pack('<II', 0, x_hat.ndim) + struct.pack(f'<{x_hat.ndim}I', *x_hat.shape)
+            self.request.sendall(header + np.ascontiguousarray(x_hat, dtype=np.float32).tobytes())
+
+
+class _unix_server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve_unix_socket(decode_server, socket_path):
+    '''
+    expose a running DecodeServer on a Unix socket, every client connection gets its own thread
+    Return:
+        the socketserver, call serve_forever() (or run it in a thread) and shutdown() on it
+    '''
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    server = _unix_server(socket_path, _decode_handler)
+    server.decode_server = decode_server
+    return server
+
+
+class DecodeClient:
+    """Client of a `serve_unix_socket` server, one connection per client.
+
+    Args:
+        socket_path (str): Path of the Unix socket.
+        timeout (float): Seconds to wait for the socket to appear.
+    """
+    def __init__(self, socket_path, timeout=30.):
+        deadline = time.perf_counter() + timeout
+        while True:
+            try:
+                self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                self.sock.connect(socket_path)
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                self.sock.close()
+                if time.perf_counter() > deadline:
+                    raise
+                time.sleep(0.05)
+
+    def decode(self, z):
+        '''
+        Args:
+            z: latent vectors [B*latent_dim] or [latent_dim]
+        Return:
+            decoded fields as float32 numpy array [B*C*W*L]
+        '''
+        z = np.ascontiguousarray(z, dtype=np.float32)
+        if z.ndim == 1:
+            z = z[None]
+        self.sock.sendall(struct.pack('<II', *z.shape) + z.tobytes())
+        status, n = struct.unpack('<II', _recv_exact(self.sock, 8))
+        if status != 0:
+            raise RuntimeError('decode server error: ' + _recv_exact(self.sock, n).decode())
+        shape = struct.unpack(f'<{n}I', _recv_exact(self.sock, 4 * n))
+        payload = _recv_exact(self.sock, int(np.prod(shape)) * 4)
+        return np.frombuffer(payload, dtype=np.float32).reshape(shape)
+
+    def close(self):
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# %% load generator
+def run_load_generator(make_decode, n_clients=8, requests_per_client=20, rows_per_request=4,
+                       latent_dim=6, seed=0):
+    '''
+    stand-in for the optimizer workers: n_clients threads each send requests_per_client
+    requests of rows_per_request random latent vectors
+    Args:
+        make_decode: called once per client thread, returns its decode function,
+            e.g. `lambda: server.decode` or `lambda: DecodeClient(path).decode`
+    Return:
+        dict with client-side samples/sec and latency percentiles in ms
+    '''
+    latencies = [[] for _ in range(n_clients)]
+    barrier = threading.Barrier(n_clients + 1)
+
+    def client(k):
+        decode = make_decode()
+        rng = np.random.default_rng(seed + k)
+        barrier.wait()
+        for _ in range(requests_per_client):
+            z = rng.standard_normal((rows_per_request, latent_dim)).astype(np.float32)
+            t0 = time.perf_counter()
+            decode(z)
+            latencies[k].append(time.perf_counter() - t0)
+
+    threads = [threading.Thread(target=client, args=(k,)) for k in range(n_clients)]
+    for t in threads:
+        t.start()
+    barrier.wait()
+    t0 = time.perf_counter()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t0
+    lat = np.concatenate([np.array(l) for l in latencies]) * 1000.
+    out = {'clients': n_clients, 'rows_per_request': rows_per_request,
+           'samples_per_sec': n_clients * requests_per_client * rows_per_request / elapsed}
+    for q in (50, 90, 99):
+        out[f'latency_p{q}_ms'] = float(np.percentile(lat, q))
+    return out
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['serve', 'bench'])
+    parser.add_argument('--model', default=None, help='state dict of CNN_VAE, random weights if omitted')
+    parser.add_argument('--latent-dim', type=int, default=6)
+    parser.add_argument('--decoder', default='legacy', choices=('legacy', 'upsample'), help='decoder variant of the model')
+    parser.add_argument('--input-size', type=int, default=90)
+    parser.add_argument('--socket', default=None, help='Unix socket path (bench: go through the socket)')
+    parser.add_argument('--max-batch-size', type=int, default=256)
+    parser.add_argument('--max-wait-ms', type=float, default=2.)
+    parser.add_argument('--threads', type=int, default=None)
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=20)
+    parser.add_argument('--rows', type=int, default=4)
+    args = parser.parse_args()
+
+    model = load_decoder(args.model, latent_dim=args.latent_dim, input_size=args.input_size, decoder=args.decoder)
+    with DecodeServer(model, args.max_batch_size, args.max_wait_ms, args.threads) as server:
+        if args.command == 'serve':
+            if args.socket is None:
+                parser.error('serve needs --socket')
+            print(f'serving decode on {args.socket}')
+            serve_unix_socket(server, args.socket).serve_forever()
+        else:
+            if args.socket is not None:
+                sock_server = serve_unix_socket(server, args.socket)
+                threading.Thread(target=sock_server.serve_forever, daemon=True).start()
+                make_decode = lambda: DecodeClient(args.socket).decode
+            else:
+                make_decode = lambda: server.decode
+            client = run_load_generator(make_decode, args.clients, args.requests, args.rows, args.latent_dim)
+            print(json.dumps({'client': client, 'server': server.stats()}, indent=2))
@@ -0,0 +1,175 @@
+'''
+per-phase instrumentation of the training loop
+
+Wall-clock time per phase (data loading, forward, backward, optimizer step, test pass, checkpoint writing),
+samples/sec and peak memory are accumulated per epoch and appended to a JSONL log, one line per epoch.
+Optionally a torch.profiler trace is captured for a window of training steps.
+'''
+import os
+import time
+import json
+import resource
+from contextlib import contextmanager
+
+import torch
+
+# phases of a training step, their sum is the training time behind samples_per_sec
+TRAIN_PHASES = ('data', 'forward', 'backward', 'optimizer')
+
+
+def reset_peak_rss():
+    '''
+    reset the peak resident memory (VmHWM) of this process, Linux only
+    Return:
+        True if the reset worked
+    '''
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb():
+    '''
+    peak resident memory of this process in MB, since the last reset_peak_rss where supported
+    '''
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024.
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+
+def anon_rss_mb():
+    '''
+    anonymous (heap) resident memory of this process in MB, read from /proc/self/status.
+    Pages of a memory-mapped file are page cache and are not counted here.
+    '''
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('RssAnon:'):
+                return int(line.split()[1]) / 1024.
+    raise RuntimeError('RssAnon is not available, /proc/self/status is Linux only')
+
+
+class TrainingMonitor:
+    """Per-phase timers, samples/sec and peak memory of the training loop, logged as JSONL.
+
+    Usage in the training loop:
+
+        for x, y in monitor.timed_iter(train_loader): # 'data' phase
+            with monitor.phase('forward'):
+                ...
+            monitor.step(len(x))
+        monitor.end_epoch(epoch, train_loss=...)
+
+    Attributes:
+        log_file (str): JSONL file, one record per epoch. None disables the log.
+        device (torch.device): Device of the model, used for CUDA synchronization and memory stats.
+        sync (bool): Synchronize CUDA at the end of every phase, so GPU time is attributed to the right phase.
+            Adds a device sync per phase, off by default.
+
+    Args:
+        log_file (str, optional): Path of the JSONL log.
+        device: Default is the CPU.
+        sync (bool): Default is False.
+        profile_start (int, optional): Global training step at which a torch.profiler trace starts. None disables profiling.
+        profile_steps (int): Number of profiled steps. Default is 5.
+        profile_dir (str): Folder of the chrome trace. Default is './profile/'.
+    """
+    def __init__(self, log_file=None, device='cpu', sync=False, profile_start=None, profile_steps=5,
+                 profile_dir='./profile/'):
+        self.log_file = log_file
+        self.device = torch.device(device)
+        self.sync = sync and self.device.type == 'cuda'
+        self.global_step = 0
+        self._profiler = None
+        if profile_start is not None:
+            os.makedirs(profile_dir, exist_ok=True)
+            trace = os.path.join(profile_dir, f'trace_step_{profile_start}.json')
+            self._profiler = torch.profiler.profile(
+                activities=[torch.profiler.ProfilerActivity.CPU]
+                + ([torch.profiler.ProfilerActivity.CUDA] if self.device.type == 'cuda' else []),
+                schedule=torch.profiler.schedule(wait=max(profile_start - 1, 0), warmup=min(profile_start, 1),
+                                                 active=profile_steps, repeat=1),
+                on_trace_ready=lambda prof: prof.export_chrome_trace(trace),
+                record_shapes=True, profile_memory=True)
+            self._profiler.start()
+        if log_file is not None and os.path.dirname(log_file):
+            os.makedirs(os.path.dirname(log_file), exist_ok=True)
+        self._reset()
+
+    def _reset(self):
+        self.phases = {}
+        self.samples = 0
+        self._t_epoch = time.perf_counter()
+        if self.device.type == 'cuda':
+            torch.cuda.reset_peak_memory_stats(self.device)
+        reset_peak_rss()
+
+    def _synchronize(self):
+        if self.sync:
+            torch.cuda.synchronize(self.device)
+
+    @contextmanager
+    def phase(self, name):
+        ''' accumulate the wall-clock time of the enclosed block under name '''
+        t0 = time.perf_counter()
+        with torch.profiler.record_function(name):
+            yield
+            self._synchronize()
+        self.phases[name] = self.phases.get(name, 0.) + time.perf_counter() - t0
+
+    def timed_iter(self, loader, name='data'):
+        ''' iterate over loader, the time spent waiting for each batch is accumulated under name '''
+        it = iter(loader)
+        while True:
+            t0 = time.perf_counter()
+            try:
+                batch = next(it)
+            except StopIteration:
+                return
+            self.phases[name] = self.phases.get(name, 0.) + time.perf_counter() - t0
+            yield batch
+
+    def step(self, batch_size):
+        ''' mark the end of one training step of batch_size samples '''
+        self.samples += batch_size
+        self.global_step += 1
+        if self._profiler is not None:
+            self._profiler.step()
+
+    def end_epoch(self, epoch, **metrics):
+        '''
+        write the record of the epoch and reset the counters
+        Args:
+            epoch: epoch number
+            metrics: further values of the record, e.g. train_loss
+        Return:
+            the record as dict
+        '''
+        self._synchronize()
+        elapsed = time.perf_counter() - self._t_epoch
+        train_seconds = sum(self.phases.get(name, 0.) for name in TRAIN_PHASES)
+        record = {'epoch': epoch, 'time': time.time(), 'epoch_seconds': elapsed,
+                  'phases': self.phases, 'samples': self.samples,
+                  'samples_per_sec': self.samples / train_seconds if train_seconds > 0 else 0.,
+                  'peak_rss_mb': peak_rss_mb()}
+        if self.device.type == 'cuda':
+            record['peak_cuda_mb'] = torch.cuda.max_memory_allocated(self.device) / 2**20
+        record.update(metrics)
+        if self.log_file is not None:
+            with open(self.log_file, 'a') as f:
+                f.write(json.dumps(record) + '\n')
+        self._reset()
+        return record
+
+    def close(self):
+        if self._profiler is not None:
+            self._profiler.stop()
+            self._profiler = None
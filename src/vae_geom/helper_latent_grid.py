@@ -0,0 +1,229 @@
+'''
+precomputed latent-grid lookup table as a surrogate of CNN_VAE.decode
+
+The trained decoder is evaluated once on a regular grid over the bounded region of the training
+latent distribution. The decoded fields (and optional derived scalars) are stored in memory-mapped
+.npy files, and batched latent queries are answered by multilinear interpolation between the
+2^latent_dim surrounding grid points, without running the network.
+
+    python -m vae_geom.helper_latent_grid build --model ./save_model/VAEmodel_last.pt --mu ./save_model/mu_list_last.npy --points 5 --out ./latent_grid/
+    python -m vae_geom.helper_latent_grid error --model ./save_model/VAEmodel_last.pt --mu ./save_model/mu_list_test_last.npy --out ./latent_grid/
+'''
+import os
+import json
+import time
+import argparse
+import itertools
+
+import numpy as np
+import torch
+
+
+def latent_bounds(mu, quantile=0.005):
+    '''
+    bounded region of the latent distribution
+    Args:
+        mu: latent vectors [N*latent_dim], e.g. the saved mu_list
+        quantile: fraction cut off at each side per dimension, 0 uses min/max
+    Return:
+        lower, upper: numpy arrays [latent_dim]
+    '''
+    mu = torch.as_tensor(mu).detach().cpu().double().numpy()
+    return np.quantile(mu, quantile, axis=0), np.quantile(mu, 1. - quantile, axis=0)
+
+
+def grid_axes(lower, upper, points):
+    '''
+    Args:
+        lower, upper: bounds per latent dimension, upper > lower
+        points: number of grid points per dimension, an int or a list with one entry per dimension
+    Return:
+        list of 1D numpy arrays, the grid coordinates of every dimension
+    '''
+    if np.isscalar(points):
+        points = [int(points)] * len(lower)
+    if min(points) < 2:
+        raise ValueError('every latent dimension needs at least 2 grid points')
+    empty = [d for d, (lo, hi) in enumerate(zip(lower, upper)) if not hi > lo]
+    if empty: # e.g. a collapsed latent dimension, whose mu is constant
+        raise ValueError(f'latent dimensions {empty} have bounds of zero width, the grid needs upper > lower')
+    return [np.linspace(lo, hi, n) for lo, hi, n in zip(lower, upper, points)]
+
+
+def build_latent_grid(decode_fn, axes, out_dir, batch_size=256, scalar_fns=None, dtype=np.float32):
+    '''
+    decode every grid point and store the table in out_dir
+    Args:
+        decode_fn: decodes latent vectors [B*latent_dim] to fields [B*C*W*L], e.g. model.decode in eval mode
+        axes: grid coordinates per dimension, see grid_axes
+        out_dir: folder for fields.npy, scalars.npy and grid.json
+        batch_size: number of grid points decoded per call
+        scalar_fns: optional dict name -> function(fields [B*C*W*L]) -> [B], derived scalars stored per grid point
+        dtype: storage type of the fields, float32 or float16
+    Return:
+        path of grid.json
+    '''
+    os.makedirs(out_dir, exist_ok=True)
+    shape = tuple(len(a) for a in axes)
+    n = int(np.prod(shape))
+    scalar_fns = scalar_fns or {}
+    fields = scalars = None
+    with torch.inference_mode():
+        for start in range(0, n, batch_size):
+            stop = min(start + batch_size, n)
+            index = np.unravel_index(np.arange(start, stop), shape)
+            z = np.stack([axis[i] for axis, i in zip(axes, index)], axis=1)
+            x_hat = decode_fn(torch.from_numpy(z).float())
+            if fields is None:
+                fields = np.lib.format.open_memmap(os.path.join(out_dir, 'fields.npy'), mode='w+', dtype=dtype,
+                                                   shape=(n,) + tuple(x_hat.shape[1:]))
+                if scalar_fns:
+                    scalars = np.lib.format.open_memmap(os.path.join(out_dir, 'scalars.npy'), mode='w+',
+                                                        dtype=np.float32, shape=(n, len(scalar_fns)))
+            fields[start:stop] = x_hat.cpu().numpy()
+            if scalars is not None:
+                scalars[start:stop] = torch.stack([fn(x_hat) for fn in scalar_fns.values()], dim=1).cpu().numpy()
+    fields.flush()
+    if scalars is not None:
+        scalars.flush()
+    meta = {'axes': [a.tolist() for a in axes], 'scalars': list(scalar_fns), 'dtype': np.dtype(dtype).name}
+    path = os.path.join(out_dir, 'grid.json')
+    with open(path, 'w') as f:
+        json.dump(meta, f, indent=2)
+    return path
+
+
+class LatentGridInterpolator:
+    """Multilinear interpolation of decoded fields over a precomputed latent grid.
+
+    Queries outside the grid are clamped to its boundary.
+
+    Attributes:
+        axes (list): Grid coordinates per latent dimension.
+        fields (numpy.memmap): Decoded fields of all grid points [N*C*W*L], row-major over the grid.
+        scalars (numpy.memmap): Derived scalars [N*K], or None.
+        scalar_names (list): Names of the K scalars.
+
+    Args:
+        grid_dir (str): Folder written by `build_latent_grid`.
+    """
+    def __init__(self, grid_dir):
+        with open(os.path.join(grid_dir, 'grid.json')) as f:
+            meta = json.load(f)
+        self.axes = [np.asarray(a) for a in meta['axes']]
+        self.scalar_names = meta['scalars']
+        self.fields = np.load(os.path.join(grid_dir, 'fields.npy'), mmap_mode='r')
+        self.scalars = np.load(os.path.join(grid_dir, 'scalars.npy'), mmap_mode='r') if self.scalar_names else None
+        self.shape = tuple(len(a) for a in self.axes)
+        self.strides = np.array([int(np.prod(self.shape[i + 1:])) for i in range(len(self.shape))], dtype=np.int64)
+        self.corners = np.array(list(itertools.product((0, 1), repeat=len(self.shape))), dtype=np.int64) # [2^d*d]
+
+    def _weights(self, z):
+        '''
+        Return:
+            flat indices [B*2^d] of the surrounding grid points and their weights [B*2^d]
+        '''
+        z = torch.as_tensor(z).detach().cpu().double().numpy()
+        if z.ndim == 1:
+            z = z[None]
+        lower = np.empty(z.shape, dtype=np.int64)
+        t = np.empty(z.shape)
+        for d, axis in enumerate(self.axes):
+            i = np.clip(np.searchsorted(axis, z[:, d], side='right') - 1, 0, len(axis) - 2)
+            lower[:, d] = i
+            span = axis[i + 1] - axis[i]
+            # a cell of zero width (repeated coordinates) takes its lower point
+            t[:, d] = np.clip((z[:, d] - axis[i]) / np.where(span > 0, span, 1.), 0., 1.) * (span > 0)
+        index = (lower[:, None, :] + self.corners[None]) @ self.strides # [B*2^d]
+        weight = np.prod(np.where(self.corners[None] == 1, t[:, None, :], 1. - t[:, None, :]), axis=2)
+        return index, weight
+
+    def _interpolate(self, table, z):
+        index, weight = self._weights(z)
+        out = np.zeros((len(index),) + table.shape[1:], dtype=np.float32)
+        expand = (slice(None),) + (None,) * (table.ndim - 1)
+        for k in range(index.shape[1]): # one gather over the batch per corner
+            out += weight[:, k][expand].astype(np.float32) * table[index[:, k]]
+        return torch.from_numpy(out)
+
+    def __call__(self, z):
+        '''
+        Args:
+            z: latent vectors [B*latent_dim]
+        Return:
+            interpolated fields [B*C*W*L] as float32 tensor
+        '''
+        return self._interpolate(self.fields, z)
+
+    def interpolate_scalars(self, z):
+        '''
+        Return:
+            interpolated derived scalars [B*K] as float32 tensor, in the order of scalar_names
+        '''
+        if self.scalars is None:
+            raise ValueError('the grid was built without scalar_fns')
+        return self._interpolate(self.scalars, z)
+
+
+def interpolation_error(interpolator, decode_fn, z, batch_size=256):
+    '''
+    error of the lookup table against true decodes on held-out latent vectors, and the cost of both
+    Args:
+        interpolator: a LatentGridInterpolator
+        decode_fn: the network decode, e.g. model.decode in eval mode
+        z: held-out latent vectors [N*latent_dim], e.g. mu_list_test
+    Return:
+        dict with max/mean/rms absolute field error and the time per sample of interpolation and decode
+    '''
+    z = torch.as_tensor(z, dtype=torch.float32)
+    max_err, abs_sum, sq_sum, count = 0., 0., 0., 0
+    t_interp = t_decode = 0.
+    with torch.inference_mode():
+        for chunk in z.split(batch_size):
+            t0 = time.perf_counter()
+            approx = interpolator(chunk)
+            t1 = time.perf_counter()
+            exact = decode_fn(chunk).cpu()
+            t2 = time.perf_counter()
+            t_interp += t1 - t0
+            t_decode += t2 - t1
+            err = (approx - exact).abs()
+            max_err = max(max_err, err.max().item())
+            abs_sum += err.sum().item()
+            sq_sum += err.pow(2).sum().item()
+            count += err.numel()
+    return {'samples': len(z), 'max_error': max_err, 'mean_error': abs_sum / count, 'rms_error': (sq_sum / count) ** 0.5,
+            'interp_ms_per_sample': 1000. * t_interp / len(z), 'decode_ms_per_sample': 1000. * t_decode / len(z)}
+
+
+if __name__ == '__main__':
+    from .helper_inference_server import load_decoder
+    from .helper_latent_index import load_latents
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['build', 'error'])
+    parser.add_argument('--model', required=True, help='state dict of CNN_VAE')
+    parser.add_argument('--mu', required=True, help='saved latent vectors, training (build) or held-out (error)')
+    parser.add_argument('--latent-dim', type=int, default=6)
+    parser.add_argument('--decoder', default='legacy', choices=('legacy', 'upsample'), help='decoder variant of the model')
+    parser.add_argument('--input-size', type=int, default=90)
+    parser.add_argument('--points', type=int, nargs='+', default=[5], help='grid points, one value or one per dimension')
+    parser.add_argument('--quantile', type=float, default=0.005)
+    parser.add_argument('--batch-size', type=int, default=256)
+    parser.add_argument('--float16', action='store_true', help='store the fields as float16')
+    parser.add_argument('--holdout', type=int, default=1000, help='number of held-out vectors used by error')
+    parser.add_argument('--out', required=True, help='folder of the table')
+    args = parser.parse_args()
+
+    model = load_decoder(args.model, latent_dim=args.latent_dim, input_size=args.input_size, decoder=args.decoder)
+    mu = torch.from_numpy(np.array(load_latents(args.mu))) # .npy of the training script, or .pt of older runs
+    if args.command == 'build':
+        points = args.points[0] if len(args.points) == 1 else args.points
+        axes = grid_axes(*latent_bounds(mu, args.quantile), points)
+        # volume fraction of every channel as derived scalars
+        scalar_fns = {f'volume_fraction_{c}': (lambda x, c=c: x[:, c].mean(dim=(1, 2))) for c in range(model.channel_in)}
+        print(build_latent_grid(model.decode, axes, args.out, args.batch_size, scalar_fns,
+                                np.float16 if args.float16 else np.float32))
+    else:
+        index = torch.randperm(len(mu), generator=torch.Generator().manual_seed(0))[:args.holdout]
+        print(json.dumps(interpolation_error(LatentGridInterpolator(args.out), model.decode, mu[index]), indent=2))
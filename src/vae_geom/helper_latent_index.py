@@ -0,0 +1,369 @@
+'''
+latent index of an encoded unit-cell library with batched k-nearest-neighbour search
+
+A dataset is streamed through CNN_VAE.encode into a memory-mapped latent matrix, with the ids of the
+source samples. Queries (latent vectors, or target geometries that are encoded first) return the ids
+of the closest existing unit cells:
+
+    exact         brute force with BLAS, |q|^2 - 2 q.x + |x|^2, over blocks of the library
+    partitioned   inverted file: k-means lists, only the n_probe lists closest to a query are searched
+
+The index is a folder of .npy files: latents.npy [N*latent_dim], ids.npy [N], norms.npy [N], meta.json,
+and after build_partitions ivf_centroids.npy, ivf_offsets.npy, ivf_order.npy and ivf_latents.npy.
+
+    python -m vae_geom.helper_latent_index encode --model ./save_model/VAEmodel_last.pt --data rve_lattice_train.npy --out ./latent_index/
+    python -m vae_geom.helper_latent_index build --index ./latent_index/ --lists 1024
+    python -m vae_geom.helper_latent_index query --index ./latent_index/ --latents ./save_model/mu_list_test_last.npy --k 5 --probe 8
+    python -m vae_geom.helper_latent_index bench --n 1000000 --queries 1000 --k 10
+'''
+import os
+import json
+import time
+import argparse
+import tempfile
+
+import numpy as np
+import torch
+
+
+def load_latents(path, mmap=True):
+    '''
+    latent vectors saved by the training script, mu_list_*.npy (memory mapped), an artifact (.tensors, memory
+    mapped) or the torch tensors (.pt) of older runs
+    Return:
+        numpy array [N*latent_dim]
+    '''
+    if path.endswith('.pt'):
+        return torch.load(path, map_location='cpu').detach().numpy()
+    if path.endswith('.tensors'):
+        from .helper_artifact import load_artifact
+        return load_artifact(path, names=['data'])['data'].numpy()
+    return np.load(path, mmap_mode='r' if mmap else None)
+
+
+def squared_norms(latents, chunk=2**20):
+    ''' squared norms of the rows [N], in chunks of rows '''
+    norms = np.empty(len(latents), dtype=np.float32)
+    for start in range(0, len(latents), chunk):
+        block = np.asarray(latents[start:start + chunk], dtype=np.float32)
+        norms[start:start + chunk] = np.einsum('ij,ij->i', block, block)
+    return norms
+
+
+def write_library(folder, latents, ids=None, meta=None):
+    '''
+    write latent vectors as an index folder
+    Args:
+        latents: [N*latent_dim]
+        ids: source sample index per row [N], default 0..N-1
+        meta: optional dict stored in meta.json
+    Return:
+        folder
+    '''
+    os.makedirs(folder, exist_ok=True)
+    latents = np.asarray(latents, dtype=np.float32)
+    np.save(os.path.join(folder, 'latents.npy'), latents)
+    np.save(os.path.join(folder, 'ids.npy'), np.arange(len(latents)) if ids is None else np.asarray(ids, dtype=np.int64))
+    np.save(os.path.join(folder, 'norms.npy'), squared_norms(latents))
+    with open(os.path.join(folder, 'meta.json'), 'w') as f:
+        json.dump(dict(meta or {}, n=len(latents), latent_dim=latents.shape[1]), f, indent=2)
+    return folder
+
+
+def encode_dataset(model, data_path, folder, batch_size=256, device='cpu', num_workers=0):
+    '''
+    stream a dataset through model.encode into a memory-mapped index folder; row i holds the mean latent
+    vector of sample i, ids are the sample indices (global indices for a list of shards)
+    Args:
+        model: CNN_VAE or CNN_VAE3D
+        data_path: .npy file, quantized folder, list of shards or .h5 voxel file
+    Return:
+        folder
+    '''
+    from .helper_load_data import open_dataset, custom_transform, batch_loader
+    from .helper_latents import MemmapWriter
+    dataset = open_dataset(data_path, transform=custom_transform, batched=True, mmap=True)
+    loader = batch_loader(dataset, batch_size=batch_size, num_workers=num_workers)
+    os.makedirs(folder, exist_ok=True)
+    writer = MemmapWriter(os.path.join(folder, 'latents.npy'), len(dataset), (model.latent_dim,))
+    model.eval().to(device)
+    t0 = time.perf_counter()
+    with torch.inference_mode():
+        for x, idx in loader:
+            mu, _ = model.encode(x.to(device, non_blocking=True))
+            writer.write(idx, mu)
+    latents = np.load(writer.close(), mmap_mode='r')
+    np.save(os.path.join(folder, 'ids.npy'), np.arange(len(dataset), dtype=np.int64))
+    np.save(os.path.join(folder, 'norms.npy'), squared_norms(latents))
+    meta = {'n': len(dataset), 'latent_dim': model.latent_dim, 'encode_seconds': time.perf_counter() - t0,
+            'source': data_path if isinstance(data_path, (list, tuple)) else [data_path],
+            'shard_lengths': [len(shard) for shard in dataset.data.shards] if hasattr(dataset.data, 'shards') else None}
+    with open(os.path.join(folder, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=2)
+    return folder
+
+
+def kmeans(x, n_lists, iters=10, seed=0):
+    '''
+    Lloyd k-means with BLAS distances
+    Return:
+        centroids [min(n_lists, N)*latent_dim], float32
+    '''
+    rng = np.random.default_rng(seed)
+    n_lists = min(n_lists, len(x)) # every list starts at a distinct row
+    centroids = x[rng.choice(len(x), n_lists, replace=False)].copy()
+    for _ in range(iters):
+        assign = nearest_rows(x, centroids)
+        counts = np.bincount(assign, minlength=n_lists)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, x)
+        empty = counts == 0 # restart empty lists at random points
+        centroids = np.where(empty[:, None], x[rng.choice(len(x), n_lists)], sums / np.maximum(counts, 1)[:, None])
+    return centroids.astype(np.float32)
+
+
+def nearest_rows(x, centroids, max_elements=2**22):
+    ''' index of the nearest centroid of every row of x [N], the distance matrix is bounded to max_elements '''
+    chunk = max(1, max_elements // len(centroids))
+    c_norms = np.einsum('ij,ij->i', centroids, centroids)
+    assign = np.empty(len(x), dtype=np.int64)
+    for start in range(0, len(x), chunk):
+        block = np.asarray(x[start:start + chunk], dtype=np.float32)
+        d = block @ centroids.T
+        d *= -2.
+        d += c_norms[None]
+        assign[start:start + chunk] = np.argmin(d, axis=1)
+    return assign
+
+
+def _merge_topk(best_d, best_i, d, offset, k):
+    ''' merge the distances d [Q*M] of rows offset..offset+M into the running top-k (unsorted) '''
+    if d.shape[1] > k:
+        part = np.argpartition(d, k - 1, axis=1)[:, :k]
+        d, rows = np.take_along_axis(d, part, axis=1), part + offset
+    else:
+        rows = np.broadcast_to(np.arange(offset, offset + d.shape[1]), d.shape)
+    d, rows = np.concatenate([best_d, d], axis=1), np.concatenate([best_i, rows], axis=1)
+    part = np.argpartition(d, k - 1, axis=1)[:, :k]
+    return np.take_along_axis(d, part, axis=1), np.take_along_axis(rows, part, axis=1)
+
+
+class LatentIndex:
+    """k-nearest-neighbour search over an index folder written by `encode_dataset` or `write_library`.
+
+    Distances are Euclidean in the latent space. The library is only read through memory maps,
+    the exact search visits it in blocks of `block_rows` rows, so its size is not limited by the memory.
+
+    Attributes:
+        latents (numpy.ndarray): The library [N*latent_dim], memory mapped.
+        ids (numpy.ndarray): Source sample id of every row [N].
+        partitioned (bool): True if the inverted-file partitions are built.
+
+    Args:
+        folder (str): The index folder.
+        block_rows (int): Library rows per block of the exact search. Default is 2**18.
+    """
+    def __init__(self, folder, block_rows=2**18):
+        self.folder = folder
+        self.block_rows = block_rows
+        self.latents = np.load(os.path.join(folder, 'latents.npy'), mmap_mode='r')
+        self.ids = np.load(os.path.join(folder, 'ids.npy'), mmap_mode='r')
+        self.norms = np.load(os.path.join(folder, 'norms.npy'), mmap_mode='r')
+        self._load_partitions()
+
+    def _load_partitions(self):
+        path = os.path.join(self.folder, 'ivf_centroids.npy')
+        self.partitioned = os.path.exists(path)
+        if self.partitioned:
+            self.centroids = np.load(path)
+            self.offsets = np.load(os.path.join(self.folder, 'ivf_offsets.npy'))
+            self.order = np.load(os.path.join(self.folder, 'ivf_order.npy'), mmap_mode='r')
+            self.ivf_latents = np.load(os.path.join(self.folder, 'ivf_latents.npy'), mmap_mode='r')
+
+    def __len__(self):
+        return len(self.latents)
+
+    def build_partitions(self, n_lists=None, iters=10, sample=2**16, seed=0):
+        '''
+        cluster the library into n_lists k-means lists (trained on a sample of rows) and store the rows
+        grouped by list, contiguous on disk
+        Args:
+            n_lists: number of lists, default 4*sqrt(N), at most N
+        '''
+        n = len(self)
+        n_lists = min(n_lists or max(1, int(4 * np.sqrt(n))), n)
+        rng = np.random.default_rng(seed)
+        sample = min(n, max(sample, 32 * n_lists)) # at least 32 training rows per list
+        train = np.asarray(self.latents[np.sort(rng.choice(n, sample, replace=False))], dtype=np.float32)
+        centroids = kmeans(train, n_lists, iters, seed)
+        assign = nearest_rows(self.latents, centroids)
+        order = np.argsort(assign, kind='stable')
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=n_lists))])
+        grouped = np.lib.format.open_memmap(os.path.join(self.folder, 'ivf_latents.npy'), mode='w+',
+                                            dtype=np.float32, shape=self.latents.shape)
+        for start in range(0, n, self.block_rows):
+            rows = order[start:start + self.block_rows]
+            ascending = np.argsort(rows) # read the library in file order
+            block = np.empty((len(rows), self.latents.shape[1]), dtype=np.float32)
+            block[ascending] = self.latents[rows[ascending]]
+            grouped[start:start + len(rows)] = block
+        grouped.flush()
+        del grouped
+        np.save(os.path.join(self.folder, 'ivf_centroids.npy'), centroids)
+        np.save(os.path.join(self.folder, 'ivf_offsets.npy'), offsets)
+        np.save(os.path.join(self.folder, 'ivf_order.npy'), order)
+        self._load_partitions()
+
+    def search(self, queries, k=5, n_probe=None):
+        '''
+        Args:
+            queries: latent vectors [Q*latent_dim] (numpy or tensor) or one vector [latent_dim]
+            k: number of neighbours
+            n_probe: number of lists searched per query; None searches exactly
+        Return:
+            distances [Q*k] (ascending) and ids [Q*k] of the nearest library rows
+        '''
+        if torch.is_tensor(queries):
+            queries = queries.detach().cpu().numpy()
+        q = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        k = min(k, len(self))
+        if n_probe is None or not self.partitioned:
+            rows = self._exact(q, k)
+        else:
+            rows = self._probe(q, k, n_probe)
+        # exact distances of the k candidates, sorted
+        candidates = self.latents[rows.reshape(-1)].reshape(rows.shape + (-1,))
+        d = np.sqrt(((candidates - q[:, None]) ** 2).sum(-1))
+        order = np.argsort(d, axis=1)
+        rows = np.take_along_axis(rows, order, axis=1)
+        return np.take_along_axis(d, order, axis=1), np.asarray(self.ids[rows.reshape(-1)]).reshape(rows.shape)
+
+    def _exact(self, q, k, max_elements=2**24):
+        step = max(1, max_elements // self.block_rows) # queries per pass, bounds the distance matrix
+        if len(q) > step:
+            return np.concatenate([self._exact(q[i:i + step], k) for i in range(0, len(q), step)])
+        q_norms = np.einsum('ij,ij->i', q, q)[:, None]
+        best_d = np.full((len(q), 0), np.inf, dtype=np.float32)
+        best_i = np.zeros((len(q), 0), dtype=np.int64)
+        for start in range(0, len(self), self.block_rows):
+            block = np.asarray(self.latents[start:start + self.block_rows])
+            d = q_norms - 2. * (q @ block.T) + self.norms[start:start + len(block)][None]
+            best_d, best_i = _merge_topk(best_d, best_i, d, start, k)
+        return best_i
+
+    def _probe(self, q, k, n_probe):
+        n_probe = min(n_probe, len(self.centroids))
+        c_d = np.einsum('ij,ij->i', self.centroids, self.centroids)[None] - 2. * q @ self.centroids.T
+        lists = np.argpartition(c_d, n_probe - 1, axis=1)[:, :n_probe]
+        rows = np.empty((len(q), k), dtype=np.int64)
+        for i, probe in enumerate(lists):
+            span = np.concatenate([np.arange(self.offsets[l], self.offsets[l + 1]) for l in probe])
+            if len(span) < k: # too few candidates in the probed lists, fall back to the exact search
+                rows[i] = self._exact(q[i:i + 1], k)[0]
+                continue
+            candidates = np.concatenate([self.ivf_latents[self.offsets[l]:self.offsets[l + 1]] for l in probe])
+            d = ((candidates - q[i]) ** 2).sum(1)
+            best = np.argpartition(d, k - 1)[:k]
+            rows[i] = self.order[span[best]]
+        return rows
+
+    def query_geometries(self, model, x, k=5, n_probe=None, batch_size=256):
+        '''
+        closest library cells of target geometries
+        Args:
+            model: the CNN_VAE the library was encoded with, in eval mode
+            x: target fields [B*C*W*L]
+        Return:
+            distances [B*k] and ids [B*k]
+        '''
+        with torch.inference_mode():
+            mu = torch.cat([model.encode(chunk)[0] for chunk in torch.as_tensor(x).float().split(batch_size)])
+        return self.search(mu, k, n_probe)
+
+
+def benchmark(folder, n=1000000, latent_dim=6, n_queries=1000, k=10, n_lists=None, probes=(1, 4, 16), seed=0):
+    '''
+    build a random library of n gaussian latent vectors, then time exact and partitioned search
+    (per query, one query at a time and in one batch) and the recall of the partitioned search
+    Return:
+        list of dicts, one per search mode
+    '''
+    rng = np.random.default_rng(seed)
+    write_library(folder, rng.standard_normal((n, latent_dim), dtype=np.float32))
+    index = LatentIndex(folder)
+    t0 = time.perf_counter()
+    index.build_partitions(n_lists)
+    build_seconds = time.perf_counter() - t0
+    queries = rng.standard_normal((n_queries, latent_dim), dtype=np.float32)
+    _, exact_ids = index.search(queries, k)
+    results = []
+    for n_probe in (None,) + tuple(probes):
+        t0 = time.perf_counter()
+        _, ids = index.search(queries, k, n_probe)
+        batched_ms = 1000. * (time.perf_counter() - t0) / n_queries
+        single = queries[:min(n_queries, 50 if n_probe is None else 200)]
+        t0 = time.perf_counter()
+        for q in single:
+            index.search(q, k, n_probe)
+        single_ms = 1000. * (time.perf_counter() - t0) / len(single)
+        recall = np.mean([len(set(a) & set(b)) / k for a, b in zip(ids, exact_ids)])
+        results.append({'mode': 'exact' if n_probe is None else f'probe {n_probe}', 'n': n, 'k': k,
+                        'batched_ms_per_query': batched_ms, 'single_ms_per_query': single_ms, 'recall': recall,
+                        'n_lists': len(index.centroids), 'build_seconds': build_seconds})
+        print(f"{results[-1]['mode']:>10s}  batched {batched_ms:8.4f} ms/query  single {single_ms:8.4f} ms/query"
+              f"  recall@{k} {recall:.3f}")
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='command', required=True)
+    enc = sub.add_parser('encode', help='encode a dataset into an index folder')
+    enc.add_argument('--model', required=True, help='state dict of CNN_VAE, or of CNN_VAE3D for an .h5 file')
+    enc.add_argument('--data', required=True, nargs='+', help='.npy file(s), quantized folder(s) or one .h5 voxel file')
+    enc.add_argument('--latent-dim', type=int, default=6)
+    enc.add_argument('--decoder', default='legacy', choices=('legacy', 'upsample'), help='decoder variant of the model')
+    enc.add_argument('--input-size', type=int, default=90)
+    enc.add_argument('--batch-size', type=int, default=256)
+    enc.add_argument('--out', required=True)
+    build = sub.add_parser('build', help='build the partitioned index')
+    build.add_argument('--index', required=True)
+    build.add_argument('--lists', type=int, default=None)
+    query = sub.add_parser('query', help='nearest library ids of saved latent vectors')
+    query.add_argument('--index', required=True)
+    query.add_argument('--latents', required=True, help='mu_list_*.npy or .pt')
+    query.add_argument('--k', type=int, default=5)
+    query.add_argument('--probe', type=int, default=None, help='lists searched per query, exact if omitted')
+    query.add_argument('--out', default=None, help='.npz with distances and ids, printed if omitted')
+    bench = sub.add_parser('bench', help='search latency and recall on a random library')
+    bench.add_argument('--n', type=int, default=1000000)
+    bench.add_argument('--latent-dim', type=int, default=6)
+    bench.add_argument('--queries', type=int, default=1000)
+    bench.add_argument('--k', type=int, default=10)
+    bench.add_argument('--lists', type=int, default=None)
+    bench.add_argument('--probes', type=int, nargs='+', default=[1, 4, 16])
+    bench.add_argument('--work-dir', default=None, help='folder of the random library, a temporary folder if omitted')
+    args = parser.parse_args()
+
+    if args.command == 'encode':
+        from .inference import load_model
+        voxel = [path.lower().endswith(('.h5', '.hdf5')) for path in args.data]
+        if any(voxel) and len(args.data) > 1:
+            parser.error('an .h5 voxel file is encoded on its own, shards are .npy files or quantized folders')
+        # 2D fields: CNN_VAE of the given decoder and input size; .h5 voxel fields: CNN_VAE3D, whose
+        # channels and grid size are read from the file
+        model = load_model({'model_params': {'latent_dim': args.latent_dim, 'input_size': args.input_size,
+                                             'decoder': args.decoder}}, args.model, data_path=args.data[0])
+        print(encode_dataset(model, args.data if len(args.data) > 1 else args.data[0], args.out, args.batch_size))
+    elif args.command == 'build':
+        LatentIndex(args.index).build_partitions(args.lists)
+    elif args.command == 'query':
+        distances, ids = LatentIndex(args.index).search(load_latents(args.latents), args.k, args.probe)
+        if args.out is None:
+            print(ids)
+        else:
+            np.savez(args.out, distances=distances, ids=ids)
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            print(json.dumps(benchmark(args.work_dir or tmp, args.n, args.latent_dim, args.queries, args.k, args.lists,
+                                       args.probes), indent=2))
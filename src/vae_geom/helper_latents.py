@@ -0,0 +1,51 @@
+'''
+streaming storage of per-sample arrays (latent vectors, test inputs) in memory-mapped .npy files
+'''
+import os
+import numpy as np
+import torch
+
+
+class MemmapWriter:
+    """Preallocated, memory-mapped .npy file that per-sample arrays are streamed into batch by batch.
+
+    Rows are written at their sample index, so the file is in dataset order whatever the order of the
+    batches, and memory use does not depend on the number of samples.
+
+    Attributes:
+        path (str): Path of the .npy file.
+        data (numpy.memmap): The memory-mapped array [N*...].
+
+    Args:
+        path (str): Path of the .npy file, overwritten.
+        n (int): Number of samples (rows).
+        shape (tuple): Shape of one row, e.g. (latent_dim,).
+        dtype: Default is float32.
+    """
+    def __init__(self, path, n, shape, dtype=np.float32):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.data = np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=(n,) + tuple(shape))
+
+    def write(self, idx, values):
+        '''
+        Args:
+            idx: sample indices of the batch [B], tensor or numpy array
+            values: rows of the batch [B*...], tensor (any device) or numpy array
+        '''
+        if torch.is_tensor(idx):
+            idx = idx.cpu().numpy()
+        if torch.is_tensor(values):
+            values = values.detach().cpu().numpy()
+        self.data[idx] = values
+
+    def close(self):
+        ''' flush to disk and release the mapping
+        Return:
+            path of the .npy file
+        '''
+        if self.data is not None:
+            self.data.flush()
+            self.data = None
+        return self.path
@@ -0,0 +1,628 @@
+'''
+custom organize data set for pytorch 
+'''
+import os
+import json
+import random
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import torch
+import numpy as np
+from torch.utils.data import Dataset, DataLoader, BatchSampler, RandomSampler, SequentialSampler
+from torch.utils.data import default_collate
+
+def custom_transform(sample):
+    '''
+    define the transform of the data from [0,1] 
+    '''
+    # double float data
+    tensor_sample = torch.from_numpy(sample).float()  # Convert numpy array to tensor
+    # tensor_sample = torch.from_numpy(sample).double()  # Convert numpy array to tensor
+    
+    # Normalize to [0,1] 
+    normalized_sample = tensor_sample.sub_(0.).mul_(1.0)  # In-place subtraction and multiplication
+    return normalized_sample
+
+
+def batch_transform(batch, out=None, order=None):
+    '''
+    vectorized `custom_transform` for a whole batch: one float32 conversion of [B*C*W*L]
+    Args:
+        batch: numpy array [B*C*W*L]
+        out: optional float32 tensor with room for B samples to write into, e.g. a reusable pinned buffer
+        order: optional permutation, sample i of batch is written to position order[i] of the output
+    Return:
+        float32 tensor [B*C*W*L], a view of out if it is given
+    '''
+    if out is None:
+        out = torch.empty(batch.shape, dtype=torch.float32)
+    out = out[:len(batch)]
+    if order is None:
+        np.copyto(out.numpy(), batch, casting='unsafe')
+    else:
+        out.numpy()[order] = batch # cast and scatter back in one pass
+    return out
+
+
+def batch_collate(batch):
+    '''
+    collate function for `batch_loader`: batches coming from `custom_datasets.__getitems__`
+    are already collated, a list of single samples falls back to the default collate
+    '''
+    if isinstance(batch, tuple):
+        return batch
+    return default_collate(batch)
+
+
+def batch_loader(dataset, batch_size, shuffle=False, drop_last=False, generator=None, sampler=None, **kwargs):
+    '''
+    DataLoader that fetches whole batches through `custom_datasets.__getitems__`
+    (one fancy-index and one float32 conversion per batch) instead of one `__getitem__` per sample.
+    Args:
+        dataset: a custom_datasets instance, created with batched=True
+        batch_size: number of samples per batch
+        shuffle: draw the batches from a random permutation
+        drop_last: drop the last incomplete batch
+        generator: torch.Generator for the shuffling
+        sampler: sample order, e.g. a DistributedSampler; replaces shuffle and generator
+        kwargs: further DataLoader arguments, e.g. num_workers, pin_memory
+    Return:
+        torch.utils.data.DataLoader yielding (x [B*C*W*L], idx [B])
+    '''
+    if sampler is None:
+        sampler = RandomSampler(dataset, generator=generator) if shuffle else SequentialSampler(dataset)
+    sampler = BatchSampler(sampler, batch_size=batch_size, drop_last=drop_last)
+    if getattr(dataset, 'pin_memory', False):
+        kwargs['pin_memory'] = False # the dataset already writes into pinned memory
+    return DataLoader(dataset, batch_sampler=sampler, collate_fn=batch_collate, generator=generator, **kwargs)
+
+
+def seed_worker(worker_id):
+    '''
+    worker_init_fn: seed numpy and random of a DataLoader worker from its torch seed,
+    which torch derives from the loader generator and the worker id
+    '''
+    seed = torch.initial_seed() % 2**32
+    np.random.seed(seed)
+    random.seed(seed)
+
+
+def loader_kwargs(data_loader=None, seed=0):
+    '''
+    DataLoader arguments from the "data_loader" section of config_cluster.json
+    Args:
+        data_loader: dict with num_workers, persistent_workers, prefetch_factor, pin_memory, default is {}
+        seed: seed of the loader generator; every worker is seeded from it, so runs are reproducible
+            from manual_seed at any worker count
+    Return:
+        dict of keyword arguments for DataLoader / batch_loader
+    '''
+    data_loader = data_loader or {}
+    num_workers = data_loader.get('num_workers', 0)
+    kwargs = {'num_workers': num_workers,
+              'pin_memory': data_loader.get('pin_memory', True) and torch.cuda.is_available(),
+              'worker_init_fn': seed_worker,
+              'generator': torch.Generator().manual_seed(seed)}
+    if num_workers > 0: # only valid with worker processes
+        kwargs['persistent_workers'] = data_loader.get('persistent_workers', False)
+        kwargs['prefetch_factor'] = data_loader.get('prefetch_factor', 2)
+    return kwargs
+
+
+def load_channels(data_path, mmap=False, channels=2):
+    '''
+    load the first `channels` channels of a [N*C*W*L] .npy file
+    Args:
+        data_path: path to the .npy file, or to a quantized dataset folder (see `quantized_array`)
+        mmap: if True, return a read-only memory map; the channel slice is a view
+            and samples are only read from the page cache when indexed
+        channels: number of leading channels to keep
+    Return:
+        numpy array (or numpy.memmap view) of size [N*channels*W*L], a `quantized_array` for a quantized folder
+    '''
+    if os.path.isdir(data_path):
+        return quantized_array(data_path, mmap=mmap, channels=channels)
+    data = np.load(data_path, mmap_mode='r')[:, :channels, :, :]
+    if mmap:
+        return data
+    # only the selected channels are read into memory, in a single copy
+    return np.ascontiguousarray(data)
+
+
+class quantized_array:
+    """Read-only, array-like view of a quantized dataset folder written by `helper_quantize.quantize_dataset`.
+
+    The folder holds the stored values `data.npy` (uint8 or float16) [N*C*W*L], the float32 `scale.npy` and
+    `offset.npy`, broadcastable per sample [N*1*1*1], per channel [1*C*1*1] or per sample and channel [N*C*1*1],
+    and `meta.json`. Indexing dequantizes the selected samples in one vectorized pass, `value = stored * scale + offset`,
+    and returns float32 arrays, so it can stand in for the .npy array in `custom_datasets` and `sharded_array`.
+
+    Attributes:
+        stored (numpy.ndarray): The stored values, a read-only memory map in mmap mode.
+        scale, offset (numpy.ndarray): The dequantization parameters.
+        shape (tuple): Shape of the dataset [N*C*W*L].
+        dtype (numpy.dtype): float32, the type of the dequantized values.
+        meta (dict): Content of meta.json.
+    """
+    def __init__(self, folder, mmap=False, channels=2):
+        with open(os.path.join(folder, 'meta.json')) as f:
+            self.meta = json.load(f)
+        stored = np.load(os.path.join(folder, 'data.npy'), mmap_mode='r')[:, :channels]
+        self.stored = stored if mmap else np.ascontiguousarray(stored)
+        self.scale = np.load(os.path.join(folder, 'scale.npy'))[:, :channels]
+        self.offset = np.load(os.path.join(folder, 'offset.npy'))[:, :channels]
+        self.shape = self.stored.shape
+        self.dtype = np.dtype(np.float32)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, idx):
+        '''
+        Args:
+            idx: an integer, or a 1D integer index array
+        Return:
+            the dequantized sample [C*W*L] or samples [len(idx)*C*W*L], float32
+        '''
+        return self.dequantize(idx)
+
+    def dequantize(self, idx, out=None):
+        '''
+        Args:
+            idx: an integer, or a 1D integer index array
+            out: optional float32 array to write the samples into, e.g. the numpy view of a batch buffer
+        Return:
+            the dequantized samples, out if given
+        '''
+        stored = self.stored[idx]
+        scale = self.scale[idx] if len(self.scale) > 1 else self.scale[0]
+        offset = self.offset[idx] if len(self.offset) > 1 else self.offset[0]
+        out = np.multiply(stored, scale, out=out, dtype=np.float32)
+        out += offset
+        return out
+
+
+class sharded_array:
+    """Read-only, array-like concatenation of several [N_i*C*W*L] arrays along the first axis.
+
+    Used by `custom_datasets` for sharded multi-file input, so the shards (usually memory maps)
+    never have to be concatenated into one array in memory.
+
+    Attributes:
+        shards (list): The per-file arrays.
+        offsets (numpy.ndarray): Start index of every shard, followed by the total length.
+        shape (tuple): Shape of the concatenated array.
+        dtype (numpy.dtype): Data type of the shards.
+    """
+    def __init__(self, shards):
+        if len(shards) == 0:
+            raise ValueError("sharded_array needs at least one shard.")
+        sample_shape = shards[0].shape[1:]
+        for shard in shards:
+            if shard.shape[1:] != sample_shape:
+                raise ValueError(f"shard shape {shard.shape[1:]} does not match {sample_shape}")
+        self.shards = shards
+        self.offsets = np.cumsum([0] + [len(shard) for shard in shards])
+        self.shape = (int(self.offsets[-1]),) + tuple(sample_shape)
+        self.dtype = shards[0].dtype
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, idx):
+        '''
+        Args:
+            idx: an integer, or a 1D integer index array (fancy indexing over the first axis)
+        Return:
+            one sample [C*W*L], or the gathered samples [len(idx)*C*W*L] in the order of idx
+        '''
+        if np.isscalar(idx):
+            idx = int(idx)
+            if idx < 0:
+                idx += len(self)
+            if not 0 <= idx < len(self):
+                raise IndexError(f"index {idx} is out of range for {len(self)} samples")
+            shard = int(np.searchsorted(self.offsets, idx, side='right')) - 1
+            return self.shards[shard][idx - self.offsets[shard]]
+        idx = np.asarray(idx, dtype=np.int64)
+        idx = np.where(idx < 0, idx + len(self), idx)
+        out = np.empty((len(idx),) + self.shape[1:], dtype=self.dtype)
+        shard_of = np.searchsorted(self.offsets, idx, side='right') - 1
+        for shard in np.unique(shard_of):
+            mask = shard_of == shard
+            out[mask] = self.shards[shard][idx[mask] - self.offsets[shard]]
+        return out
+
+
+class custom_datasets(Dataset):
+    """Custom dataset for organizing and transforming datasets for PyTorch.
+
+    This dataset class is designed to load data from a specified file path, optionally apply a transformation to the data,
+    and support flattening the data for use with fully connected neural network layers.
+    With `mmap=True` the data is memory mapped instead of loaded, so samples are read lazily from the page cache
+    and memory use does not grow with the number of samples.
+
+    Attributes:
+        data (numpy.ndarray): The dataset loaded from the specified path, limited to the first two channels.
+            A read-only memory map view in mmap mode, a `sharded_array` when several files are given,
+            a `quantized_array` for a quantized dataset folder.
+        channels (int): The number of channels in the dataset.
+        dim (int): The dimension of the images (assumed square).
+        transform (callable, optional): A function/transform that takes in a sample and returns a transformed version.
+        flatten (bool): Whether to flatten the data for use with fully connected layers.
+
+    Args:
+        data_path (str or list): The file path to the dataset, expected to be a .npy file or a quantized
+            dataset folder, or a list of them (shards) that are concatenated along the sample axis.
+        transform (callable, optional): Optional transform to apply to each sample.
+        flatten (bool): If True, flattens the data for use with fully connected layers. Default is False.
+        mmap (bool): If True, memory map the .npy file(s) instead of loading them. Default is False.
+        batched (bool): If True, `__getitems__` returns whole collated batches, use with `batch_loader`. Default is False.
+        pin_memory (bool): In batched mode, write batches into page-locked memory. Only with num_workers=0.
+        reuse_buffer (bool): In batched mode, write every batch into the same preallocated buffer.
+            A batch is then only valid until the next one is fetched. Default is False.
+
+    The data must be stored in row major (C) order.
+    """
+
+    def __init__(self, data_path, transform=None,flatten = False, mmap=False,
+                 batched=False, pin_memory=False, reuse_buffer=False):
+        '''
+        Args: loading the dataset 
+            
+            data_path: path to the data, and  size should be [N*C*W*L]
+                N: number of images
+                C: number of channels (gray scale = 1, RGB = 3)
+                W: width of the image
+                L: length of the image
+            transform: transform the data, default is None
+            flatten:  flatten is used  only for a flatten NN layer, default is False
+            mmap: memory map the data instead of loading it into RAM, default is False
+            batched: fetch whole batches in `__getitems__`, default is False
+            pin_memory: pin the batches in batched mode, default is False
+            reuse_buffer: reuse one float32 buffer for all batches in batched mode, default is False
+        '''
+        if not data_path:
+            raise ValueError("Please provide a valid data_path to your dataset.")
+        
+        self.data_path = data_path
+        self.mmap = mmap
+        self.data = self._load()
+        self.batched = batched
+        self.pin_memory = pin_memory
+        self.reuse_buffer = reuse_buffer
+        self._buffer = None
+        # print('data size',self.data.shape)
+        self.channels = self.data.shape[1] #number of channels
+        # size of each image, square image
+        self.dim = self.data.shape[2] 
+        self.transform = transform
+        self.flatten = flatten
+
+    def _load(self):
+        # only first two channel is expected
+        if isinstance(self.data_path, (list, tuple)):
+            return sharded_array([load_channels(path, mmap=self.mmap) for path in self.data_path])
+        return load_channels(self.data_path, mmap=self.mmap)
+
+    def __getstate__(self):
+        '''
+        memory maps are reopened instead of copied when the dataset is sent to DataLoader worker processes
+        '''
+        state = self.__dict__.copy()
+        state['_buffer'] = None
+        if self.mmap:
+            state['data'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.data is None:
+            self.data = self._load()
+
+    def __len__(self):
+        '''
+            Args: return the size of data
+            this function will  used for torch.utils.data.DataLoader
+        '''
+        return len(self.data)
+    
+    def __getitem__(self, idx):
+        '''
+        Thix function will  used for torch.utils.data.DataLoader
+        Args: 
+            idx: a list, size of batch_size, random choose the index of the data
+        '''
+        # note, the first dimension is the channel, then height*width
+        sample = self.data[idx]
+        if self.mmap: # copy the sample out of the read-only page cache
+            sample = np.array(sample)
+        # label = ... # no label for this dataset
+
+
+        if self.transform: # if transform is not None, normlize the data
+            sample = self.transform(sample)
+        if self.flatten:
+             sample = sample.view(-1)# when flatten is used for a flatten NN layer
+        return sample,idx
+
+    def __getitems__(self, indices):
+        '''
+        Batched fetch, used by torch.utils.data.DataLoader instead of `__getitem__` when batching is automatic.
+        Args:
+            indices: list of sample indices of one batch
+        Return:
+            batched mode: the collated batch (x [B*C*W*L], idx [B])
+            otherwise: list of (sample, idx), as DataLoader would build it from `__getitem__`
+        '''
+        if not self.batched:
+            return [self[idx] for idx in indices]
+        idx = np.asarray(indices, dtype=np.int64)
+        if isinstance(self.data, quantized_array) and self.transform is custom_transform:
+            # dequantize the batch straight into the output buffer, in the requested order
+            batch = self._batch_buffer(len(idx))
+            self.data.dequantize(idx, out=batch.numpy())
+            if self.flatten:
+                batch = batch.view(len(idx), -1)
+            return batch, torch.from_numpy(idx)
+        order = np.argsort(idx, kind='stable') # read in file order
+        gathered = self.data[idx[order]] # one fancy-index for the whole batch
+        if self.transform is custom_transform:
+            batch = batch_transform(gathered, out=self._batch_buffer(len(idx)), order=order)
+        else:
+            samples = np.empty_like(gathered)
+            samples[order] = gathered
+            if self.transform:
+                batch = torch.stack([self.transform(sample) for sample in samples])
+            else:
+                batch = torch.from_numpy(samples)
+        if self.flatten:
+            batch = batch.view(len(idx), -1)
+        return batch, torch.from_numpy(idx)
+
+    def _batch_buffer(self, batch_size):
+        '''
+        float32 output buffer for one batch; the same buffer is returned every time if reuse_buffer is set
+        '''
+        shape = (batch_size,) + tuple(self.data.shape[1:])
+        if self.reuse_buffer and self._buffer is not None and len(self._buffer) >= batch_size:
+            return self._buffer[:batch_size]
+        buffer = torch.empty(shape, dtype=torch.float32, pin_memory=self.pin_memory)
+        if self.reuse_buffer:
+            self._buffer = buffer
+        return buffer
+
+
+
+def write_voxel_dataset(data_path, sdfs, isovalues=None, chunks=None, compression='gzip', compression_opts=4,
+                        key='sdfs', scalar_key='isovalues', dtype=np.float32):
+    '''
+    write 3D voxel fields (e.g. SDFs) to a chunked, compressed HDF5 file readable by `voxel_datasets`,
+    the layout of test_data_save_load.py ('sdfs' [N*C*D*W*L] and 'isovalues' [N])
+    Args:
+        data_path: path of the .h5 file, overwritten
+        sdfs: array [N*C*D*W*L], may be memory-mapped, it is written in blocks of chunks[0] samples
+        isovalues: optional per-sample scalars [N]
+        chunks: HDF5 chunk shape, default (1, C, D, W, L), one sample per chunk
+        compression: 'gzip', 'lzf' or None
+        compression_opts: gzip level 0-9
+    Return:
+        data_path
+    '''
+    import h5py
+    shape = tuple(sdfs.shape)
+    chunks = tuple(chunks) if chunks is not None else (1,) + shape[1:]
+    with h5py.File(data_path, 'w') as f:
+        data = f.create_dataset(key, shape=shape, dtype=dtype, chunks=chunks, compression=compression,
+                                compression_opts=compression_opts if compression == 'gzip' else None,
+                                shuffle=compression is not None)
+        step = chunks[0] * max(1, 64 // chunks[0]) # whole chunks per write
+        for start in range(0, shape[0], step):
+            data[start:start + step] = sdfs[start:start + step]
+        if isovalues is not None:
+            f.create_dataset(scalar_key, data=np.asarray(isovalues))
+    return data_path
+
+
+class voxel_datasets(Dataset):
+    """3D voxel fields [N*C*D*W*L] (e.g. SDFs) read lazily from a chunked, compressed HDF5 file.
+
+    Samples are read in blocks of whole chunks along the sample axis (chunks[0] samples), every chunk is
+    decompressed once and kept in an LRU cache of at most `cache_bytes`. When the blocks are accessed in order
+    (e.g. the test set or encoding), the next `readahead` blocks are read by a background thread while the
+    current one is used. Every process opens its own file handle on first access, so the dataset can be
+    used with DataLoader worker processes.
+
+    Attributes:
+        data_path (str): Path of the .h5 file.
+        shape (tuple): Shape of the stored fields [N*C*D*W*L].
+        dtype (numpy.dtype): Type of the stored fields.
+        chunks (tuple): HDF5 chunk shape of the fields.
+        scalars (numpy.ndarray): The per-sample scalars (isovalues), None if the file has none.
+        channels (int): Number of channels.
+        dim (int): Size of each (cubic) voxel grid.
+
+    Args:
+        data_path (str): The .h5 file, as written by `write_voxel_dataset`.
+        key (str): Name of the fields. Default is 'sdfs'.
+        scalar_key (str): Name of the per-sample scalars. Default is 'isovalues'.
+        transform (callable, optional): Optional transform to apply to each sample.
+        batched (bool): If True, `__getitems__` returns whole collated batches, use with `batch_loader`. Default is False.
+        cache_bytes (int): Size limit of the cache of decompressed blocks. Default is 256 MB.
+        readahead (int): Number of blocks read ahead on sequential access, 0 disables it. Default is 2.
+    """
+    def __init__(self, data_path, key='sdfs', scalar_key='isovalues', transform=None, batched=False,
+                 cache_bytes=256 * 2**20, readahead=2):
+        import h5py
+        if not data_path:
+            raise ValueError("Please provide a valid data_path to your dataset.")
+        self.data_path = data_path
+        self.key = key
+        self.transform = transform
+        self.batched = batched
+        self.cache_bytes = cache_bytes
+        self.readahead = readahead
+        with h5py.File(data_path, 'r') as f:
+            data = f[key]
+            if data.ndim != 5:
+                raise ValueError(f'{key} of {data_path} must be [N*C*D*W*L], got shape {data.shape}')
+            self.shape = data.shape
+            self.dtype = data.dtype
+            self.chunks = data.chunks or (1,) + data.shape[1:] # contiguous layout: read sample by sample
+            self.scalars = f[scalar_key][:] if scalar_key in f else None
+        self.block = self.chunks[0] # samples per read
+        self.channels = self.shape[1]
+        self.dim = self.shape[2]
+        self._reset()
+
+    def _reset(self):
+        self._file = None
+        self._pid = None
+        self._cache = OrderedDict() # block number -> decompressed samples
+        self._cached_bytes = 0
+        self._pending = {} # block number -> future of a read-ahead
+        self._executor = None
+        self._last_block = None
+
+    @property
+    def data(self):
+        ''' the HDF5 dataset of the fields, opened once per process '''
+        if self._pid != os.getpid(): # first access, or a forked worker: never share a handle
+            import h5py
+            self._reset()
+            self._file = h5py.File(self.data_path, 'r')
+            self._pid = os.getpid()
+        return self._file[self.key]
+
+    def __getstate__(self):
+        '''
+        file handle, cache and read-ahead thread are not sent to DataLoader worker processes, every worker opens its own
+        '''
+        state = self.__dict__.copy()
+        for name in ('_file', '_pid', '_cache', '_pending', '_executor', '_last_block'):
+            state[name] = None
+        state['_cached_bytes'] = 0
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._reset()
+
+    def _read(self, b):
+        return self.data[b * self.block:(b + 1) * self.block]
+
+    def _get_block(self, b):
+        '''
+        samples of block b, from the cache, a finished read-ahead or the file
+        '''
+        data = self.data # opens the file in a new process
+        if b in self._cache:
+            self._cache.move_to_end(b)
+            samples = self._cache[b]
+        else:
+            future = self._pending.pop(b, None)
+            samples = future.result() if future is not None else self._read(b)
+            self._cache[b] = samples
+            self._cached_bytes += samples.nbytes
+            while self._cached_bytes > self.cache_bytes and len(self._cache) > 1:
+                self._cached_bytes -= self._cache.popitem(last=False)[1].nbytes
+        if self.readahead > 0 and self._last_block is not None and b == self._last_block + 1:
+            self._read_ahead(b, len(data))
+        self._last_block = b
+        return samples
+
+    def _read_ahead(self, b, n):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1)
+        for ahead in range(b + 1, min(b + 1 + self.readahead, (n + self.block - 1) // self.block)):
+            if ahead not in self._cache and ahead not in self._pending:
+                self._pending[ahead] = self._executor.submit(self._read, ahead)
+
+    def close(self):
+        ''' close the file handle of this process and stop the read-ahead thread '''
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+        if self._file is not None and self._pid == os.getpid():
+            self._file.close()
+        self._reset()
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, idx):
+        '''
+        Args:
+            idx: index of the sample
+        Return:
+            sample [C*D*W*L] (after transform) and idx
+        '''
+        b = idx // self.block
+        sample = np.array(self._get_block(b)[idx - b * self.block])
+        if self.transform:
+            sample = self.transform(sample)
+        return sample, idx
+
+    def __getitems__(self, indices):
+        '''
+        Batched fetch, every block of the batch is read once.
+        Return:
+            batched mode: the collated batch (x [B*C*D*W*L], idx [B])
+            otherwise: list of (sample, idx)
+        '''
+        if not self.batched:
+            return [self[idx] for idx in indices]
+        idx = np.asarray(indices, dtype=np.int64)
+        blocks = idx // self.block
+        gathered = np.empty((len(idx),) + tuple(self.shape[1:]), dtype=self.dtype)
+        for b in np.unique(blocks): # ascending, sequential reads trigger the read-ahead
+            rows = np.nonzero(blocks == b)[0]
+            gathered[rows] = self._get_block(b)[idx[rows] - b * self.block]
+        if self.transform is custom_transform:
+            batch = batch_transform(gathered)
+        elif self.transform:
+            batch = torch.stack([self.transform(sample) for sample in gathered])
+        else:
+            batch = torch.from_numpy(gathered)
+        return batch, torch.from_numpy(idx)
+
+
+def open_dataset(data_path, **kwargs):
+    '''
+    dataset of a data file: .h5/.hdf5 files hold 3D voxel fields (`voxel_datasets`),
+    everything else 2D fields in .npy files (`custom_datasets`)
+    Args:
+        data_path: path of the data, or a list of .npy shards
+        kwargs: arguments of the dataset class, e.g. transform, batched
+    '''
+    if isinstance(data_path, str) and os.path.splitext(data_path)[1].lower() in ('.h5', '.hdf5'):
+        kwargs.pop('flatten', None)
+        kwargs.pop('mmap', None) # voxel files are always read lazily
+        return voxel_datasets(data_path, **kwargs)
+    return custom_datasets(data_path, **kwargs)
+
+
+
+# # test the data set
+# def test_data_load():
+#     import torch 
+#     from torchvision import transforms
+#     from torch.utils.data import DataLoader    
+#     from helper_dataset import custom_datasets
+#     psedo_data = np.random.rand(359,100)
+#     # for i in range(359):
+#     #     psedo_data[i,:] = np.repeat(i,100)
+#     # np.save('./data/GEOMATRY/psedo_data.npy',psedo_data)
+#     data_path = './data/GEOMATRY/pseudo_rbg.npy'
+#     data = np.load(data_path)
+#     print(data.shape)
+#     # dataset = custom_datasets(data_path,transform=custom_transform)
+
+#     # print(dataset[0].shape)
+#     # dataset.shape()
+#     return data
+
+# dataset = test_data_load()
+# # device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+# # for x in dataset:
+# #     x = x.to(device)
+#     print(x.shape)
@@ -0,0 +1,148 @@
+'''
+convert a .npy dataset [N*C*W*L] to the compact quantized format read by custom_datasets
+
+The quantized dataset is a folder with
+    data.npy      stored values, uint8 or float16 [N*C*W*L]
+    scale.npy     float32 scale, per sample [N*1*1*1], per channel [1*C*1*1] or per sample and channel [N*C*1*1]
+    offset.npy    float32 offset, same shape as the scale
+    meta.json     format, granularity, shapes and the conversion report
+and is dequantized batch by batch when read, value = stored * scale + offset.
+
+    python -m vae_geom.helper_quantize rve_lattice_train.npy rve_lattice_train_u8 --dtype uint8 --granularity sample
+'''
+import os
+import json
+import time
+import argparse
+
+import numpy as np
+
+from .helper_load_data import custom_datasets, custom_transform, batch_loader
+
+GRANULARITIES = ('sample', 'channel', 'sample_channel')
+LEVELS = 255 # uint8 quantization levels - 1
+
+
+def value_range(data, granularity, chunk=1024):
+    '''
+    minimum and maximum of data [N*C*W*L] per granularity, streamed in chunks of samples
+    Return:
+        lo, hi as float64 arrays broadcastable to data, [N*1*1*1], [1*C*1*1] or [N*C*1*1]
+    '''
+    n, c = data.shape[:2]
+    if granularity == 'channel':
+        lo, hi = np.full((1, c, 1, 1), np.inf), np.full((1, c, 1, 1), -np.inf)
+    else:
+        lo = np.empty((n, c if granularity == 'sample_channel' else 1, 1, 1))
+        hi = np.empty_like(lo)
+    axes = (2, 3) if granularity == 'sample_channel' else (1, 2, 3)
+    for start in range(0, n, chunk):
+        x = np.asarray(data[start:start + chunk], dtype=np.float64)
+        if granularity == 'channel':
+            lo = np.minimum(lo, x.min(axis=(0, 2, 3), keepdims=True))
+            hi = np.maximum(hi, x.max(axis=(0, 2, 3), keepdims=True))
+        else:
+            lo[start:start + chunk] = x.min(axis=axes, keepdims=True)
+            hi[start:start + chunk] = x.max(axis=axes, keepdims=True)
+    return lo, hi
+
+
+def quantize_dataset(src_path, dst_folder, dtype='uint8', granularity='sample', channels=2, chunk=1024):
+    '''
+    write the quantized dataset of a .npy file, streamed in chunks of samples so the source may be larger than the memory
+    Args:
+        src_path: .npy file [N*C*W*L]
+        dst_folder: output folder, created
+        dtype: 'uint8' (affine quantization to 256 levels) or 'float16'
+        granularity: scale per 'sample', per 'channel' or per 'sample_channel', uint8 only
+        channels: number of leading channels kept, the training reads the first two
+    Return:
+        the report: reconstruction error of the dequantized values and the disk / RAM bytes against the .npy baseline
+    '''
+    if dtype not in ('uint8', 'float16'):
+        raise ValueError(f"unknown dtype {dtype}, use 'uint8' or 'float16'")
+    if granularity not in GRANULARITIES:
+        raise ValueError(f'unknown granularity {granularity}, use one of {GRANULARITIES}')
+    source = np.load(src_path, mmap_mode='r')
+    data = source[:, :channels]
+    n, c = data.shape[:2]
+    os.makedirs(dst_folder, exist_ok=True)
+    if dtype == 'uint8':
+        lo, hi = value_range(data, granularity, chunk)
+        scale = (hi - lo) / LEVELS
+        scale[scale == 0] = 1. # constant fields
+        offset = lo
+    else: # float16 keeps the values, no scaling
+        granularity = None
+        scale, offset = np.ones((1, c, 1, 1)), np.zeros((1, c, 1, 1))
+    scale, offset = scale.astype(np.float32), offset.astype(np.float32)
+
+    stored = np.lib.format.open_memmap(os.path.join(dst_folder, 'data.npy'), mode='w+', dtype=dtype, shape=data.shape)
+    max_err, abs_sum, sq_sum = 0., 0., 0.
+    t0 = time.perf_counter()
+    for start in range(0, n, chunk):
+        x = np.asarray(data[start:start + chunk], dtype=np.float64)
+        s = scale[start:start + chunk] if len(scale) > 1 else scale
+        o = offset[start:start + chunk] if len(offset) > 1 else offset
+        if dtype == 'uint8':
+            q = np.clip(np.rint((x - o) / s), 0, LEVELS).astype(np.uint8)
+        else:
+            q = x.astype(np.float16)
+        stored[start:start + chunk] = q
+        err = np.abs(q.astype(np.float32) * s + o - x) # the error of the float32 dequantization that is read
+        max_err = max(max_err, float(err.max()))
+        abs_sum += float(err.sum())
+        sq_sum += float(np.square(err).sum())
+    stored.flush()
+    del stored
+    np.save(os.path.join(dst_folder, 'scale.npy'), scale)
+    np.save(os.path.join(dst_folder, 'offset.npy'), offset)
+
+    count = data.size
+    quantized_bytes = sum(os.path.getsize(os.path.join(dst_folder, name)) for name in ('data.npy', 'scale.npy', 'offset.npy'))
+    baseline_ram = count * source.dtype.itemsize # the channels custom_datasets holds in memory from the .npy file
+    ram = count * np.dtype(dtype).itemsize + scale.nbytes + offset.nbytes
+    report = {'max_error': max_err, 'mean_error': abs_sum / count, 'rms_error': (sq_sum / count) ** 0.5,
+              'source_bytes': os.path.getsize(src_path), 'quantized_bytes': quantized_bytes,
+              'disk_ratio': quantized_bytes / os.path.getsize(src_path),
+              'source_ram_bytes': baseline_ram, 'quantized_ram_bytes': ram, 'ram_ratio': ram / baseline_ram,
+              'convert_seconds': time.perf_counter() - t0}
+    meta = {'format': 'quantized', 'dtype': dtype, 'granularity': granularity, 'shape': list(data.shape),
+            'source': os.path.abspath(src_path), 'source_dtype': str(source.dtype), 'report': report}
+    with open(os.path.join(dst_folder, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=2)
+    return report
+
+
+def read_throughput(data_path, mmap=True, batch_size=256, passes=2):
+    '''
+    samples/sec of full passes over a dataset with custom_datasets and batch_loader (after a warm-up pass),
+    including the dequantization for quantized folders
+    '''
+    dataset = custom_datasets(data_path, transform=custom_transform, mmap=mmap, batched=True)
+    loader = batch_loader(dataset, batch_size=batch_size, shuffle=True)
+    for _ in loader: # warm-up, fills the page cache
+        pass
+    t0 = time.perf_counter()
+    for _ in range(passes):
+        for x, _ in loader:
+            pass
+    return passes * len(dataset) / (time.perf_counter() - t0)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('src', help='.npy file [N*C*W*L]')
+    parser.add_argument('dst', help='output folder')
+    parser.add_argument('--dtype', default='uint8', choices=('uint8', 'float16'))
+    parser.add_argument('--granularity', default='sample', choices=GRANULARITIES)
+    parser.add_argument('--channels', type=int, default=2)
+    parser.add_argument('--chunk', type=int, default=1024)
+    parser.add_argument('--benchmark', action='store_true', help='also compare the read throughput with the .npy file')
+    args = parser.parse_args()
+
+    report = quantize_dataset(args.src, args.dst, args.dtype, args.granularity, args.channels, args.chunk)
+    if args.benchmark:
+        report['source_samples_per_sec'] = read_throughput(args.src)
+        report['quantized_samples_per_sec'] = read_throughput(args.dst)
+    print(json.dumps(report, indent=2))
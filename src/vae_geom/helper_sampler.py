@@ -0,0 +1,262 @@
+'''
+constrained generative sampling of new unit-cell designs
+
+Latent vectors are drawn in rounds from the prior N(0, I) of CNN_VAE or from a Gaussian fitted to a saved
+mu_list. Every round is filtered as a whole: latent constraints first (minimum distance to the existing
+designs and to the designs accepted so far), then the survivors are decoded in batches and filtered on
+their descriptors (e.g. a volume-fraction window, see helper_descriptors). The size of the next round is
+set from the acceptance rate so far, accepted designs are streamed into memory-mapped .npy files, and the
+result only depends on the seed.
+
+    python -m vae_geom.helper_sampler --model ./save_model/VAEmodel_last.pt --n 1000 --out ./designs/ \
+        --proposal gaussian --mu ./save_model/mu_list_last.npy --window volume_fraction 0.3 0.5 --min-distance 0.2
+
+writes designs/fields.npy [n*C*W*L], designs/latents.npy [n*latent_dim], designs/descriptors.npy [n*C*k]
+and designs/meta.json (descriptor names, rounds, acceptance rate).
+'''
+import os
+import json
+import time
+import math
+import argparse
+
+import numpy as np
+import torch
+
+from .helper_latents import MemmapWriter
+
+
+class latent_proposal:
+    """Distribution new latent vectors are drawn from.
+
+    Attributes:
+        mean (torch.Tensor): Mean [latent_dim].
+        scale_tril (torch.Tensor): Cholesky factor of the covariance [latent_dim*latent_dim].
+
+    Args:
+        latent_dim (int): Dimension of the latent space, used by the prior.
+        mu (array, optional): Saved latent vectors [N*latent_dim]; a Gaussian is fitted to them. Default is
+            None, the prior N(0, I).
+        temperature (float): Scale of the standard deviation, < 1 stays closer to the mean. Default is 1.
+    """
+    def __init__(self, latent_dim=6, mu=None, temperature=1.):
+        if mu is None:
+            self.mean = torch.zeros(latent_dim)
+            self.scale_tril = torch.eye(latent_dim)
+        else:
+            mu = np.asarray(mu, dtype=np.float64)
+            cov = np.cov(mu, rowvar=False) + 1e-9 * np.eye(mu.shape[1])
+            self.mean = torch.from_numpy(mu.mean(axis=0)).float()
+            self.scale_tril = torch.from_numpy(np.linalg.cholesky(cov)).float()
+        self.scale_tril = self.scale_tril * temperature
+
+    def sample(self, n, generator):
+        ''' [n*latent_dim] '''
+        eps = torch.randn(n, len(self.mean), generator=generator)
+        return self.mean + eps @ self.scale_tril.T
+
+
+def min_distances(z, reference, block=8192):
+    ''' distance of every row of z to its nearest row of reference [len(z)], inf if reference is empty '''
+    if reference is None or len(reference) == 0:
+        return torch.full((len(z),), float('inf'))
+    best = torch.full((len(z),), float('inf'))
+    for start in range(0, len(reference), block):
+        ref = torch.as_tensor(np.asarray(reference[start:start + block], dtype=np.float32))
+        best = torch.minimum(best, torch.cdist(z, ref).min(dim=1).values)
+    return best
+
+
+def distinct_rows(z, min_distance):
+    '''
+    greedy selection in draw order of the rows that are at least min_distance from every earlier selected row
+    Return:
+        boolean mask [len(z)]
+    '''
+    keep = torch.ones(len(z), dtype=torch.bool)
+    if min_distance <= 0 or len(z) < 2:
+        return keep
+    close = torch.cdist(z, z) < min_distance
+    close.fill_diagonal_(False)
+    for i in range(len(z)): # only rows with a close neighbour are visited
+        if keep[i] and close[i].any():
+            keep[i + 1:] &= ~close[i, i + 1:]
+    return keep
+
+
+def sample_designs(decode_fn, n, out_dir, proposal, windows=None, isovalue=0.5, existing=None, min_distance=0.,
+                   round_size=1024, min_round=256, max_round=65536, decode_batch=256, max_draws=None, seed=0,
+                   dtype=np.float32, verbose=False):
+    '''
+    draw, decode and filter latent vectors in rounds until n designs are accepted
+    Args:
+        decode_fn: decodes latent vectors [B*latent_dim] to fields [B*C*W*L], e.g. model.decode in eval mode
+        n: number of designs wanted
+        out_dir: folder of fields.npy, latents.npy, descriptors.npy and meta.json
+        proposal: latent_proposal
+        windows: dict descriptor name -> (channel, low, high), e.g. {'volume_fraction': (0, 0.3, 0.5)};
+                 None (or a None bound) leaves a side open
+        isovalue: isovalue of the descriptors
+        existing: latent vectors of the existing designs [M*latent_dim], e.g. the saved mu_list
+        min_distance: minimum latent distance of an accepted design to the existing and the other accepted designs
+        round_size: latent vectors drawn in the first round
+        min_round, max_round: bounds of the round size, max_round bounds the memory of a round
+        decode_batch: latent vectors decoded per call
+        max_draws: stop after this many draws even if fewer than n designs are accepted, default 1000*n
+        seed: seed of the draws, the accepted designs only depend on it
+    Return:
+        the meta dict (also written to meta.json)
+    '''
+    from .helper_descriptors import descriptors, DESCRIPTORS
+
+    windows = windows or {}
+    unknown = set(windows) - set(DESCRIPTORS)
+    if unknown:
+        raise ValueError(f'unknown descriptors {sorted(unknown)}, use {DESCRIPTORS}')
+    # the volume fraction is stored in any case, the descriptors are evaluated from the cheapest
+    names = tuple(name for name in DESCRIPTORS if name in windows or name == 'volume_fraction')
+    max_draws = 1000 * n if max_draws is None else max_draws
+    generator = torch.Generator().manual_seed(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    with torch.inference_mode(): # shape of the fields, so every file is written even if no design is accepted
+        probe = decode_fn(proposal.mean[None])
+    latent_writer = MemmapWriter(os.path.join(out_dir, 'latents.npy'), n, (len(proposal.mean),))
+    field_writer = MemmapWriter(os.path.join(out_dir, 'fields.npy'), n, probe.shape[1:], dtype)
+    desc_writer = MemmapWriter(os.path.join(out_dir, 'descriptors.npy'), n, (probe.shape[1], len(names)))
+    del probe
+    accepted_z = torch.zeros(0, len(proposal.mean))
+    accepted, drawn, rounds, size = 0, 0, [], round_size
+    t0 = time.perf_counter()
+    with torch.inference_mode():
+        while accepted < n and drawn < max_draws:
+            size = min(size, max_draws - drawn)
+            z = proposal.sample(size, generator)
+            drawn += size
+            # latent constraints, before the decoder
+            keep = torch.ones(size, dtype=torch.bool)
+            if min_distance > 0:
+                keep &= min_distances(z, existing) >= min_distance
+                keep &= min_distances(z, accepted_z) >= min_distance
+            z_latent = z[keep]
+            # field constraints, decoded in batches; accepted rows are written at once, a round holds one batch of fields
+            round_accepted = 0
+            for chunk in z_latent.split(decode_batch):
+                if accepted == n:
+                    break
+                x = decode_fn(chunk)
+                # descriptors from the cheapest, each on the rows that passed the windows before
+                rows = torch.arange(len(chunk), device=x.device)
+                values = {}
+                for name in names:
+                    value = descriptors(x[rows], isovalue, names=(name,))[name]
+                    values[name] = value
+                    if name in windows:
+                        channel, low, high = windows[name]
+                        ok = torch.ones(len(rows), dtype=torch.bool, device=x.device)
+                        if low is not None:
+                            ok &= value[:, channel] >= low
+                        if high is not None:
+                            ok &= value[:, channel] <= high
+                        rows = rows[ok]
+                        values = {k: v[ok] for k, v in values.items()}
+                rows = rows.cpu()
+                if min_distance > 0: # apart from the designs accepted earlier in this round and from each other
+                    ok = min_distances(chunk[rows], accepted_z) >= min_distance
+                    ok[ok.clone()] = distinct_rows(chunk[rows[ok]], min_distance)
+                else:
+                    ok = torch.ones(len(rows), dtype=torch.bool)
+                take = ok.nonzero().squeeze(1)[:n - accepted] # positions in rows
+                if not len(take):
+                    continue
+                x_new = x[rows[take].to(x.device)]
+                d_new = torch.stack([values[k] for k in names], dim=-1)[take.to(x.device)]
+                take = rows[take]
+                idx = np.arange(accepted, accepted + len(take))
+                latent_writer.write(idx, chunk[take])
+                field_writer.write(idx, x_new)
+                desc_writer.write(idx, d_new)
+                accepted_z = torch.cat([accepted_z, chunk[take]])
+                accepted += len(take)
+                round_accepted += len(take)
+            rounds.append({'drawn': size, 'latent_passed': int(keep.sum()), 'accepted': round_accepted})
+            # next round: the draws expected for the missing designs at the acceptance rate so far
+            rate = (accepted + 1) / (drawn + 2)
+            size = int(min(max_round, max(min_round, math.ceil(1.2 * (n - accepted) / rate))))
+            if verbose:
+                print(f'round {len(rounds)}: drew {rounds[-1]["drawn"]}, accepted {rounds[-1]["accepted"]}, '
+                      f'total {accepted}/{n}, acceptance {accepted / drawn:.4f}')
+    for writer in (latent_writer, field_writer, desc_writer):
+        writer.close()
+    meta = {'n': n, 'accepted': accepted, 'drawn': drawn, 'acceptance_rate': accepted / max(drawn, 1),
+            'seconds': time.perf_counter() - t0, 'seed': seed, 'descriptors': list(names), 'isovalue': isovalue,
+            'windows': {k: list(v) for k, v in windows.items()}, 'min_distance': min_distance, 'rounds': rounds}
+    if accepted < n:
+        meta['note'] = f'max_draws reached, only the first {accepted} rows are filled'
+    with open(os.path.join(out_dir, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=2)
+    return meta
+
+
+def sample_one_by_one(decode_fn, n, proposal, windows=None, isovalue=0.5, max_draws=None, seed=0):
+    ''' the loop of single draws through decode the sampler replaces, for the benchmark; accepted latent vectors '''
+    from .helper_descriptors import descriptors
+    generator = torch.Generator().manual_seed(seed)
+    accepted, drawn = [], 0
+    max_draws = 1000 * n if max_draws is None else max_draws
+    with torch.inference_mode():
+        while len(accepted) < n and drawn < max_draws:
+            z = proposal.sample(1, generator)
+            drawn += 1
+            x = decode_fn(z)
+            ok = True
+            for name, (channel, low, high) in (windows or {}).items():
+                value = float(descriptors(x, isovalue, names=(name,))[name][0, channel])
+                ok &= (low is None or value >= low) and (high is None or value <= high)
+            if ok:
+                accepted.append(z[0])
+    return accepted, drawn
+
+
+if __name__ == '__main__':
+    from .helper_inference_server import load_decoder
+    from .helper_latent_index import load_latents
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', default=None, help='state dict or artifact of CNN_VAE, random weights if omitted')
+    parser.add_argument('--latent-dim', type=int, default=6)
+    parser.add_argument('--decoder', default='legacy', choices=('legacy', 'upsample'), help='decoder variant of the model')
+    parser.add_argument('--input-size', type=int, default=90)
+    parser.add_argument('--n', type=int, default=1000, help='designs wanted')
+    parser.add_argument('--out', default='./designs/')
+    parser.add_argument('--proposal', default='prior', choices=('prior', 'gaussian'))
+    parser.add_argument('--mu', default=None, help='saved latent vectors, fitted by the gaussian proposal and used as existing designs')
+    parser.add_argument('--temperature', type=float, default=1.)
+    parser.add_argument('--window', nargs=3, action='append', default=[], metavar=('DESCRIPTOR', 'LOW', 'HIGH'),
+                        help="e.g. volume_fraction 0.3 0.5, 'none' for an open side")
+    parser.add_argument('--channel', type=int, default=0, help='channel of the windows')
+    parser.add_argument('--isovalue', type=float, default=0.5)
+    parser.add_argument('--min-distance', type=float, default=0.)
+    parser.add_argument('--round-size', type=int, default=1024)
+    parser.add_argument('--max-round', type=int, default=65536)
+    parser.add_argument('--decode-batch', type=int, default=256)
+    parser.add_argument('--float16', action='store_true', help='store the fields as float16')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--benchmark', type=int, default=0, help='also time this many designs with the one-by-one loop')
+    args = parser.parse_args()
+
+    model = load_decoder(args.model, latent_dim=args.latent_dim, input_size=args.input_size, decoder=args.decoder)
+    mu = None if args.mu is None else load_latents(args.mu)
+    proposal = latent_proposal(args.latent_dim, mu if args.proposal == 'gaussian' else None, args.temperature)
+    bound = lambda v: None if v.lower() == 'none' else float(v)
+    windows = {name: (args.channel, bound(low), bound(high)) for name, low, high in args.window}
+    meta = sample_designs(model.decode, args.n, args.out, proposal, windows, args.isovalue, existing=mu,
+                          min_distance=args.min_distance, round_size=args.round_size, max_round=args.max_round,
+                          decode_batch=args.decode_batch, seed=args.seed,
+                          dtype=np.float16 if args.float16 else np.float32, verbose=True)
+    print(f"{meta['accepted']} designs in {meta['seconds']:.1f} s, {meta['accepted'] / meta['seconds']:.1f} designs/s, "
+          f"acceptance {meta['acceptance_rate']:.4f}, {len(meta['rounds'])} rounds")
+    if args.benchmark:
+        t0 = time.perf_counter()
+        accepted, drawn = sample_one_by_one(model.decode, args.benchmark, proposal, windows, args.isovalue, seed=args.seed)
+        seconds = time.perf_counter() - t0
+        print(f'one by one: {len(accepted)} designs in {seconds:.1f} s, {len(accepted) / seconds:.1f} designs/s')
@@ -0,0 +1,151 @@
+'''
+batched sensitivities of decoded unit cells with respect to their latent vectors
+
+The decoder must be in eval mode, so that every decoded field only depends on its own latent vector
+(BatchNorm then uses its running statistics). The products are then computed for a whole batch at once:
+    vector-Jacobian product  dL/dz = adjoint^T (d field / d z)   one backward pass for the batch
+    Jacobian-vector product  (d field / d z) v                   one forward-mode pass for the batch
+    Jacobian                 d field / d z                       latent_dim forward-mode passes, vectorized with vmap
+
+    python -m vae_geom.helper_sensitivity --batch 8     # finite difference check and benchmark against the per-element loop
+'''
+import time
+import json
+import argparse
+
+import torch
+from torch.func import jvp, vmap
+
+
+def decoder_vjp(decode_fn, z, adjoint):
+    '''
+    vector-Jacobian products for a batch, e.g. the sensitivity of an objective with adjoint fields
+    Args:
+        decode_fn: decodes latent vectors [B*latent_dim] to fields [B*C*W*L], in eval mode
+        z: latent vectors [B*latent_dim]
+        adjoint: adjoint fields dL/dfield [B*C*W*L]
+    Return:
+        dL/dz [B*latent_dim]
+    '''
+    with torch.enable_grad():
+        z = z.detach().requires_grad_(True)
+        x_hat = decode_fn(z)
+        grad, = torch.autograd.grad(x_hat, z, grad_outputs=adjoint)
+    return grad
+
+
+def decoder_jvp(decode_fn, z, v):
+    '''
+    Jacobian-vector products for a batch
+    Args:
+        decode_fn: decodes latent vectors [B*latent_dim] to fields [B*C*W*L], in eval mode
+        z: latent vectors [B*latent_dim]
+        v: latent directions [B*latent_dim]
+    Return:
+        decoded fields [B*C*W*L] and their directional derivatives [B*C*W*L]
+    '''
+    return jvp(decode_fn, (z.detach(),), (v,))
+
+
+def decoder_jacobian(decode_fn, z):
+    '''
+    full Jacobians of a batch, one vectorized forward-mode pass per latent dimension
+    Args:
+        decode_fn: decodes latent vectors [B*latent_dim] to fields [B*C*W*L], in eval mode
+        z: latent vectors [B*latent_dim]
+    Return:
+        d field / d z [B*C*W*L*latent_dim]
+    '''
+    z = z.detach()
+    basis = torch.eye(z.shape[1], dtype=z.dtype, device=z.device)[:, None, :].expand(-1, len(z), -1)
+    tangents = vmap(lambda v: jvp(decode_fn, (z,), (v,))[1])(basis) # [latent_dim*B*C*W*L]
+    return tangents.movedim(0, -1)
+
+
+def finite_difference_jacobian(decode_fn, z, eps=1e-3, batch_size=64):
+    '''
+    central finite-difference Jacobians, the 2*latent_dim perturbations of all elements are decoded in batches
+    Return:
+        d field / d z [B*C*W*L*latent_dim]
+    '''
+    B, d = z.shape
+    step = eps * torch.eye(d, dtype=z.dtype, device=z.device)
+    z_pm = torch.cat([z[:, None, :] + step[None], z[:, None, :] - step[None]], dim=1).view(-1, d)
+    with torch.no_grad():
+        x = torch.cat([decode_fn(chunk) for chunk in z_pm.split(batch_size)])
+        x = x.view(B, 2, d, *x.shape[1:])
+    return ((x[:, 0] - x[:, 1]) / (2 * eps)).movedim(1, -1)
+
+
+def check_jacobian(decode_fn, z, eps=1e-3, batch_size=64):
+    '''
+    compare decoder_jacobian, decoder_jvp and decoder_vjp with central finite differences
+    Return:
+        dict with the max absolute errors and the max absolute finite-difference entry for scale
+    '''
+    J = decoder_jacobian(decode_fn, z)
+    J_fd = finite_difference_jacobian(decode_fn, z, eps, batch_size)
+    v = torch.randn_like(z)
+    adjoint = torch.randn(J.shape[:-1], dtype=z.dtype, device=z.device)
+    _, Jv = decoder_jvp(decode_fn, z, v)
+    vJ = decoder_vjp(decode_fn, z, adjoint)
+    return {'jacobian_max_error': (J - J_fd).abs().max().item(),
+            'jvp_max_error': (Jv - torch.einsum('b...d,bd->b...', J_fd, v)).abs().max().item(),
+            'vjp_max_error': (vJ - torch.einsum('b...d,b...->bd', J_fd, adjoint)).abs().max().item(),
+            'fd_max_abs': J_fd.abs().max().item()}
+
+
+def loop_vjp(decode_fn, z, adjoint):
+    ''' reference: one decode and one backward() per element '''
+    grads = []
+    for b in range(len(z)):
+        z_b = z[b:b + 1].detach().requires_grad_(True)
+        decode_fn(z_b).backward(adjoint[b:b + 1])
+        grads.append(z_b.grad)
+    return torch.cat(grads)
+
+
+def benchmark(decode_fn, z, repeat=3):
+    '''
+    wall-clock of the batched calls against the per-element loops
+    Return:
+        dict of seconds per call, best of repeat
+    '''
+    adjoint = torch.randn_like(decode_fn(z[:1]).expand(len(z), -1, -1, -1))
+    cases = {'vjp_batched': lambda: decoder_vjp(decode_fn, z, adjoint),
+             'vjp_loop': lambda: loop_vjp(decode_fn, z, adjoint),
+             'jacobian_batched': lambda: decoder_jacobian(decode_fn, z)}
+    out = {}
+    for name, fn in cases.items():
+        times = []
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            fn()
+            times.append(time.perf_counter() - t0)
+        out[name] = min(times)
+    return out
+
+
+if __name__ == '__main__':
+    from .helper_inference_server import load_decoder
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', default=None, help='state dict of CNN_VAE, random weights if omitted')
+    parser.add_argument('--latent-dim', type=int, default=6)
+    parser.add_argument('--decoder', default='legacy', choices=('legacy', 'upsample'), help='decoder variant of the model')
+    parser.add_argument('--input-size', type=int, default=90)
+    parser.add_argument('--batch', type=int, default=8)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--threads', type=int, default=None)
+    args = parser.parse_args()
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+
+    torch.manual_seed(0)
+    model = load_decoder(args.model, latent_dim=args.latent_dim, input_size=args.input_size, decoder=args.decoder)
+    # finite differences in double precision, so that the check is not limited by float32 round-off
+    check = check_jacobian(model.double().decode, torch.randn(1, args.latent_dim, dtype=torch.float64),
+                           eps=1e-5, batch_size=2)
+    model.float()
+    timing = benchmark(model.decode, torch.randn(args.batch, args.latent_dim), args.repeat)
+    print(json.dumps({'finite_difference_check': check, 'seconds': timing}, indent=2))
@@ -0,0 +1,182 @@
+'''
+streaming decoding of latent fields for macroscale meshes
+
+Every element of a mesh has a latent vector; all elements are decoded in chunks of `chunk_size`
+vectors, optionally by several worker processes, straight into a preallocated memory-mapped .npy
+output [N*C*W*L]. Memory use is bounded by the chunk size and the number of workers, not by N.
+Finished chunks are recorded in `<out>.progress.npz`, an interrupted run continues where it stopped.
+
+    python -m vae_geom.helper_stream_decode decode --model ./save_model/VAEmodel_last.pt --latents mesh_latents.npy --out mesh_fields.npy --workers 2
+    python -m vae_geom.helper_stream_decode bench --sizes 1000 4000 --decoder upsample  # peak memory vs. mesh size
+'''
+import os
+import time
+import argparse
+import multiprocessing
+
+import numpy as np
+import torch
+
+_worker = {} # state of a decode worker process: decode function and output memory map
+
+
+def _chunks(latents, chunk_size):
+    '''
+    (chunk number, start row, latent vectors) of an array (e.g. a memory map) or of an iterator of arrays,
+    the arrays of an iterator are re-chunked to chunk_size rows
+    '''
+    if hasattr(latents, 'shape'):
+        for c, start in enumerate(range(0, len(latents), chunk_size)):
+            yield c, start, latents[start:start + chunk_size]
+        return
+    buffer, start, c = [], 0, 0
+    for z in latents:
+        buffer.append(np.asarray(z, dtype=np.float32).reshape(-1, np.shape(z)[-1]))
+        while sum(len(b) for b in buffer) >= chunk_size:
+            z = np.concatenate(buffer)
+            yield c, start, z[:chunk_size]
+            buffer, start, c = [z[chunk_size:]], start + chunk_size, c + 1
+    if buffer and sum(len(b) for b in buffer) > 0:
+        yield c, start, np.concatenate(buffer)
+
+
+def _decode(decode_fn, z):
+    ''' fields of one chunk of latent vectors as a numpy array, the chunk is copied out of a read-only memory map '''
+    with torch.inference_mode():
+        return decode_fn(torch.from_numpy(np.array(z, dtype=np.float32))).cpu().numpy()
+
+
+def _decode_into(decode_fn, out, start, z):
+    ''' decode one chunk and write it to rows start.. of the output memory map '''
+    x = _decode(decode_fn, z)
+    out[start:start + len(x)] = x
+    out.flush() # on disk before the chunk is marked as finished
+    return len(x)
+
+
+def _init_worker(out_path, threads):
+    torch.set_num_threads(threads)
+    _worker['out'] = np.load(out_path, mmap_mode='r+')
+
+
+def _work(task):
+    c, start, z = task
+    _decode_into(_worker['decode_fn'], _worker['out'], start, z)
+    return c
+
+
+class _progress:
+    ''' bitmap of the finished chunks, saved atomically next to the output '''
+    def __init__(self, path, n_chunks, chunk_size, restart):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.done = np.zeros(n_chunks, dtype=bool)
+        if restart and os.path.exists(path):
+            saved = np.load(path)
+            if int(saved['chunk_size']) == chunk_size and len(saved['done']) == n_chunks:
+                self.done = saved['done']
+
+    def mark(self, c):
+        self.done[c] = True
+        tmp = self.path + '.tmp.npz'
+        np.savez(tmp, done=self.done, chunk_size=self.chunk_size)
+        os.replace(tmp, self.path)
+
+
+def stream_decode(decode_fn, latents, out_path, n=None, chunk_size=256, workers=0, dtype=np.float32,
+                  restart=True, verbose=False):
+    '''
+    decode all latent vectors into a memory-mapped .npy file
+    Args:
+        decode_fn: decodes latent vectors [B*latent_dim] to fields [B*C*W*L], e.g. model.decode in eval mode
+        latents: array [N*latent_dim] (e.g. np.load(..., mmap_mode='r')) or an iterator of arrays [n_i*latent_dim]
+        out_path: the output .npy file [N*C*W*L]
+        n: number of latent vectors, required for an iterator
+        chunk_size: latent vectors decoded per call, bounds the memory
+        workers: number of decode processes (fork), 0 decodes in this process
+        dtype: type of a new output, e.g. np.float16 to halve its size
+        restart: continue an interrupted run with the same output, chunk size and n, the output keeps its type
+    Return:
+        dict with n, number of chunks, chunks decoded by this call, skipped (already finished) chunks and seconds
+    '''
+    n = len(latents) if n is None else n
+    n_chunks = -(-n // chunk_size)
+    progress_path = out_path + '.progress.npz'
+    progress = _progress(progress_path, n_chunks, chunk_size, restart and os.path.exists(out_path))
+    skipped = int(progress.done.sum())
+    decoded = 0
+    tasks = _chunks(latents, chunk_size)
+    t0 = time.perf_counter()
+    if progress.done.any():
+        out = np.load(out_path, mmap_mode='r+')
+    else: # the shape of one field is taken from the first chunk
+        c, start, z = next(tasks)
+        first = _decode(decode_fn, z)
+        out = np.lib.format.open_memmap(out_path, mode='w+', dtype=dtype, shape=(n,) + first.shape[1:])
+        out[start:start + len(first)] = first
+        out.flush()
+        del first
+        progress.mark(c)
+        decoded += 1
+    todo = ((c, start, z) for c, start, z in tasks if not progress.done[c])
+    if workers > 0:
+        _worker['decode_fn'] = decode_fn # inherited by the forked workers
+        threads = max(1, torch.get_num_threads() // workers)
+        context = multiprocessing.get_context('fork')
+        with context.Pool(workers, initializer=_init_worker, initargs=(out_path, threads)) as pool:
+            for c in pool.imap_unordered(_work, todo):
+                progress.mark(c)
+                decoded += 1
+                if verbose:
+                    print(f'\rchunk {int(progress.done.sum())}/{n_chunks}', end='', flush=True)
+    else:
+        for c, start, z in todo:
+            _decode_into(decode_fn, out, start, z)
+            progress.mark(c)
+            decoded += 1
+            if verbose:
+                print(f'\rchunk {int(progress.done.sum())}/{n_chunks}', end='', flush=True)
+    del out
+    if verbose:
+        print()
+    return {'n': n, 'chunks': n_chunks, 'decoded': decoded, 'skipped': skipped, 'seconds': time.perf_counter() - t0}
+
+
+if __name__ == '__main__':
+    from .helper_inference_server import load_decoder
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='command', required=True)
+    dec = sub.add_parser('decode', help='decode a latent array into a memory-mapped field array')
+    dec.add_argument('--latents', required=True, help='.npy file [N*latent_dim]')
+    dec.add_argument('--out', required=True, help='output .npy file [N*C*W*L]')
+    bench = sub.add_parser('bench', help='peak memory and time per mesh size on random latents')
+    bench.add_argument('--sizes', type=int, nargs='+', default=[1000, 4000])
+    bench.add_argument('--work-dir', default=None)
+    for p in (dec, bench):
+        p.add_argument('--model', default=None, help='state dict of CNN_VAE, random weights if omitted')
+        p.add_argument('--latent-dim', type=int, default=6)
+        p.add_argument('--decoder', default='legacy', choices=('legacy', 'upsample'), help='decoder variant of the model')
+        p.add_argument('--input-size', type=int, default=90)
+        p.add_argument('--chunk-size', type=int, default=256)
+        p.add_argument('--workers', type=int, default=0)
+        p.add_argument('--float16', action='store_true', help='store the fields as float16')
+    args = parser.parse_args()
+
+    model = load_decoder(args.model, latent_dim=args.latent_dim, input_size=args.input_size, decoder=args.decoder)
+    dtype = np.float16 if args.float16 else np.float32
+    if args.command == 'decode':
+        print(stream_decode(model.decode, np.load(args.latents, mmap_mode='r'), args.out, chunk_size=args.chunk_size,
+                            workers=args.workers, dtype=dtype, verbose=True))
+    else:
+        import tempfile
+        from .benchmark_model import peak_memory
+        with tempfile.TemporaryDirectory(dir=args.work_dir) as tmp:
+            for size in args.sizes:
+                path = os.path.join(tmp, f'latents_{size}.npy')
+                np.save(path, np.random.default_rng(0).standard_normal((size, args.latent_dim), dtype=np.float32))
+                with peak_memory('cpu') as mem:
+                    result = stream_decode(model.decode, np.load(path, mmap_mode='r'), os.path.join(tmp, f'fields_{size}.npy'),
+                                           chunk_size=args.chunk_size, workers=args.workers, dtype=dtype)
+                print(f"n={size:>8d}  {result['seconds']:8.1f} s  {size / result['seconds']:8.1f} fields/s"
+                      f"  peak anonymous memory of this process +{mem.peak_mb:.0f} MB")
@@ -0,0 +1,308 @@
+'''
+parallel hyperparameter sweep of vae_geom.main_train_on_GPU
+
+Every trial is one run of the training script in its own folder, with a copy of the base config in which
+the swept keys are replaced and the outputs point into the folder. Trials run concurrently as separate
+processes, each pinned to its own set of CPU cores with matching thread limits, all reading the same
+memory-mapped dataset (data_loader.mmap), so the page cache holds one copy for all of them. The test
+reconstruction loss of every trial is read from its train_log.jsonl every export_every epochs; a trial whose
+best one is worse than the median of the other trials at the same epoch is stopped (median stopping rule).
+The trials are compared on the reconstruction loss, not on the test loss, whose KL term is weighted by beta:
+trials with a larger beta would look worse by construction.
+
+    python -m vae_geom.helper_sweep --param model_params.latent_dim=4,6,8 --param model_params.beta=1,10 --cores-per-trial 4
+    python -m vae_geom.helper_sweep --search random --trials 16 --param model_params.beta=loguniform:1:100 --param model_params.latent_dim=4,6,8
+'''
+import os
+import sys
+import csv
+import copy
+import json
+import math
+import time
+import random
+import argparse
+import itertools
+import subprocess
+
+import numpy as np
+
+TRAIN_MODULE = __package__ + '.main_train_on_GPU'
+# folder containing the package, put on the PYTHONPATH of the trials when it is not installed
+PACKAGE_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# record of train_log.jsonl the trials are stopped and ranked by, lower is better
+METRIC = 'test_recon_loss'
+
+
+def parse_param(spec):
+    '''
+    'section.key=v1,v2,...' (values as JSON, e.g. 4 or 1e-4 or "upsample") or 'section.key=uniform:a:b' /
+    'section.key=loguniform:a:b' / 'section.key=randint:a:b' for random search
+    Return:
+        key, list of values or (distribution, a, b)
+    '''
+    key, _, values = spec.partition('=')
+    if not values:
+        raise ValueError(f'parameter {spec} has no values, use section.key=v1,v2')
+    head = values.split(':')[0]
+    if head in ('uniform', 'loguniform', 'randint'):
+        _, a, b = values.split(':')
+        return key, (head, float(a), float(b))
+
+    def value(v):
+        try:
+            return json.loads(v)
+        except json.JSONDecodeError:
+            return v # bare strings
+    return key, [value(v) for v in values.split(',')]
+
+
+def grid_trials(space):
+    ''' all combinations of the value lists, list of dicts key -> value '''
+    for key, values in space.items():
+        if not isinstance(values, list):
+            raise ValueError(f'{key}: distributions need --search random')
+    keys = list(space)
+    return [dict(zip(keys, combo)) for combo in itertools.product(*(space[k] for k in keys))]
+
+
+def random_trials(space, n, seed=0):
+    ''' n random points, value lists are sampled uniformly, distributions as given '''
+    rng = random.Random(seed)
+    trials = []
+    for _ in range(n):
+        trial = {}
+        for key, values in space.items():
+            if isinstance(values, list):
+                trial[key] = rng.choice(values)
+            elif values[0] == 'uniform':
+                trial[key] = rng.uniform(values[1], values[2])
+            elif values[0] == 'loguniform':
+                trial[key] = math.exp(rng.uniform(math.log(values[1]), math.log(values[2])))
+            else:
+                trial[key] = rng.randint(int(values[1]), int(values[2]))
+        trials.append(trial)
+    return trials
+
+
+def trial_config(base, params, folder, base_dir, threads):
+    '''
+    config of one trial: the swept keys replaced, data paths absolute, outputs inside folder,
+    memory-mapped data and the thread limit of the trial
+    '''
+    config = copy.deepcopy(base)
+    for key, value in params.items():
+        section, _, name = key.rpartition('.')
+        target = config
+        for part in section.split('.') if section else []:
+            target = target.setdefault(part, {})
+        target[name] = value
+    paths = config['Path']
+    for key in ('train_data_path', 'test_data_path'):
+        if isinstance(paths[key], list):
+            paths[key] = [os.path.join(base_dir, p) for p in paths[key]]
+        else:
+            paths[key] = os.path.join(base_dir, paths[key])
+    paths['save_path'] = os.path.join(folder, 'save_model', '')
+    paths['log_path'] = os.path.join(folder, 'checkpoints', '')
+    instrumentation = config.setdefault('instrumentation', {})
+    instrumentation['log_file'] = os.path.join(folder, 'train_log.jsonl')
+    instrumentation['profile_dir'] = os.path.join(folder, 'profile', '')
+    instrumentation['montage_dir'] = os.path.join(folder, 'montage', '')
+    config.setdefault('data_loader', {})['mmap'] = True
+    config.setdefault('distributed', {})['threads_per_process'] = threads
+    return config
+
+
+def core_sets(cores_per_trial, cores=None):
+    ''' disjoint core sets of cores_per_trial cores out of the cores this process may run on '''
+    cores = sorted(os.sched_getaffinity(0)) if cores is None else list(cores)
+    k = max(1, min(cores_per_trial, len(cores)))
+    return [cores[i:i + k] for i in range(0, len(cores) - k + 1, k)]
+
+
+class _trial:
+    ''' one run of the training script and the metric values read from its log '''
+    def __init__(self, number, params, folder, metric=METRIC):
+        self.number = number
+        self.params = params
+        self.folder = folder
+        self.log_file = os.path.join(folder, 'train_log.jsonl')
+        self.process = None
+        self.cores = None
+        self.status = 'pending'
+        self.metric = metric
+        self.scores = {} # epoch -> metric
+        self.last_epoch = None
+        self._offset = 0
+        self.t_start = self.t_end = None
+
+    def start(self, config, cores):
+        os.makedirs(self.folder, exist_ok=True)
+        with open(os.path.join(self.folder, 'config_cluster.json'), 'w') as f:
+            json.dump(config, f, indent=4)
+        threads = str(len(cores))
+        path = os.pathsep.join(p for p in (PACKAGE_ROOT, os.environ.get('PYTHONPATH')) if p)
+        env = dict(os.environ, OMP_NUM_THREADS=threads, MKL_NUM_THREADS=threads, PYTHONPATH=path)
+        self.cores = cores
+        self.t_start = time.time()
+        # the script reads ./config_cluster.json, it runs in the trial folder
+        with open(os.path.join(self.folder, 'stdout.log'), 'w') as out:
+            self.process = subprocess.Popen([sys.executable, '-m', TRAIN_MODULE], cwd=self.folder, env=env, stdout=out,
+                                            stderr=subprocess.STDOUT, preexec_fn=lambda: os.sched_setaffinity(0, cores))
+        self.status = 'running'
+
+    def stop(self, timeout=30.):
+        ''' SIGTERM, and SIGKILL if the run has not exited after timeout seconds '''
+        self.process.terminate()
+        try:
+            self.process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+    def read_log(self):
+        ''' new records of the log, the last line may still be written '''
+        if not os.path.exists(self.log_file):
+            return
+        with open(self.log_file) as f:
+            f.seek(self._offset)
+            for line in f:
+                if not line.endswith('\n'):
+                    break
+                self._offset += len(line.encode())
+                record = json.loads(line)
+                self.last_epoch = record['epoch']
+                if record.get(self.metric) is not None:
+                    self.scores[record['epoch']] = record[self.metric]
+
+    def best(self, epoch=None):
+        ''' best metric up to epoch (all epochs if None) '''
+        losses = [v for e, v in self.scores.items() if epoch is None or e <= epoch]
+        return min(losses) if losses else None
+
+    def row(self):
+        best = self.best()
+        best_epoch = None if best is None else min(e for e, v in self.scores.items() if v == best)
+        return dict({'trial': self.number, 'status': self.status}, **self.params,
+                    **{'best_' + self.metric: best}, best_epoch=best_epoch, last_epoch=self.last_epoch,
+                    seconds=None if self.t_end is None else self.t_end - self.t_start,
+                    cores=' '.join(map(str, self.cores or [])), folder=self.folder)
+
+
+def should_stop(trial, trials, min_trials=3, grace_reports=2, margin=0.):
+    '''
+    median stopping rule: stop the trial if its best metric is worse than (1 + margin) times the median
+    of the best metrics of the other trials at its latest reported epoch
+    Args:
+        min_trials: other trials that must have reported that epoch
+        grace_reports: metric values a trial reports before it can be stopped
+    '''
+    if len(trial.scores) < grace_reports:
+        return False
+    epoch = max(trial.scores)
+    others = [t.best(epoch) for t in trials if t is not trial and epoch in t.scores]
+    if len(others) < min_trials:
+        return False
+    return trial.best(epoch) > (1. + margin) * float(np.median(others))
+
+
+def run_sweep(trials, base_config='config_cluster.json', out_dir='./sweep/', cores_per_trial=1, cores=None,
+              early_stopping=True, min_trials=3, grace_reports=2, margin=0., poll=2., metric=METRIC, stop_timeout=30.,
+              verbose=True):
+    '''
+    run the trials, as many at once as there are core sets
+    Args:
+        trials: list of dicts config key ('section.key') -> value, see grid_trials and random_trials
+        base_config: config the trials are derived from, relative data paths are relative to its folder
+        out_dir: sweep folder, trial_<i>/ per trial and the results.csv / results.json table
+        cores_per_trial: cores and threads of every trial
+        early_stopping, min_trials, grace_reports, margin: median stopping rule, see should_stop
+        metric: record of the training log the trials are stopped and ranked by, independent of the swept
+                parameters, default the test reconstruction loss
+        stop_timeout: seconds a stopped trial may take to exit before it is killed
+    Return:
+        the table, list of dicts sorted by the best metric
+    '''
+    with open(base_config) as f:
+        base = json.load(f)
+    base_dir = os.path.dirname(os.path.abspath(base_config))
+    out_dir = os.path.abspath(out_dir)
+    os.makedirs(out_dir, exist_ok=True)
+    slots = core_sets(cores_per_trial, cores)
+    pending = [_trial(i, params, os.path.join(out_dir, f'trial_{i}'), metric) for i, params in enumerate(trials)]
+    all_trials = list(pending)
+    running = []
+    if verbose:
+        print(f'{len(all_trials)} trials, {len(slots)} at once on cores {slots}')
+    t0 = time.time()
+    try:
+        while pending or running:
+            while pending and slots:
+                trial = pending.pop(0)
+                cores = slots.pop(0)
+                trial.start(trial_config(base, trial.params, trial.folder, base_dir, len(cores)), cores)
+                running.append(trial)
+            time.sleep(poll)
+            for trial in list(running):
+                trial.read_log()
+                code = trial.process.poll()
+                if code is None and early_stopping and should_stop(trial, all_trials, min_trials, grace_reports, margin):
+                    trial.stop(stop_timeout)
+                    trial.status = 'stopped'
+                elif code is not None:
+                    trial.read_log()
+                    trial.status = 'completed' if code == 0 else f'failed ({code})'
+                else:
+                    continue
+                trial.t_end = time.time()
+                running.remove(trial)
+                slots.append(trial.cores)
+                if verbose:
+                    print(f'trial {trial.number} {trial.status} at epoch {trial.last_epoch}, '
+                          f'best {metric} {trial.best()}, {trial.params}')
+    finally: # interrupted sweep, no orphaned runs
+        for trial in running:
+            trial.stop(stop_timeout)
+            trial.status = 'interrupted'
+    table = sorted((t.row() for t in all_trials),
+                   key=lambda r: (r['best_' + metric] is None, r['best_' + metric] or 0.))
+    with open(os.path.join(out_dir, 'results.json'), 'w') as f:
+        json.dump({'seconds': time.time() - t0, 'trials': table}, f, indent=2)
+    columns = []
+    for row in table + [_trial(None, {}, out_dir, metric).row()]: # the header of an empty sweep as well
+        columns += [c for c in row if c not in columns]
+    with open(os.path.join(out_dir, 'results.csv'), 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=columns, restval='')
+        writer.writeheader()
+        writer.writerows(table)
+    return table
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--param', action='append', required=True, help='section.key=v1,v2 or section.key=loguniform:a:b')
+    parser.add_argument('--search', default='grid', choices=('grid', 'random'))
+    parser.add_argument('--trials', type=int, default=8, help='number of random trials')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--config', default='config_cluster.json')
+    parser.add_argument('--out', default='./sweep/')
+    parser.add_argument('--cores-per-trial', type=int, default=1)
+    parser.add_argument('--no-early-stopping', action='store_true')
+    parser.add_argument('--min-trials', type=int, default=3, help='other trials needed to compare at an epoch')
+    parser.add_argument('--grace', type=int, default=2, help='metric values reported before a trial can be stopped')
+    parser.add_argument('--margin', type=float, default=0., help='relative margin above the median before stopping')
+    parser.add_argument('--poll', type=float, default=2.)
+    parser.add_argument('--metric', default=METRIC, help='record of train_log.jsonl to stop and rank by, lower is better')
+    parser.add_argument('--stop-timeout', type=float, default=30., help='seconds before a stopped trial is killed')
+    args = parser.parse_args()
+
+    space = dict(parse_param(p) for p in args.param)
+    trials = grid_trials(space) if args.search == 'grid' else random_trials(space, args.trials, args.seed)
+    table = run_sweep(trials, args.config, args.out, args.cores_per_trial, early_stopping=not args.no_early_stopping,
+                      min_trials=args.min_trials, grace_reports=args.grace, margin=args.margin, poll=args.poll,
+                      metric=args.metric, stop_timeout=args.stop_timeout)
+    columns = ['trial', 'status'] + list(space) + ['best_' + args.metric, 'best_epoch', 'last_epoch', 'seconds']
+    print('  '.join(f'{c:>22s}' for c in columns))
+    for row in table:
+        print('  '.join(f'{row[c]:>22.6g}' if isinstance(row[c], float) else f'{str(row[c]):>22s}' for c in columns))
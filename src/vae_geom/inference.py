@@ -0,0 +1,56 @@
+'''
+minimal inference path of the package: the model described by a config, with its trained weights
+
+    from vae_geom.inference import load_model
+    model = load_model('config_cluster.json', './save_model/VAEmodel_last.pt')
+    fields = model.decode(z)
+
+Imports torch, numpy, helper_VAEstruc and helper_artifact only (helper_load_data for .h5 voxel models),
+none of the training, plotting or benchmark modules and not torchvision or matplotlib.
+'''
+import os
+import json
+
+
+def read_config(path='config_cluster.json'):
+    with open(path) as f:
+        return json.load(f)
+
+
+def _is_voxel(path):
+    return isinstance(path, str) and os.path.splitext(path)[1].lower() in ('.h5', '.hdf5')
+
+
+def load_model(config, model_path=None, map_location='cpu', data_path=None):
+    '''
+    the model described by a config in eval mode, gradients disabled
+    Args:
+        config: config dict or path of the config file
+        model_path: state dict saved by the training script, random weights if None; a .tensors artifact is
+                    memory mapped and the parameters stay views of the page cache
+        data_path: data the model was trained on, default the training data of the config; only read
+                   for .h5 voxel files, whose channels and grid size define the CNN_VAE3D
+    Return:
+        CNN_VAE or CNN_VAE3D
+    '''
+    from .helper_VAEstruc import CNN_VAE, CNN_VAE3D
+
+    if isinstance(config, str):
+        config = read_config(config)
+    params = config['model_params']
+    data_path = config['Path']['train_data_path'] if data_path is None else data_path
+    if _is_voxel(data_path):
+        from .helper_load_data import voxel_datasets
+        data = voxel_datasets(data_path)
+        model = CNN_VAE3D(channel_in=data.channels, latent_dim=params['latent_dim'], input_size=data.dim)
+        data.close()
+    else:
+        model = CNN_VAE(channel_in=2, latent_dim=params['latent_dim'], input_size=params.get('input_size', 90),
+                        decoder=params.get('decoder', 'legacy'))
+    if model_path is not None:
+        from .helper_artifact import is_artifact, load_state_dict
+        model.load_state_dict(load_state_dict(model_path, map_location), assign=is_artifact(model_path))
+    model.eval()
+    for p in model.parameters():
+        p.requires_grad_(False)
+    return model
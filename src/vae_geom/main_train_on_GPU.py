@@ -0,0 +1,320 @@
+### Import public pkgs
+import torch
+from torch import nn
+from torch.utils.data.distributed import DistributedSampler
+from torch.nn.parallel import DistributedDataParallel
+import os
+import sys
+import json
+import shutil
+from contextlib import nullcontext
+
+
+###  Import inhouse pkgs
+from .helper_load_data import open_dataset, voxel_datasets
+from .helper_load_data import custom_transform
+from .helper_load_data import batch_loader
+from .helper_load_data import loader_kwargs
+from .helper_instrument import TrainingMonitor
+from .helper_latents import MemmapWriter
+from .helper_checkpoint import CheckpointWriter, load_latest_checkpoint
+from .helper_distributed import init_distributed, is_main_process, all_reduce_sum, gather_rows, cleanup
+from .helper_distributed import padding_mask, drop_padding, sample_noise, convert_sync_batchnorm
+from .helper_display import save_montage
+
+
+
+def main(config_path='./config_cluster.json'):
+    '''
+    train the VAE described by a config file, see config_cluster.json
+    Args:
+        config_path: path of the config file, its relative paths are relative to the working directory
+    '''
+    # Load configuration file
+    with open(config_path) as f:
+        config = json.load(f)
+
+    # Extract configuration parameters
+    batch_size = config['model_params']['batch_size']
+    latent_dim = config['model_params']['latent_dim']
+    beta = config['model_params']['beta']
+    learning_rate = config['train_params']['learning_rate']
+    epochs = config['train_params']['epochs']
+    manual_seed = config['random_seed']['manual_seed']
+    cuda_manual_seed = config['random_seed']['cuda_manual_seed']
+    loading_checkpoint = config['train_params']['loading_checkpoint']
+    checkpoint_every = config['train_params'].get('checkpoint_every', 10) # epochs between periodic checkpoints
+    keep_last = config['train_params'].get('keep_last', 3) # number of periodic checkpoints kept
+    export_every = config['train_params'].get('export_every', 40) # epochs between test evaluations, model and latent exports
+    # exported models are also written as memory-mappable artifacts (.tensors), shared by all processes that load them
+    save_artifacts = config['train_params'].get('save_artifacts', False)
+    # Memory-lean training step: the model emits logits and the loss fuses the sigmoid into the binary cross entropy,
+    # final_layer is optionally recomputed in backward, every batch is split into micro_batches whose gradients
+    # are accumulated, the optimizer step and the loss stay the ones of the whole batch
+    fused_loss = config['train_params'].get('fused_loss', False)
+    checkpoint_final_layer = config['train_params'].get('checkpoint_final_layer', False)
+    micro_batches = config['train_params'].get('micro_batches', 1)
+    # Paths from configuration
+    data_path_train = config['Path']['train_data_path']
+    data_path_test = config['Path']['test_data_path']
+    save_path = config['Path']['save_path']
+    checkpoint_path = config['Path']['log_path']
+    # Instrumentation: per-phase timers logged as JSONL, optional torch.profiler window,
+    # input-vs-reconstruction montages (PNG) every montage_every epochs
+    instrumentation = config.get('instrumentation', {})
+    montage_every = instrumentation.get('montage_every')
+    # Data pipeline: worker processes, prefetching, pinning and shuffling
+    data_loader = config.get('data_loader', {})
+    # Multi-process DistributedDataParallel mode, active when started by torchrun with more than one process
+    distributed = config.get('distributed', {})
+
+
+
+    # One process per device or CPU socket, only rank 0 writes artifacts and logs
+    rank, local_rank, world_size = init_distributed(distributed.get('backend', 'auto'))
+    if distributed.get('threads_per_process'):
+        torch.set_num_threads(distributed['threads_per_process'])
+    if batch_size % world_size != 0:
+        raise ValueError(f'batch_size {batch_size} must be divisible by the number of processes {world_size}')
+
+
+
+
+    # Set random seeds for reproducibility
+    torch.manual_seed(manual_seed)
+    torch.cuda.manual_seed(cuda_manual_seed)
+
+
+
+
+    # DataLoader parameters, workers are seeded from manual_seed
+    kwargs = loader_kwargs(data_loader, seed=manual_seed)
+    # Initialize DataLoaders for training and testing, whole batches are fetched at once.
+    # The sample order is a seeded permutation shared by all processes, every process takes every
+    # world_size-th sample. If the dataset size is not a multiple of world_size, DistributedSampler repeats
+    # a few samples so that all processes have batches of the same size; the repetitions are left out of
+    # the losses (padding_mask), so every sample counts once per epoch for any number of processes.
+    # .npy files hold 2D fields [N*C*W*L], .h5 files 3D voxel fields [N*C*D*W*L] read lazily in chunks
+    # with mmap the .npy files are memory mapped, concurrent runs (e.g. a sweep) share one copy in the page cache
+    train_dataset = open_dataset(data_path_train,transform=custom_transform,flatten=False,batched=True,
+                                 mmap=data_loader.get('mmap', False))
+    train_sampler = DistributedSampler(train_dataset, num_replicas=world_size, rank=rank,
+                                       shuffle=data_loader.get('shuffle', True), seed=manual_seed)
+    train_loader = batch_loader(train_dataset, batch_size=batch_size//world_size, sampler=train_sampler, **kwargs)
+
+
+    test_dataset = open_dataset(data_path_test,transform=custom_transform,flatten=False,batched=True,
+                                mmap=data_loader.get('mmap', False))
+    test_sampler = DistributedSampler(test_dataset, num_replicas=world_size, rank=rank,
+                                      shuffle=data_loader.get('test_shuffle', False))
+    test_loader = batch_loader(test_dataset, batch_size=batch_size//world_size, sampler=test_sampler, **kwargs)
+
+
+    # Initialize the model and optimizer
+    from .helper_VAEstruc import CNN_VAE,CNN_VAE3D
+    from .helper_VAEstruc import lossfunc, lossfunc_logits
+    if isinstance(train_dataset, voxel_datasets): # 3D voxel fields, the grid size is the one of the training set
+        model = CNN_VAE3D(channel_in=train_dataset.channels,latent_dim=latent_dim,input_size=train_dataset.dim)
+    else:
+        # decoder variant ('legacy' or 'upsample') and input size, the input size defaults to the one of the training set
+        model = CNN_VAE(channel_in=2,latent_dim=latent_dim,input_size=config['model_params'].get('input_size', train_dataset.dim),
+                        decoder=config['model_params'].get('decoder', 'legacy'))
+    model.checkpoint_final = checkpoint_final_layer
+    # the unwrapped model, its state dict is saved and loaded whatever the parallel wrapper
+    raw_model = model
+
+    # Setup device (GPU/CPU)
+    if torch.cuda.is_available(): # GPU is available
+        device = torch.device("cuda", local_rank)
+        torch.cuda.set_device(device)
+    else:  # only cpu is available
+        device = torch.device("cpu")
+    model.to(device)
+
+    # Load the latest valid checkpoint if specified
+    checkpoint = load_latest_checkpoint(checkpoint_path, map_location=device) if loading_checkpoint else None
+    if checkpoint is not None:
+        raw_model.load_state_dict(checkpoint['model_state_dict'])
+
+    if world_size > 1: # DDP, gradients are averaged over the processes
+        # batch norm over the global batch, on CPU (gloo) with all-reduced statistics, so that the model
+        # is trained the same for any number of processes
+        if distributed.get('sync_batchnorm', True):
+            model = (nn.SyncBatchNorm.convert_sync_batchnorm if device.type == 'cuda' else convert_sync_batchnorm)(model)
+            raw_model = model
+        model = DistributedDataParallel(model, device_ids=[local_rank] if device.type == 'cuda' else None)
+    elif torch.cuda.device_count() > 1: # single process on several GPUs
+        model = nn.DataParallel(model)
+
+    optimizer = torch.optim.Adam(
+        model.parameters(),
+        lr=learning_rate,
+    )
+
+
+    if checkpoint is not None:
+        if is_main_process():
+            print(f'resuming from {checkpoint["path"]}')
+        optimizer.load_state_dict(checkpoint['optimizer_state_dict'])
+        if 'rng_state' in checkpoint:
+            torch.set_rng_state(checkpoint['rng_state'].cpu())
+        current_epoch = checkpoint['epoch'] + 1 # the checkpoint holds a completed epoch
+        loss = checkpoint['loss']
+    else: # use the initial model and optimiser
+        if loading_checkpoint and is_main_process():
+            print(f'no valid checkpoint in {checkpoint_path}, starting from scratch')
+        current_epoch = 0
+
+    # Checkpoints and artifacts are written by a background thread
+    writer = CheckpointWriter(checkpoint_path, keep_last=keep_last)
+    x_test_saved = False # the test inputs do not change, they are saved once
+   
+
+    
+    # Per-phase timers of the training loop
+    monitor = TrainingMonitor(log_file=instrumentation.get('log_file') if is_main_process() else None,
+                              device=device,
+                              sync=instrumentation.get('sync_cuda', False),
+                              profile_start=instrumentation.get('profile_start_step'),
+                              profile_steps=instrumentation.get('profile_steps', 5),
+                              profile_dir=instrumentation.get('profile_dir', './profile/'))
+
+    # Training loop, empty when a resumed checkpoint already holds the last epoch
+    last_epoch = current_epoch - 1 # last completed epoch
+    for epoch in range(current_epoch, epochs+1):
+        # latents are only collected on export epochs, streamed to memory-mapped files in dataset order
+        export = epoch % export_every == 0 or epoch == epochs # save model every export_every (40) steps and at the end
+        train_sampler.set_epoch(epoch)
+        if export and is_main_process():
+            mu_writer = MemmapWriter(save_path+'mu_list_'+str(epoch)+'.npy', len(train_loader.dataset), (latent_dim,))
+        model.train()
+        # losses are accumulated on the device and synchronized once per epoch
+        train_loss = torch.zeros((), device=device)
+        test_loss = test_recons_loss = None
+        seen = 0 # samples of this process so far in the epoch
+        for x,y in monitor.timed_iter(train_loader):
+            x = x.to(device, non_blocking=True)
+            keep = padding_mask(seen, len(x), len(train_dataset), rank, world_size)
+            seen += len(x)
+            optimizer.zero_grad()
+            # the summed losses of the micro-batches add up to the batch loss, so do their gradients;
+            # every process has batches of the same size, hence the same number of micro-batches
+            n_micro = min(micro_batches, len(x))
+            mu_batch = []
+            keep_micro = [None] * n_micro if keep is None else keep.tensor_split(n_micro)
+            for i, (x_micro, y_micro, keep) in enumerate(zip(x.tensor_split(n_micro), y.tensor_split(n_micro), keep_micro)):
+                #==== forwad pass
+                with monitor.phase('forward'):
+                    # reparameterization noise per sample and epoch, independent of the process and batch
+                    # layout and reproducible on resume
+                    eps = sample_noise(y_micro, latent_dim, manual_seed, epoch).to(device, non_blocking=True)
+                    x_hat,mu,logvar = model(x_micro, logits=fused_loss, eps=eps)
+                    mu_batch.append(mu.detach())
+                    loss = (lossfunc_logits if fused_loss else lossfunc)(*drop_padding(keep,x_micro,x_hat,mu,logvar),beta=beta)
+                    train_loss += loss.detach()
+                #==== backward pass
+                with monitor.phase('backward'):
+                    # DDP averages the gradients once, after the last micro-batch; scale them back to the
+                    # gradient of the summed global batch loss
+                    with model.no_sync() if world_size > 1 and i < n_micro - 1 else nullcontext():
+                        (loss * world_size).backward()
+            if export:
+                idx, mu_all = gather_rows(y, torch.cat(mu_batch))
+                if is_main_process():
+                    mu_writer.write(idx, mu_all)
+            with monitor.phase('optimizer'):
+                optimizer.step()
+            monitor.step(len(x) * world_size)
+        if montage_every and epoch % montage_every == 0 and is_main_process():
+            with monitor.phase('montage'): # last training batch of the epoch
+                x_hat = torch.sigmoid(x_hat) if fused_loss else x_hat # last micro-batch
+                save_montage(x_micro, x_hat, os.path.join(instrumentation.get('montage_dir', './montage/'), f'epoch_{epoch}.png'),
+                             n=instrumentation.get('montage_samples', 16))
+        if export:
+            if is_main_process():
+                with monitor.phase('checkpoint'):
+                    save_model = 'VAEmodel_'+str(epoch) + '.pt'
+                    writer.save(raw_model.state_dict(), save_path+save_model)
+                    if save_artifacts:
+                        writer.save_artifact(raw_model.state_dict(), save_path+'VAEmodel_'+str(epoch)+'.tensors', meta={'epoch': epoch})
+                    mu_writer.close()
+            with torch.no_grad(), monitor.phase('test'):
+                model.eval()
+                # Save the 'mu' the latent space and the test inputs, row i belongs to test sample i
+                if is_main_process():
+                    mu_test_writer = MemmapWriter(save_path+'mu_list_test_'+str(epoch)+'.npy',
+                                                  len(test_dataset), (latent_dim,))
+                    if not x_test_saved:
+                        x_test_writer = MemmapWriter(save_path+'x_test.npy', len(test_dataset), test_dataset.data.shape[1:])
+                test_loss = torch.zeros((), device=device)
+                test_recons_loss = torch.zeros((), device=device)
+                seen = 0
+                for x,y in test_loader:
+                    x = x.to(device, non_blocking=True)
+                    keep = padding_mask(seen, len(x), len(test_dataset), rank, world_size)
+                    seen += len(x)
+                    x_hat,mu,logvar = model(x, logits=fused_loss)
+                    loss, recons_loss = (lossfunc_logits if fused_loss else lossfunc)(*drop_padding(keep,x,x_hat,mu,logvar),
+                                                                                      beta=beta,terms=True)
+                    test_loss += loss
+                    test_recons_loss += recons_loss
+                    idx, mu_all = gather_rows(y, mu)
+                    if not x_test_saved:
+                        _, x_all = gather_rows(y, x)
+                    if is_main_process():
+                        mu_test_writer.write(idx, mu_all)
+                        if not x_test_saved:
+                            x_test_writer.write(idx, x_all)
+                if is_main_process():
+                    mu_test_writer.close()
+                    if not x_test_saved:
+                        x_test_writer.close()
+                x_test_saved = True
+                test_loss = all_reduce_sum(test_loss).item()
+                test_recons_loss = all_reduce_sum(test_recons_loss).item()
+        train_loss = all_reduce_sum(train_loss).item()
+        if (epoch + 1) % checkpoint_every == 0 or epoch == epochs: # periodic checkpoint, keep the last ones
+            if is_main_process():
+                with monitor.phase('checkpoint'):
+                    writer.save_checkpoint(epoch, raw_model.state_dict(), optimizer.state_dict(), loss=loss)
+
+        monitor.end_epoch(epoch,
+                          train_loss=train_loss/len(train_dataset),
+                          test_loss=None if test_loss is None else test_loss/len(test_dataset),
+                          # reconstruction part of the test loss, comparable between runs with different beta
+                          test_recon_loss=None if test_recons_loss is None else test_recons_loss/len(test_dataset))
+        if is_main_process():
+            print(f'====> Epoch: {epoch} Average loss:{train_loss/len(train_dataset):.4f}')
+        last_epoch = epoch
+
+    # only save last on 
+    # the last epoch is an export epoch, its latents are kept under the 'last' names
+    save_model = 'VAEmodel_'+'last'+ '.pt'
+    # torch.save(model.state_dict(), save_path+save_model)  
+
+
+    # Saving the unwrapped model, the same for single-process, DataParallel and DDP training
+    monitor.close()
+    if is_main_process():
+        writer.save(raw_model.state_dict(), save_path+save_model)
+        if save_artifacts:
+            writer.save_artifact(raw_model.state_dict(), save_path+'VAEmodel_last.tensors', meta={'epoch': last_epoch})
+        for name in ['mu_list_', 'mu_list_test_']:
+            # written by the run that trained last_epoch, which may be an earlier run if nothing was left to train
+            if os.path.exists(save_path+name+str(last_epoch)+'.npy'):
+                shutil.copyfile(save_path+name+str(last_epoch)+'.npy', save_path+name+'last'+'.npy')
+
+        # Save the final model and other states
+        writer.save({
+                    'epoch': last_epoch,
+                    'model_state_dict': raw_model.state_dict(),
+                    'optimizer_state_dict': optimizer.state_dict(),
+                    'loss': loss,
+                    }, checkpoint_path+'checkpoint.tar')
+    writer.close()
+    cleanup()
+
+
+if __name__ == '__main__':
+    # ./config_cluster.json or the path given as first argument
+    main(sys.argv[1] if len(sys.argv) > 1 else './config_cluster.json')
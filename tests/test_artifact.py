@@ -0,0 +1,86 @@
+'''
+memory-mappable tensor artifacts of helper_artifact: round trip, integrity checks and copy-on-write
+
+    python -m pytest tests/test_artifact.py
+'''
+import os
+
+import numpy as np
+import pytest
+import torch
+
+from vae_geom.helper_artifact import (save_artifact, load_artifact, read_header, load_state_dict, convert, unflatten,
+                                      ArtifactError, ALIGN)
+from vae_geom.helper_VAEstruc import CNN_VAE
+
+
+def _tensors():
+    return {'w': torch.randn(3, 5), 'half': torch.randn(7).half(), 'bf': torch.randn(2, 2).bfloat16(),
+            'steps': torch.arange(5), 'mask': torch.tensor([True, False, True]), 'empty': torch.zeros(0, 4),
+            'table': np.arange(12, dtype=np.float64).reshape(3, 4)}
+
+
+def test_round_trip_and_alignment(tmp_path):
+    path = str(tmp_path / 'a.tensors')
+    tensors = _tensors()
+    save_artifact(path, tensors, meta={'epoch': 3})
+    loaded, meta = load_artifact(path, meta=True)
+    assert meta == {'epoch': 3} and list(loaded) == list(tensors)
+    for name, t in tensors.items():
+        assert torch.equal(loaded[name], torch.as_tensor(t)), name
+    header, start = read_header(path)
+    assert start % ALIGN == 0 and all(e['offset'] % ALIGN == 0 for e in header['tensors'].values())
+    assert list(load_artifact(path, names=['steps'])) == ['steps']
+
+
+def test_corrupted_byte_fails_the_checksum(tmp_path):
+    path = str(tmp_path / 'a.tensors')
+    save_artifact(path, {'a': torch.zeros(16), 'b': torch.ones(16)})
+    header, start = read_header(path)
+    with open(path, 'r+b') as f: # flip one byte of b
+        f.seek(start + header['tensors']['b']['offset'] + 5)
+        byte = f.read(1)
+        f.seek(-1, os.SEEK_CUR)
+        f.write(bytes([byte[0] ^ 0xFF]))
+    with pytest.raises(ArtifactError, match='checksum mismatch of b'):
+        load_artifact(path)
+    assert torch.equal(load_artifact(path, names=['a'])['a'], torch.zeros(16)) # the other tensor is intact
+    assert not torch.equal(load_artifact(path, verify=False)['b'], torch.ones(16))
+
+
+def test_invalid_files(tmp_path):
+    path = str(tmp_path / 'a.tensors')
+    save_artifact(path, {'a': torch.zeros(100)})
+    with open(path, 'rb') as f:
+        content = f.read()
+    with open(path, 'wb') as f: # truncated by a crash of a non-atomic copy
+        f.write(content[:-10])
+    with pytest.raises(ArtifactError):
+        read_header(path)
+    with open(path, 'wb') as f:
+        f.write(b'PK\x03\x04' + content[4:]) # e.g. a torch.save zip file renamed to .tensors
+    with pytest.raises(ArtifactError, match='not an artifact'):
+        load_artifact(path)
+
+
+def test_model_weights_copy_on_write(tmp_path):
+    torch.manual_seed(0)
+    model = CNN_VAE(channel_in=2, latent_dim=4, hidden_dims=[8, 16], input_size=32, decoder='upsample').eval()
+    path = save_artifact(str(tmp_path / 'VAEmodel_last.tensors'), model.state_dict())
+    other = CNN_VAE(channel_in=2, latent_dim=4, hidden_dims=[8, 16], input_size=32, decoder='upsample').eval()
+    other.load_state_dict(load_state_dict(path), assign=True)
+    z = torch.randn(3, 4)
+    with torch.no_grad():
+        torch.testing.assert_close(other.decode(z), model.decode(z), rtol=0, atol=0)
+        next(other.parameters()).add_(1.) # changes the private copy of the pages only
+    name = next(iter(model.state_dict()))
+    assert torch.equal(load_artifact(path)[name], model.state_dict()[name]) # the file is unchanged, checksums match
+
+
+def test_convert_checkpoint(tmp_path):
+    src = str(tmp_path / 'checkpoint.tar')
+    torch.save({'epoch': 4, 'model_state_dict': {'layer.weight': torch.ones(2, 2)}, 'loss': 0.5}, src)
+    tensors, meta = load_artifact(convert(src), meta=True)
+    state = unflatten(tensors, meta['values'])
+    assert state['epoch'] == 4 and state['loss'] == 0.5
+    assert torch.equal(state['model_state_dict']['layer.weight'], torch.ones(2, 2))
@@ -0,0 +1,67 @@
+'''
+atomic checkpoint writing and keep-last-K retention of helper_checkpoint
+
+    python -m pytest tests/test_checkpoint.py
+'''
+import os
+
+import pytest
+import torch
+
+from vae_geom.helper_checkpoint import atomic_save, list_checkpoints, load_latest_checkpoint, CheckpointWriter
+
+
+def _states(value):
+    model = torch.nn.Linear(3, 2)
+    torch.nn.init.constant_(model.weight, value)
+    optimizer = torch.optim.Adam(model.parameters())
+    return model.state_dict(), optimizer.state_dict()
+
+
+def test_failed_save_keeps_previous_file(tmp_path):
+    path = str(tmp_path / 'model.pth')
+    atomic_save({'value': 1}, path)
+    with pytest.raises(Exception):
+        atomic_save({'value': lambda: 2}, path) # not picklable, fails halfway
+    assert torch.load(path) == {'value': 1}
+    assert os.listdir(tmp_path) == ['model.pth'] # no temporary file is left behind
+
+
+def test_keep_last_retention(tmp_path):
+    writer = CheckpointWriter(str(tmp_path), keep_last=2)
+    for epoch in range(5):
+        writer.save_checkpoint(epoch, *_states(float(epoch)), loss=epoch / 10)
+    writer.close()
+    assert [epoch for epoch, _ in list_checkpoints(str(tmp_path))] == [4, 3]
+    checkpoint = load_latest_checkpoint(str(tmp_path))
+    assert checkpoint['epoch'] == 4 and checkpoint['loss'] == 0.4
+    assert (checkpoint['model_state_dict']['weight'] == 4.).all()
+
+
+def test_corrupt_checkpoint_is_skipped(tmp_path):
+    writer = CheckpointWriter(str(tmp_path), keep_last=None)
+    for epoch in range(3):
+        writer.save_checkpoint(epoch, *_states(float(epoch)))
+    writer.close()
+    newest = list_checkpoints(str(tmp_path))[0][1]
+    with open(newest, 'r+b') as f: # a checkpoint truncated by a crash of an older, non-atomic writer
+        f.truncate(os.path.getsize(newest) // 2)
+    assert load_latest_checkpoint(str(tmp_path))['epoch'] == 1
+    torch.save({'epoch': 7}, str(tmp_path / 'checkpoint_000008.tar')) # no model or optimizer state
+    assert load_latest_checkpoint(str(tmp_path))['epoch'] == 1
+
+
+def test_legacy_fallback_and_empty_folder(tmp_path):
+    assert load_latest_checkpoint(str(tmp_path)) is None
+    model_state, optimizer_state = _states(0.)
+    torch.save({'epoch': 2, 'model_state_dict': model_state, 'optimizer_state_dict': optimizer_state},
+               str(tmp_path / 'checkpoint.tar'))
+    assert load_latest_checkpoint(str(tmp_path))['epoch'] == 2
+
+
+def test_background_error_is_raised(tmp_path):
+    writer = CheckpointWriter(str(tmp_path))
+    writer.save({'value': lambda: 0}, str(tmp_path / 'bad.pth'))
+    with pytest.raises(RuntimeError):
+        writer.wait()
+    writer.close() # the error was reported once, the writer stays usable
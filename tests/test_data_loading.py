@@ -0,0 +1,91 @@
+'''
+memory-mapped and sharded input modes of custom_datasets, see vae_geom.benchmark_data_loading for the full-size benchmark
+
+    python -m pytest tests/test_data_loading.py
+'''
+import os
+import sys
+import json
+import subprocess
+
+import numpy as np
+import pytest
+
+from vae_geom.helper_load_data import custom_datasets, custom_transform
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+
+# run in a fresh process: build the dataset, touch every sample, report the peak anonymous RSS
+CHILD = '''
+import sys, json
+from vae_geom.helper_load_data import custom_datasets, custom_transform
+from vae_geom.helper_instrument import anon_rss_mb
+paths = sys.argv[1].split(',') if len(sys.argv) > 2 else sys.argv[1]
+baseline = anon_rss_mb()
+dataset = custom_datasets(paths, transform=custom_transform, mmap=True)
+peak = anon_rss_mb()
+for i in range(len(dataset)):
+    dataset[i]
+    if i % 64 == 0:
+        peak = max(peak, anon_rss_mb())
+peak = max(peak, anon_rss_mb())
+print(json.dumps({'n': len(dataset), 'growth_mb': peak - baseline}))
+'''
+
+
+def write_random_dataset(path, n, channels=3, dim=90, chunk=256, seed=0):
+    ''' random [n*channels*dim*dim] float32 .npy file, written chunk by chunk '''
+    rng = np.random.default_rng(seed)
+    data = np.lib.format.open_memmap(path, mode='w+', dtype=np.float32, shape=(n, channels, dim, dim))
+    for start in range(0, n, chunk):
+        data[start:start + chunk] = rng.random((min(chunk, n - start), channels, dim, dim), dtype=np.float32)
+    data.flush()
+    del data
+    return path
+
+
+def measure_peak_rss(data_path, shards=False):
+    ''' peak anonymous RSS growth of iterating over the memory-mapped dataset in a separate process '''
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(p for p in (SRC, os.environ.get('PYTHONPATH')) if p))
+    cmd = [sys.executable, '-c', CHILD, data_path] + (['--shards'] if shards else [])
+    out = subprocess.run(cmd, check=True, capture_output=True, text=True, env=env)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+@pytest.fixture(scope='module')
+def datasets(tmp_path_factory):
+    ''' a small and a 10x larger random dataset, the larger one also as 4 shards '''
+    tmp = tmp_path_factory.mktemp('data')
+    small = write_random_dataset(str(tmp / 'small.npy'), 200)
+    large = write_random_dataset(str(tmp / 'large.npy'), 2000) # 194 MB
+    shards = [write_random_dataset(str(tmp / f'large_{k}.npy'), 500, seed=k) for k in range(4)]
+    return small, large, shards
+
+
+def test_mmap_samples_equal_in_memory(datasets):
+    small, _, _ = datasets
+    in_memory = custom_datasets(small, transform=custom_transform)
+    mapped = custom_datasets(small, transform=custom_transform, mmap=True)
+    assert len(mapped) == len(in_memory)
+    for i in (0, 57, len(mapped) - 1):
+        np.testing.assert_array_equal(np.asarray(mapped[i][0]), np.asarray(in_memory[i][0]))
+
+
+def test_shards_are_concatenated(datasets):
+    _, _, shards = datasets
+    mapped = custom_datasets(shards, transform=custom_transform, mmap=True)
+    assert len(mapped) == 2000
+    last = np.load(shards[-1], mmap_mode='r')
+    np.testing.assert_array_equal(np.asarray(mapped[1999][0]), custom_transform(np.array(last[-1, :2])))
+
+
+@pytest.mark.parametrize('sharded', [False, True])
+def test_mmap_rss_is_flat(datasets, sharded):
+    ''' iterating over every sample must not grow the anonymous RSS with the dataset size '''
+    small, large, shards = datasets
+    target = ','.join(shards) if sharded else large
+    growth_small = measure_peak_rss(small)['growth_mb']
+    result = measure_peak_rss(target, shards=sharded)
+    assert result['n'] == 2000
+    # the large dataset is 194 MB, loading it would grow the RSS by about as much
+    assert result['growth_mb'] < growth_small + 16.
@@ -0,0 +1,63 @@
+'''
+LRU decode cache of helper_decode_cache, with a cheap stand-in for CNN_VAE.decode
+
+    python -m pytest tests/test_decode_cache.py
+'''
+import threading
+
+import torch
+
+from vae_geom.helper_decode_cache import DecodeCache
+
+
+class _decoder:
+    ''' fields [B*2*4*4] that depend on z, counting the decoded rows '''
+    def __init__(self):
+        self.rows = 0
+
+    def __call__(self, z):
+        self.rows += len(z)
+        return torch.sin(z.sum(1))[:, None, None, None].expand(-1, 2, 4, 4) + torch.arange(16.).view(1, 1, 4, 4)
+
+
+def test_hits_misses_and_grid_centers():
+    decode = _decoder()
+    cache = DecodeCache(decode, tolerance=0.1)
+    z = torch.tensor([[0.01, 0.5], [0.52, 0.2], [0.0, 0.49]]) # rows 0 and 2 share the grid cell (0, 5)
+    out = cache.decode(z)
+    assert decode.rows == 2 # distinct cells are decoded once
+    torch.testing.assert_close(out, decode(torch.tensor([[0., 0.5], [0.5, 0.2], [0., 0.5]])))
+    cache.decode(z[:2])
+    assert cache.stats()['hits'] == 2 and cache.stats()['misses'] == 3 and decode.rows == 2 + 3
+    assert len(cache) == 2
+
+
+def test_byte_budget_evicts_least_recently_used():
+    field_bytes = 2 * 4 * 4 * 4
+    cache = DecodeCache(_decoder(), tolerance=1., max_bytes=2 * field_bytes)
+    cache.decode(torch.tensor([[0., 0.], [1., 0.]]))
+    cache.decode(torch.tensor([[0., 0.]])) # cell (0, 0) is now the most recent
+    cache.decode(torch.tensor([[2., 0.]])) # evicts (1, 0)
+    stats = cache.stats()
+    assert stats['evictions'] == 1 and stats['bytes'] == 2 * field_bytes and stats['entries'] == 2
+    cache.decode(torch.tensor([[0., 0.], [1., 0.]]))
+    assert cache.stats()['hits'] == 2 and cache.stats()['misses'] == 4
+
+
+def test_counters_under_concurrency():
+    cache = DecodeCache(_decoder(), tolerance=0.5)
+    n_threads, n_calls, rows = 8, 50, 4
+
+    def worker(k):
+        g = torch.Generator().manual_seed(k)
+        for _ in range(n_calls):
+            cache.decode(torch.randint(0, 6, (rows, 2), generator=g).float())
+
+    threads = [threading.Thread(target=worker, args=(k,)) for k in range(n_threads)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    stats = cache.stats()
+    assert stats['hits'] + stats['misses'] == n_threads * n_calls * rows
+    assert stats['entries'] == 36
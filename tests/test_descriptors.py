@@ -0,0 +1,73 @@
+'''
+batched geometric descriptors of helper_descriptors, against the per-cell numpy baseline and hand-made cells
+
+    python -m pytest tests/test_descriptors.py
+'''
+import numpy as np
+import pytest
+import torch
+
+from vae_geom.helper_descriptors import (DESCRIPTORS, descriptors, volume_fraction, perimeter, min_feature_size,
+                                         components, baseline_descriptors, _ball)
+from vae_geom.benchmark_model import smooth_fields
+
+
+def _cells(*masks):
+    ''' fields [B*1*W*L] of solid masks, 1 in the solid and 0 in the void '''
+    return torch.stack([torch.as_tensor(m, dtype=torch.float32) for m in masks])[:, None]
+
+
+def test_batched_matches_baseline():
+    x = smooth_fields(6, resolution=40, cells=5, seed=3)
+    desc = descriptors(x, isovalue=0.5, max_radius=4)
+    ref = baseline_descriptors(x, isovalue=0.5, max_radius=4)
+    for k, name in enumerate(DESCRIPTORS):
+        assert desc[name].shape == (6, 2)
+        np.testing.assert_allclose(desc[name].numpy(), ref[..., k], rtol=1e-5, atol=1e-6, err_msg=name)
+
+
+def test_hand_made_cells():
+    disc = np.zeros((12, 12))
+    disc[2:7, 3:8] = _ball(2, 2, 'cpu').numpy() # the digital ball of diameter 5, 21 cells
+    two = np.zeros((12, 12))
+    two[1:3, 1:3] = 1 # 2x2, thinner than any ball but the single cell
+    two[6:10, 5:11] = 1
+    spiral = np.zeros((12, 12)) # one region with several turns, a line of width 1
+    spiral[1, 1:11] = spiral[1:11, 10] = spiral[10, 2:11] = spiral[3:11, 2] = spiral[3, 2:9] = spiral[3:9, 8] = 1
+    empty = np.zeros((12, 12))
+    x = _cells(disc, two, spiral, empty)
+
+    torch.testing.assert_close(volume_fraction(x)[:, 0], torch.tensor([21., 28., float(spiral.sum()), 0.]) / 144)
+    torch.testing.assert_close(perimeter(x)[:, 0], torch.tensor([20., 8. + 20., 2 * float(spiral.sum()) + 2, 0.]) / 12)
+    assert components(x)[:, 0].tolist() == [1., 2., 1., 0.]
+    assert min_feature_size(x)[:, 0].tolist() == [5., 1., 1., 0.]
+
+
+def test_periodic_boundary():
+    band = np.zeros((8, 8))
+    band[:, :2] = band[:, 6:] = 1 # one band split by the unit cell boundary
+    x = _cells(band)
+    assert components(x)[0, 0] == 2. and components(x, periodic=True)[0, 0] == 1.
+    assert perimeter(x)[0, 0] == 2 * 8 / 8 and perimeter(x, periodic=True)[0, 0] == 2 * 8 / 8
+    cut = _cells(band[:, 3:]) # solid at the right side only, 5 cells wide
+    assert perimeter(cut)[0, 0] == 8 / 5 and perimeter(cut, periodic=True)[0, 0] == 2 * 8 / 5
+
+
+def test_voxel_cube():
+    x = torch.zeros(1, 1, 10, 10, 10)
+    x[..., 2:6, 3:7, 1:5] = 1.
+    desc = descriptors(x, max_radius=3)
+    assert desc['volume_fraction'][0, 0] == 64 / 1000
+    assert desc['perimeter'][0, 0] == pytest.approx(6 * 16 / 100) # faces of 1/10 x 1/10
+    assert desc['components'][0, 0] == 1.
+
+
+def test_differentiable_variants():
+    x = smooth_fields(4, resolution=32, seed=1).requires_grad_(True)
+    smooth = descriptors(x, names=('volume_fraction', 'perimeter'), differentiable=True, sharpness=200.)
+    exact = descriptors(x.detach(), names=('volume_fraction', 'perimeter'))
+    assert (smooth['volume_fraction'] - exact['volume_fraction']).abs().max() < 0.02
+    (smooth['volume_fraction'].sum() + smooth['perimeter'].sum()).backward()
+    assert torch.isfinite(x.grad).all() and x.grad.abs().sum() > 0
+    with pytest.raises(ValueError):
+        descriptors(x, names=('porosity',))
@@ -0,0 +1,58 @@
+'''
+vectorized color maps of helper_display against the original per-channel loop
+
+    python -m pytest tests/test_display.py
+'''
+import numpy as np
+import pytest
+
+from vae_geom.helper_display import make_bitmap2, colorize, montage
+
+
+def loop_make_bitmap2(image):
+    ''' make_bitmap2 before vectorization, the reference '''
+    nx = image.shape[0]
+    ny = nx
+    image = image.reshape(nx * ny, 3)
+    color = np.array([[1, 0, 0], [0, 0, 1], [1, 1, 1], [0, 1, 0], [0, 0, 0]])
+    I = np.zeros((nx * ny, 3))
+    for j in range(3):
+        I[:, :3] += image[:, j, None] * color[j, :3]
+    return I.reshape(ny, nx, 3, order='F')
+
+
+@pytest.mark.parametrize('n', [1, 7, 90])
+def test_make_bitmap2_matches_loop(n):
+    image = np.random.default_rng(n).random((n, n, 3))
+    np.testing.assert_allclose(make_bitmap2(image), loop_make_bitmap2(image), rtol=1e-12, atol=1e-12)
+
+
+def test_colorize_matches_make_bitmap2():
+    ''' colorize maps a batch [B*C*H*W] as make_bitmap2 maps one [W*H*C] image, then clips and rounds to uint8 '''
+    batch = np.random.default_rng(0).random((4, 3, 16, 16)).astype(np.float32)
+    rgb = colorize(batch)
+    for image, colored in zip(batch, rgb):
+        expected = make_bitmap2(image.transpose(2, 1, 0)) # [W*H*C] in, [H*W*3] out
+        np.testing.assert_array_equal(colored, (np.clip(expected, 0., 1.) * 255. + 0.5).astype(np.uint8))
+
+
+def test_montage_shape():
+    x = np.random.default_rng(0).random((10, 2, 8, 8)).astype(np.float32)
+    image = montage(x, x, ncols=4, pad=2, error=True)
+    # 3 rows of 4 tiles, each with an input, a reconstruction and an error panel
+    assert image.shape == (3 * 3 * 10 + 2, 4 * 10 + 2, 3)
+    assert image.dtype == np.uint8
+
+
+@pytest.mark.parametrize('x_hat, error, panels', [(False, False, 1), (True, False, 2), (True, True, 3)])
+def test_montage_panels(x_hat, error, panels):
+    x = np.random.default_rng(0).random((5, 2, 6, 6)).astype(np.float32)
+    image = montage(x, x if x_hat else None, ncols=8, pad=1, error=error)
+    assert image.shape == (panels * 7 + 1, 5 * 7 + 1, 3)
+
+
+def test_montage_of_voxels_shows_middle_slice():
+    torch = pytest.importorskip('torch')
+    x = torch.rand(3, 2, 5, 8, 8)
+    x_hat = torch.rand(3, 2, 5, 8, 8)
+    np.testing.assert_array_equal(montage(x, x_hat, error=True), montage(x[:, :, 2], x_hat[:, :, 2], error=True))
@@ -0,0 +1,104 @@
+'''
+DistributedDataParallel mode: a model trained by 2 gloo processes is the one trained by 1 process
+
+    python -m pytest tests/test_distributed.py
+'''
+import os
+import sys
+import json
+import subprocess
+
+import numpy as np
+import pytest
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from torch.nn.parallel import DistributedDataParallel
+
+from vae_geom.helper_VAEstruc import CNN_VAE, lossfunc
+from vae_geom.helper_distributed import sample_noise, convert_sync_batchnorm, padding_mask, drop_padding
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+
+
+def test_sample_noise_is_per_sample():
+    noise = sample_noise(torch.arange(8), 6, seed=40, epoch=3)
+    np.testing.assert_array_equal(sample_noise(torch.tensor([5, 2]), 6, seed=40, epoch=3), noise[[5, 2]])
+    assert not torch.equal(sample_noise(torch.arange(8), 6, seed=40, epoch=4), noise)
+
+
+def test_padding_is_dropped():
+    # 10 samples on 4 processes: the sampler repeats 2 samples, positions 10 and 11 of the padded sequence
+    keeps = [padding_mask(0, 3, 10, rank, 4) for rank in range(4)]
+    assert keeps[0] is None and keeps[1] is None
+    assert keeps[2].tolist() == [True, True, False] and keeps[3].tolist() == [True, True, False]
+    x, = drop_padding(keeps[2], torch.arange(3))
+    assert x.tolist() == [0, 1]
+
+
+def _gradients(rank, world_size, init_file, out):
+    ''' gradients of one summed-loss step on 8 samples, the samples split over world_size processes '''
+    torch.manual_seed(0)
+    model = CNN_VAE(channel_in=2, latent_dim=4, hidden_dims=[8, 16], input_size=32, decoder='upsample').double()
+    x = torch.rand(8, 2, 32, 32, generator=torch.Generator().manual_seed(1), dtype=torch.float64)
+    y = torch.arange(8)
+    if world_size > 1:
+        dist.init_process_group('gloo', init_method='file://' + init_file, rank=rank, world_size=world_size)
+        model = DistributedDataParallel(convert_sync_batchnorm(model))
+        x, y = x[rank::world_size], y[rank::world_size] # DistributedSampler without shuffling
+    x_hat, mu, logvar = model(x, eps=sample_noise(y, 4, seed=40))
+    (lossfunc(x, x_hat, mu, logvar, beta=10.) * world_size).backward()
+    module = model.module if world_size > 1 else model
+    if rank == 0:
+        torch.save({'grad': {k: p.grad for k, p in module.named_parameters()},
+                    'buffers': dict(module.named_buffers())}, out)
+    if world_size > 1:
+        dist.destroy_process_group()
+
+
+def test_gradients_match_single_process(tmp_path):
+    ''' in float64, the batch norm statistics and gradients of 2 processes are those of the whole batch '''
+    _gradients(0, 1, None, str(tmp_path / 'single.pt'))
+    mp.spawn(_gradients, args=(2, str(tmp_path / 'init'), str(tmp_path / 'ddp.pt')), nprocs=2)
+    single, ddp = torch.load(tmp_path / 'single.pt'), torch.load(tmp_path / 'ddp.pt')
+    for kind in ('grad', 'buffers'):
+        assert single[kind].keys() == ddp[kind].keys()
+        for k in single[kind]:
+            torch.testing.assert_close(ddp[kind][k], single[kind][k], rtol=1e-9, atol=1e-9, msg=k)
+
+
+def _train(folder, world_size):
+    cmd = [sys.executable, '-m', 'vae_geom.main_train_on_GPU', 'config.json']
+    if world_size > 1:
+        cmd = [sys.executable, '-m', 'torch.distributed.run', '--standalone', '--nproc_per_node', str(world_size)] + cmd[1:]
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(p for p in (SRC, os.environ.get('PYTHONPATH')) if p),
+               OMP_NUM_THREADS='1')
+    subprocess.run(cmd, cwd=folder, env=env, check=True, capture_output=True)
+    return torch.load(os.path.join(folder, 'save_model', 'VAEmodel_last.pt'))
+
+
+def test_training_is_independent_of_world_size(tmp_path):
+    '''
+    the training script on 1 and 2 processes, shuffled, 3 steps per epoch, 2 epochs: the batch norm statistics
+    of every step depend on the sample partition, the synchronization and the reparameterization noise.
+    The learning rate is 0: Adam moves a weight by about lr per step whatever the size of its gradient, the
+    gradients that are zero up to rounding (the conv biases before batch norm) would step by +-lr in either run
+    '''
+    rng = np.random.default_rng(0)
+    np.save(tmp_path / 'train.npy', rng.random((12, 3, 90, 90)))
+    np.save(tmp_path / 'test.npy', rng.random((4, 3, 90, 90)))
+    states = []
+    for world_size in (1, 2):
+        folder = tmp_path / f'world_size_{world_size}'
+        os.makedirs(folder / 'save_model')
+        config = {'model_params': {'batch_size': 4, 'latent_dim': 4, 'beta': 10, 'decoder': 'upsample'},
+                  'train_params': {'learning_rate': 0., 'epochs': 1, 'loading_checkpoint': False, 'export_every': 1},
+                  'random_seed': {'manual_seed': 40, 'cuda_manual_seed': 39},
+                  'Path': {'train_data_path': '../train.npy', 'test_data_path': '../test.npy',
+                           'save_path': './save_model/', 'log_path': './'}}
+        (folder / 'config.json').write_text(json.dumps(config))
+        states.append(_train(str(folder), world_size))
+    single, ddp = states
+    assert single.keys() == ddp.keys()
+    for k in single:
+        torch.testing.assert_close(ddp[k], single[k], rtol=1e-5, atol=1e-6, msg=k)
@@ -0,0 +1,66 @@
+'''
+batch norm folding and the saved InferenceDecoder of helper_export
+
+    python -m pytest tests/test_export.py
+'''
+import pytest
+import torch
+from torch import nn
+
+from vae_geom.helper_VAEstruc import CNN_VAE
+from vae_geom.helper_export import fold_conv_bn, InferenceDecoder, load_inference_decoder, PRECISIONS
+
+
+def _randomize_batchnorm(module, generator):
+    ''' non-trivial running statistics and affine parameters, as after training '''
+    for m in module.modules():
+        if isinstance(m, nn.BatchNorm2d):
+            with torch.no_grad():
+                m.running_mean.normal_(0., 0.5, generator=generator)
+                m.running_var.uniform_(0.5, 2., generator=generator)
+                m.weight.uniform_(0.5, 1.5, generator=generator)
+                m.bias.normal_(0., 0.5, generator=generator)
+    return module
+
+
+@pytest.fixture(scope='module')
+def model():
+    torch.manual_seed(0)
+    model = CNN_VAE(channel_in=2, latent_dim=4, hidden_dims=[8, 16], input_size=32, decoder='upsample')
+    return _randomize_batchnorm(model, torch.Generator().manual_seed(1)).eval()
+
+
+@pytest.mark.parametrize('conv', [nn.Conv2d(3, 5, 3, padding=1), nn.ConvTranspose2d(3, 5, 3, stride=2, padding=1),
+                                  nn.Conv2d(3, 5, 3, bias=False)])
+def test_fold_conv_bn(conv):
+    bn = _randomize_batchnorm(nn.Sequential(nn.BatchNorm2d(5)), torch.Generator().manual_seed(2))[0].eval()
+    x = torch.randn(2, 3, 9, 9)
+    with torch.no_grad():
+        torch.testing.assert_close(fold_conv_bn(conv, bn)(x), bn(conv(x)), rtol=1e-5, atol=1e-5)
+
+
+def test_folded_decoder_matches_eval_model(model):
+    decoder = InferenceDecoder(model)
+    assert not any(isinstance(m, nn.BatchNorm2d) for m in decoder.modules())
+    z = torch.randn(5, 4)
+    with torch.no_grad():
+        torch.testing.assert_close(decoder.decode(z), model.decode(z), rtol=1e-5, atol=1e-5)
+
+
+def test_bf16_decoder_is_close(model):
+    z = torch.randn(5, 4)
+    with torch.no_grad():
+        err = (InferenceDecoder(model, precision='bf16').decode(z) - model.decode(z)).abs().max().item()
+    assert err < 0.05 # fields in [0,1], bfloat16 keeps 8 bits of mantissa
+
+
+@pytest.mark.parametrize('precision', PRECISIONS)
+@pytest.mark.parametrize('channels_last', [True, False])
+def test_save_load_round_trip(model, tmp_path, precision, channels_last):
+    decoder = InferenceDecoder(model, channels_last=channels_last, precision=precision)
+    decoder.save(tmp_path / 'decoder.pt')
+    loaded = load_inference_decoder(tmp_path / 'decoder.pt')
+    assert loaded.precision == precision and loaded.channels_last == channels_last and not loaded.training
+    z = torch.randn(5, 4)
+    with torch.no_grad():
+        torch.testing.assert_close(loaded.decode(z), decoder.decode(z), rtol=0, atol=0)
@@ -0,0 +1,43 @@
+'''
+minimal inference path of the package: vae_geom.inference loads and decodes without the training,
+plotting or benchmark modules
+
+    python -m pytest tests/test_inference.py
+'''
+import os
+import sys
+import json
+import subprocess
+
+import torch
+
+from vae_geom.inference import load_model
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+
+CHILD = '''
+import sys, json, torch
+from vae_geom.inference import load_model
+model = load_model(sys.argv[1], sys.argv[2])
+with torch.inference_mode():
+    model.decode(torch.zeros(1, 6))
+print(json.dumps(sorted(sys.modules)))
+'''
+
+
+def test_inference_imports_no_training_or_display_modules(tmp_path):
+    config = tmp_path / 'config.json'
+    config.write_text(json.dumps({'model_params': {'latent_dim': 6, 'decoder': 'upsample'},
+                                  'Path': {'train_data_path': 'train.npy'}}))
+    model_path = str(tmp_path / 'model.pt')
+    torch.save(load_model(str(config)).state_dict(), model_path)
+
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(p for p in (SRC, os.environ.get('PYTHONPATH')) if p))
+    out = subprocess.run([sys.executable, '-c', CHILD, str(config), model_path], check=True, capture_output=True,
+                         text=True, env=env, cwd=str(tmp_path))
+    modules = set(json.loads(out.stdout.strip().splitlines()[-1]))
+    assert 'vae_geom.helper_VAEstruc' in modules
+    for name in ('torchvision', 'matplotlib', 'vae_geom.main_train_on_GPU', 'vae_geom.helper_display',
+                 'vae_geom.helper_load_data', 'vae_geom.cli'):
+        assert name not in modules
+    assert not any(m.startswith('vae_geom.benchmark_') for m in modules)
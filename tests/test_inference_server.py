@@ -0,0 +1,68 @@
+'''
+dynamic batching of helper_inference_server: coalesced requests decode as the model does
+
+    python -m pytest tests/test_inference_server.py
+'''
+import threading
+
+import numpy as np
+import pytest
+import torch
+
+from vae_geom.helper_VAEstruc import CNN_VAE
+from vae_geom.helper_inference_server import DecodeServer, DecodeClient, serve_unix_socket
+
+
+@pytest.fixture(scope='module')
+def model():
+    torch.manual_seed(0)
+    model = CNN_VAE(channel_in=2, latent_dim=4, hidden_dims=[8, 16], input_size=32, decoder='upsample').eval()
+    for p in model.parameters():
+        p.requires_grad_(False)
+    return model
+
+
+def test_coalesced_requests_match_model(model):
+    z = torch.randn(12, 4)
+    with torch.inference_mode():
+        expected = model.decode(z)
+    with DecodeServer(model, max_batch_size=8, max_wait_ms=50.) as server:
+        futures = [server.submit(z[i:i + 3]) for i in range(0, 12, 3)] + [server.submit(z[0].numpy())]
+        results = [f.result(timeout=30) for f in futures]
+        stats = server.stats()
+    for i, result in enumerate(results[:-1]):
+        torch.testing.assert_close(result, expected[3 * i:3 * i + 3], rtol=1e-5, atol=1e-6)
+    torch.testing.assert_close(results[-1], expected[:1], rtol=1e-5, atol=1e-6)
+    assert stats['requests'] == 5 and stats['samples'] == 13
+    assert stats['batches'] < 5 # requests were coalesced
+
+
+def test_malformed_request_is_rejected_alone(model):
+    with DecodeServer(model, max_batch_size=64, max_wait_ms=100.) as server:
+        good = server.submit(torch.randn(2, 4))
+        with pytest.raises(ValueError):
+            server.submit(torch.randn(2, 5))
+        with pytest.raises(ValueError):
+            server.submit(torch.randn(2, 4, 1))
+        other = server.submit(torch.randn(3, 4))
+        assert good.result(timeout=30).shape == (2, 2, 32, 32)
+        assert other.result(timeout=30).shape == (3, 2, 32, 32)
+        assert server.stats()['requests'] == 2
+
+
+def test_unix_socket_client(model, tmp_path):
+    path = str(tmp_path / 'vae.sock')
+    z = np.random.default_rng(0).standard_normal((3, 4)).astype(np.float32)
+    with DecodeServer(model, max_wait_ms=1.) as server:
+        sock_server = serve_unix_socket(server, path)
+        threading.Thread(target=sock_server.serve_forever, daemon=True).start()
+        try:
+            with DecodeClient(path) as client:
+                with pytest.raises(RuntimeError):
+                    client.decode(np.zeros((1, 5), dtype=np.float32))
+                result = client.decode(z) # the connection survives the rejected request
+        finally:
+            sock_server.shutdown()
+            sock_server.server_close()
+    with torch.inference_mode():
+        np.testing.assert_allclose(result, model.decode(torch.from_numpy(z)).numpy(), rtol=1e-5, atol=1e-6)
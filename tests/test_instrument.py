@@ -0,0 +1,73 @@
+'''
+per-phase instrumentation of helper_instrument
+
+    python -m pytest tests/test_instrument.py
+'''
+import os
+import json
+import time
+
+import torch
+
+from vae_geom.helper_instrument import TrainingMonitor, TRAIN_PHASES, peak_rss_mb, anon_rss_mb
+
+
+class _slow_loader:
+    ''' 3 batches, each taking 10 ms to produce '''
+    def __iter__(self):
+        for i in range(3):
+            time.sleep(0.01)
+            yield torch.full((4, 2), float(i)), torch.arange(4)
+
+
+def test_phases_steps_and_log(tmp_path):
+    log = str(tmp_path / 'logs' / 'train_log.jsonl')
+    monitor = TrainingMonitor(log_file=log)
+    for epoch in range(2):
+        batches = []
+        for x, y in monitor.timed_iter(_slow_loader()):
+            batches.append(x)
+            with monitor.phase('forward'):
+                time.sleep(0.005)
+            with monitor.phase('backward'):
+                pass
+            monitor.step(len(x))
+        assert len(batches) == 3
+        record = monitor.end_epoch(epoch, train_loss=1.5)
+        assert monitor.phases == {} and monitor.samples == 0 # reset for the next epoch
+    monitor.close()
+
+    with open(log) as f:
+        records = [json.loads(line) for line in f]
+    assert [r['epoch'] for r in records] == [0, 1]
+    assert records[-1] == json.loads(json.dumps(record))
+    for r in records:
+        assert r['samples'] == 12 and r['train_loss'] == 1.5
+        assert r['phases']['data'] >= 0.03 and r['phases']['forward'] >= 0.015
+        train_seconds = sum(r['phases'].get(name, 0.) for name in TRAIN_PHASES)
+        assert abs(r['samples_per_sec'] - 12 / train_seconds) < 1e-6 * r['samples_per_sec']
+        assert r['epoch_seconds'] >= train_seconds
+        assert r['peak_rss_mb'] > 0
+    assert monitor.global_step == 6
+
+
+def test_no_log_file():
+    monitor = TrainingMonitor()
+    with monitor.phase('test'):
+        pass
+    assert 'test' in monitor.end_epoch(0)['phases']
+
+
+def test_profiler_trace(tmp_path):
+    monitor = TrainingMonitor(profile_start=1, profile_steps=1, profile_dir=str(tmp_path))
+    for _ in range(3):
+        with monitor.phase('forward'):
+            torch.ones(8, 8) @ torch.ones(8, 8)
+        monitor.step(8)
+    monitor.close()
+    assert os.path.exists(tmp_path / 'trace_step_1.json')
+
+
+def test_memory_readings():
+    assert peak_rss_mb() > 0
+    assert 0 < anon_rss_mb() <= peak_rss_mb() + 1.
@@ -0,0 +1,50 @@
+'''
+latent-grid lookup table of helper_latent_grid, with a multilinear stand-in for CNN_VAE.decode
+
+    python -m pytest tests/test_latent_grid.py
+'''
+import numpy as np
+import pytest
+import torch
+
+from vae_geom.helper_latent_grid import latent_bounds, grid_axes, build_latent_grid, LatentGridInterpolator
+
+
+def _multilinear(z):
+    ''' fields [B*1*2*2], multilinear in z, reproduced exactly by the interpolation '''
+    z = torch.as_tensor(z, dtype=torch.float32)
+    value = 1. + z[:, 0] + 2. * z[:, 1] - z[:, 0] * z[:, 1]
+    return value[:, None, None, None] * torch.tensor([[[1., 2.], [3., 4.]]])
+
+
+def test_grid_interpolates_multilinear_fields(tmp_path):
+    axes = grid_axes([-1., 0.], [1., 2.], [3, 4])
+    build_latent_grid(_multilinear, axes, str(tmp_path), batch_size=5,
+                      scalar_fns={'mean': lambda x: x.mean(dim=(1, 2, 3))})
+    grid = LatentGridInterpolator(str(tmp_path))
+    z = torch.tensor([[-0.3, 0.7], [0.9, 1.9], [-1., 0.], [0.25, 1.2]])
+    torch.testing.assert_close(grid(z), _multilinear(z), rtol=1e-5, atol=1e-5)
+    torch.testing.assert_close(grid.interpolate_scalars(z)[:, 0], _multilinear(z).mean(dim=(1, 2, 3)),
+                               rtol=1e-5, atol=1e-5)
+    # outside the grid the queries are clamped to its boundary
+    torch.testing.assert_close(grid(torch.tensor([[5., 0.7]])), _multilinear(torch.tensor([[1., 0.7]])))
+
+
+def test_degenerate_axes_are_rejected():
+    with pytest.raises(ValueError):
+        grid_axes([0., 0.], [1., 1.], 1)
+    with pytest.raises(ValueError):
+        grid_axes([0., 0.5], [1., 0.5], 3)
+    # a collapsed latent dimension gives bounds of zero width
+    mu = np.stack([np.linspace(-1., 1., 50), np.full(50, 0.3)], axis=1)
+    with pytest.raises(ValueError):
+        grid_axes(*latent_bounds(mu), 3)
+
+
+def test_repeated_grid_coordinates_give_no_nan(tmp_path):
+    ''' tables built from axes with a zero-width cell, e.g. written by hand, interpolate without NaN '''
+    axes = [np.array([-1., 1.]), np.array([0.5, 0.5, 1.])]
+    build_latent_grid(_multilinear, axes, str(tmp_path))
+    out = LatentGridInterpolator(str(tmp_path))(torch.tensor([[0.2, 0.5], [0.2, 0.4]]))
+    assert torch.isfinite(out).all()
+    torch.testing.assert_close(out, _multilinear(torch.tensor([[0.2, 0.5], [0.2, 0.5]])), rtol=1e-5, atol=1e-5)
@@ -0,0 +1,64 @@
+'''
+exact and partitioned k-nearest-neighbour search of helper_latent_index
+
+    python -m pytest tests/test_latent_index.py
+'''
+import numpy as np
+import pytest
+
+from vae_geom.helper_latent_index import LatentIndex, write_library, kmeans
+
+
+def _brute_force(library, queries, k):
+    d = np.sqrt(((queries[:, None].astype(np.float64) - library[None]) ** 2).sum(-1))
+    rows = np.argsort(d, axis=1, kind='stable')[:, :k]
+    return np.take_along_axis(d, rows, axis=1), rows
+
+
+@pytest.fixture
+def library(tmp_path):
+    rng = np.random.default_rng(0)
+    latents = rng.standard_normal((500, 6)).astype(np.float32)
+    write_library(str(tmp_path), latents, ids=np.arange(500) + 1000)
+    return str(tmp_path), latents, rng.standard_normal((20, 6)).astype(np.float32)
+
+
+@pytest.mark.parametrize('block_rows', [2**18, 64]) # one block and blocks smaller than the library
+def test_exact_search_is_brute_force(library, block_rows):
+    folder, latents, queries = library
+    d, ids = LatentIndex(folder, block_rows=block_rows).search(queries, k=7)
+    d_ref, rows_ref = _brute_force(latents, queries, 7)
+    np.testing.assert_array_equal(ids, rows_ref + 1000)
+    np.testing.assert_allclose(d, d_ref, rtol=1e-5)
+
+
+def test_probing_all_lists_is_exact(library):
+    folder, latents, queries = library
+    index = LatentIndex(folder)
+    index.build_partitions(n_lists=16)
+    assert index.offsets[-1] == len(latents)
+    _, exact = index.search(queries, k=7)
+    _, probed = index.search(queries, k=7, n_probe=16)
+    np.testing.assert_array_equal(probed, exact)
+    # fewer lists find most neighbours
+    _, partial = index.search(queries, k=7, n_probe=4)
+    assert np.mean([len(set(a) & set(b)) / 7 for a, b in zip(partial, exact)]) > 0.5
+
+
+@pytest.mark.parametrize('n', [1, 3, 15])
+def test_small_library(tmp_path, n):
+    ''' the default 4*sqrt(n) lists exceed n for n < 16 '''
+    latents = np.random.default_rng(n).standard_normal((n, 4)).astype(np.float32)
+    index = LatentIndex(write_library(str(tmp_path), latents))
+    index.build_partitions()
+    assert len(index.centroids) <= n
+    queries = latents[:2] + 0.01
+    _, exact = index.search(queries, k=5)
+    _, probed = index.search(queries, k=5, n_probe=len(index.centroids))
+    np.testing.assert_array_equal(probed, exact)
+    np.testing.assert_array_equal(exact, _brute_force(latents, queries, min(5, n))[1])
+
+
+def test_kmeans_clamps_lists():
+    x = np.random.default_rng(0).standard_normal((5, 3)).astype(np.float32)
+    assert kmeans(x, 20).shape == (5, 3)
@@ -0,0 +1,32 @@
+'''
+streaming per-sample storage of helper_latents
+
+    python -m pytest tests/test_latents.py
+'''
+import numpy as np
+import torch
+
+from vae_geom.helper_latents import MemmapWriter
+
+
+def test_round_trip_in_dataset_order(tmp_path):
+    rows = np.random.default_rng(0).standard_normal((50, 6)).astype(np.float32)
+    writer = MemmapWriter(str(tmp_path / 'save_model' / 'mu_list_0.npy'), 50, (6,))
+    order = np.random.default_rng(1).permutation(50)
+    for batch in np.array_split(order, 7): # shuffled batches, tensors and numpy arrays
+        if len(batch) % 2:
+            writer.write(torch.from_numpy(batch), torch.from_numpy(rows[batch]).requires_grad_(True))
+        else:
+            writer.write(batch, rows[batch])
+    path = writer.close()
+    assert writer.close() == path # closing twice is a no-op
+    np.testing.assert_array_equal(np.load(path), rows)
+
+
+def test_row_shape_and_dtype(tmp_path):
+    fields = np.random.default_rng(0).random((4, 2, 5, 5))
+    writer = MemmapWriter(str(tmp_path / 'x_test.npy'), 4, fields.shape[1:], dtype=np.float16)
+    writer.write(np.arange(4), fields)
+    saved = np.load(writer.close(), mmap_mode='r')
+    assert saved.shape == (4, 2, 5, 5) and saved.dtype == np.float16
+    np.testing.assert_array_equal(saved, fields.astype(np.float16))
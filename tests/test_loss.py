@@ -0,0 +1,57 @@
+'''
+memory-lean training step: the fused loss and the checkpointed final layer compute the plain step
+
+    python -m pytest tests/test_loss.py
+'''
+import copy
+
+import pytest
+import torch
+
+from vae_geom.helper_VAEstruc import CNN_VAE, lossfunc, lossfunc_logits
+
+
+def _inputs(seed=0):
+    g = torch.Generator().manual_seed(seed)
+    x = torch.rand(4, 2, 16, 16, generator=g, dtype=torch.float64)
+    logits = 3. * torch.randn(4, 2, 16, 16, generator=g, dtype=torch.float64)
+    mu = torch.randn(4, 6, generator=g, dtype=torch.float64)
+    logvar = torch.randn(4, 6, generator=g, dtype=torch.float64)
+    return x, logits, mu, logvar
+
+
+def test_fused_loss_equals_loss_of_sigmoid():
+    x, logits, mu, logvar = _inputs()
+    logits.requires_grad_(True)
+    loss, recons = lossfunc(x, torch.sigmoid(logits), mu, logvar, beta=10., terms=True)
+    grad, = torch.autograd.grad(loss, logits)
+    fused, fused_recons = lossfunc_logits(x, logits, mu, logvar, beta=10., terms=True)
+    fused_grad, = torch.autograd.grad(fused, logits)
+    torch.testing.assert_close(fused, loss, rtol=1e-10, atol=0)
+    torch.testing.assert_close(fused_recons, recons, rtol=1e-10, atol=0)
+    torch.testing.assert_close(fused_grad, grad, rtol=1e-8, atol=1e-10)
+    torch.testing.assert_close(lossfunc_logits(x, logits, mu, logvar, beta=10.), fused)
+
+
+def _step(model, x, eps, fused):
+    x_hat, mu, logvar = model(x, logits=fused, eps=eps)
+    (lossfunc_logits if fused else lossfunc)(x, x_hat, mu, logvar, beta=10.).backward()
+    return {k: p.grad for k, p in model.named_parameters()}, {k: b.clone() for k, b in model.named_buffers()}
+
+
+@pytest.mark.parametrize('fused', [False, True])
+def test_checkpointed_final_layer_equals_plain(fused):
+    ''' same gradients, and the recomputation in backward does not update the batch norm statistics again '''
+    torch.manual_seed(0)
+    plain = CNN_VAE(channel_in=2, latent_dim=4, hidden_dims=[8, 16], input_size=32, decoder='upsample').double().train()
+    checkpointed = copy.deepcopy(plain)
+    checkpointed.checkpoint_final = True
+    x = torch.rand(4, 2, 32, 32, dtype=torch.float64)
+    eps = torch.randn(4, 4, dtype=torch.float64)
+    grads, buffers = _step(plain, x, eps, fused)
+    grads_ck, buffers_ck = _step(checkpointed, x, eps, fused)
+    for k in grads:
+        torch.testing.assert_close(grads_ck[k], grads[k], rtol=1e-10, atol=1e-12, msg=k)
+    for k in buffers:
+        torch.testing.assert_close(buffers_ck[k], buffers[k], rtol=0, atol=0, msg=k)
+    assert int(buffers_ck['final_layer.2.num_batches_tracked']) == 1
@@ -0,0 +1,59 @@
+'''
+error bounds of the quantized dataset format of helper_quantize, read back with helper_load_data
+
+    python -m pytest tests/test_quantize.py
+'''
+import json
+
+import numpy as np
+import pytest
+
+from vae_geom.helper_quantize import quantize_dataset, value_range, GRANULARITIES, LEVELS
+from vae_geom.helper_load_data import load_channels, quantized_array
+
+
+@pytest.fixture(scope='module')
+def src_path(tmp_path_factory):
+    ''' 10 samples of 3 channels, ranges that differ per sample and channel, one constant field '''
+    rng = np.random.default_rng(0)
+    data = rng.standard_normal((10, 3, 6, 5)) * rng.uniform(0.1, 10., (10, 3, 1, 1)) + rng.uniform(-5., 5., (10, 3, 1, 1))
+    data[4, 1] = 2.5
+    path = str(tmp_path_factory.mktemp('src') / 'rve.npy')
+    np.save(path, data.astype(np.float32))
+    return path
+
+
+@pytest.mark.parametrize('granularity', GRANULARITIES)
+def test_uint8_error_within_half_step(src_path, tmp_path, granularity):
+    source = np.load(src_path)[:, :2].astype(np.float64)
+    report = quantize_dataset(src_path, str(tmp_path), 'uint8', granularity, channels=2, chunk=3)
+    data = load_channels(str(tmp_path))
+    assert isinstance(data, quantized_array) and data.shape == source.shape
+    values = data[np.arange(len(data))]
+    assert values.dtype == np.float32
+
+    lo, hi = value_range(source, granularity)
+    half_step = np.broadcast_to((hi - lo) / LEVELS / 2, source.shape)
+    err = np.abs(values - source)
+    assert (err <= half_step + 1e-5 * (np.abs(source) + 1.)).all() # half a level, plus float32 rounding
+    assert abs(report['max_error'] - err.max()) <= 1e-5 * (np.abs(source).max() + 1.)
+    if granularity == 'sample_channel':
+        np.testing.assert_allclose(values[4, 1], 2.5, rtol=1e-6) # a constant range is stored exactly
+    with open(tmp_path / 'meta.json') as f:
+        assert json.load(f)['granularity'] == granularity
+
+
+def test_float16_relative_error(src_path, tmp_path):
+    source = np.load(src_path)[:, :2].astype(np.float64)
+    report = quantize_dataset(src_path, str(tmp_path), 'float16', chunk=4)
+    values = load_channels(str(tmp_path), mmap=True)[np.arange(10)]
+    err = np.abs(values - source)
+    assert (err <= np.abs(source) * 2. ** -11 + 2. ** -24).all() # round to nearest with a 10 bit mantissa
+    assert report['ram_ratio'] < 0.51
+
+
+def test_unknown_options(src_path, tmp_path):
+    with pytest.raises(ValueError):
+        quantize_dataset(src_path, str(tmp_path), 'int4')
+    with pytest.raises(ValueError):
+        quantize_dataset(src_path, str(tmp_path), 'uint8', 'tensor')
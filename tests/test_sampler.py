@@ -0,0 +1,89 @@
+'''
+constrained sampling of helper_sampler, with a stand-in for CNN_VAE.decode whose volume fraction is set by z
+
+    python -m pytest tests/test_sampler.py
+'''
+import os
+import json
+
+import numpy as np
+import pytest
+import torch
+
+from vae_geom.helper_sampler import latent_proposal, sample_designs, distinct_rows, min_distances
+from vae_geom.helper_descriptors import volume_fraction
+
+W = 20
+
+
+def _decode(z):
+    ''' fields [B*2*W*W], a ramp along the rows shifted by z; channel 0 has a solid fraction of about 0.5 + 0.2 * z[:, 0] '''
+    ramp = (torch.arange(W, dtype=torch.float32) + 0.5) / W
+    x = torch.stack([ramp[None, :] + 0.2 * z[:, :1], ramp[None, :] - 0.2 * z[:, 1:2]], dim=1) # [B*2*W]
+    return x[:, :, None, :].expand(-1, -1, W, -1).contiguous()
+
+
+def _load(out):
+    with open(os.path.join(out, 'meta.json')) as f:
+        meta = json.load(f)
+    return meta, [np.load(os.path.join(out, name)) for name in ('latents.npy', 'fields.npy', 'descriptors.npy')]
+
+
+def test_window_and_min_distance(tmp_path):
+    out = str(tmp_path / 'designs')
+    existing = np.random.default_rng(0).standard_normal((50, 3)).astype(np.float32)
+    meta = sample_designs(_decode, 40, out, latent_proposal(3), windows={'volume_fraction': (0, 0.6, 0.75)},
+                          existing=existing, min_distance=0.3, round_size=64, min_round=32, decode_batch=16, seed=1)
+    meta, (z, fields, desc) = _load(out)
+    assert meta['accepted'] == 40 and 'note' not in meta
+    assert meta['drawn'] == sum(r['drawn'] for r in meta['rounds']) and len(meta['rounds']) > 1
+    assert fields.shape == (40, 2, W, W) and desc.shape == (40, 2, 1) and meta['descriptors'] == ['volume_fraction']
+    # the stored rows belong together and pass the window
+    torch.testing.assert_close(torch.from_numpy(fields), _decode(torch.from_numpy(z)))
+    np.testing.assert_allclose(desc[..., 0], volume_fraction(torch.from_numpy(fields)).numpy())
+    assert ((desc[:, 0, 0] >= 0.6) & (desc[:, 0, 0] <= 0.75)).all()
+    # apart from the existing designs and from each other
+    assert (min_distances(torch.from_numpy(z), existing) >= 0.3).all()
+    pairwise = torch.cdist(torch.from_numpy(z), torch.from_numpy(z)) + 1e9 * torch.eye(40)
+    assert pairwise.min() >= 0.3
+
+
+def test_same_seed_same_designs(tmp_path):
+    kwargs = dict(windows={'volume_fraction': (1, None, 0.4)}, min_distance=0.1, round_size=32, seed=3)
+    sample_designs(_decode, 10, str(tmp_path / 'a'), latent_proposal(2), **kwargs)
+    sample_designs(_decode, 10, str(tmp_path / 'b'), latent_proposal(2), **kwargs)
+    for a, b in zip(_load(str(tmp_path / 'a'))[1], _load(str(tmp_path / 'b'))[1]):
+        np.testing.assert_array_equal(a, b)
+    assert (_load(str(tmp_path / 'a'))[1][2][:, 1, 0] <= 0.4).all()
+
+
+def test_max_draws_partial_fill(tmp_path):
+    out = str(tmp_path / 'designs')
+    # a rare window: z[:, 0] > ~1.25, a few percent of the prior
+    meta = sample_designs(_decode, 50, out, latent_proposal(2), windows={'volume_fraction': (0, 0.75, None)},
+                          round_size=100, min_round=100, max_draws=300)
+    meta, (z, fields, desc) = _load(out)
+    assert meta['drawn'] == 300 and 0 < meta['accepted'] < 50 and 'max_draws' in meta['note']
+    k = meta['accepted']
+    assert fields.shape == (50, 2, W, W) and (desc[:k, 0, 0] >= 0.75).all()
+    torch.testing.assert_close(torch.from_numpy(fields[:k]), _decode(torch.from_numpy(z[:k])))
+
+
+def test_nothing_accepted_writes_every_file(tmp_path):
+    out = str(tmp_path / 'designs')
+    meta = sample_designs(_decode, 5, out, latent_proposal(2), windows={'volume_fraction': (0, 1.5, None)},
+                          max_draws=200)
+    meta, (z, fields, desc) = _load(out)
+    assert meta['accepted'] == 0 and meta['drawn'] == 200 and 'note' in meta
+    assert z.shape == (5, 2) and fields.shape == (5, 2, W, W) and desc.shape == (5, 2, 1)
+
+
+def test_proposal_and_distinct_rows():
+    mu = np.random.default_rng(0).multivariate_normal([1., -2.], [[1., 0.8], [0.8, 1.]], size=4000)
+    z = latent_proposal(mu=mu).sample(4000, torch.Generator().manual_seed(0)).numpy()
+    np.testing.assert_allclose(z.mean(axis=0), [1., -2.], atol=0.1)
+    np.testing.assert_allclose(np.cov(z, rowvar=False), [[1., 0.8], [0.8, 1.]], atol=0.1)
+    rows = torch.tensor([[0., 0.], [0.05, 0.], [1., 0.], [0.1, 0.], [1.02, 0.]])
+    assert distinct_rows(rows, 0.08).tolist() == [True, False, True, True, False] # greedy in draw order
+    with pytest.raises(ValueError):
+        sample_designs(_decode, 1, '.', latent_proposal(2), windows={'porosity': (0, 0., 1.)})
@@ -0,0 +1,31 @@
+'''
+batched decoder Jacobians and Jacobian products of helper_sensitivity against finite differences
+
+    python -m pytest tests/test_sensitivity.py
+'''
+import pytest
+import torch
+
+from vae_geom.helper_VAEstruc import CNN_VAE
+from vae_geom.helper_sensitivity import check_jacobian, decoder_vjp, loop_vjp
+
+
+@pytest.fixture(scope='module')
+def model():
+    ''' a small 'upsample' CNN_VAE in eval mode and double precision, so that the check is not limited by round-off '''
+    torch.manual_seed(0)
+    return CNN_VAE(channel_in=2, latent_dim=4, hidden_dims=[8, 16], input_size=32, decoder='upsample').double().eval()
+
+
+def test_jacobian_matches_finite_differences(model):
+    z = torch.randn(3, model.latent_dim, dtype=torch.float64)
+    check = check_jacobian(model.decode, z, eps=1e-5)
+    assert check['fd_max_abs'] > 0.
+    for name in ('jacobian_max_error', 'jvp_max_error', 'vjp_max_error'):
+        assert check[name] < 1e-6 * max(1., check['fd_max_abs']), (name, check)
+
+
+def test_batched_vjp_matches_per_element_loop(model):
+    z = torch.randn(5, model.latent_dim, dtype=torch.float64)
+    adjoint = torch.randn(5, model.channel_in, 32, 32, dtype=torch.float64)
+    torch.testing.assert_close(decoder_vjp(model.decode, z, adjoint), loop_vjp(model.decode, z, adjoint))
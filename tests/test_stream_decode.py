@@ -0,0 +1,76 @@
+'''
+chunked decoding into a memory map of helper_stream_decode, with a cheap stand-in for CNN_VAE.decode
+
+    python -m pytest tests/test_stream_decode.py
+'''
+import os
+
+import numpy as np
+import pytest
+import torch
+
+from vae_geom.helper_stream_decode import stream_decode
+
+
+class _decoder:
+    ''' fields [B*2*3*3] that depend on z, recording the decoded rows; raises after fail_after calls '''
+    def __init__(self, fail_after=None):
+        self.fail_after = fail_after
+        self.calls = 0
+        self.rows = []
+
+    def __call__(self, z):
+        if self.fail_after is not None and self.calls == self.fail_after:
+            raise KeyboardInterrupt
+        self.calls += 1
+        self.rows.append(z[:, 0].clone())
+        return z.sum(1)[:, None, None, None] + torch.arange(18.).view(1, 2, 3, 3)
+
+
+@pytest.fixture
+def latents():
+    z = np.random.default_rng(0).standard_normal((23, 4)).astype(np.float32)
+    z[:, 0] = np.arange(23) # the first coordinate identifies the row
+    return z
+
+
+def _expected(z):
+    return _decoder()(torch.from_numpy(z)).numpy()
+
+
+def test_interrupted_run_resumes(latents, tmp_path):
+    out = str(tmp_path / 'fields.npy')
+    with pytest.raises(KeyboardInterrupt):
+        stream_decode(_decoder(fail_after=3), latents, out, chunk_size=5)
+    assert os.path.exists(out + '.progress.npz')
+
+    decode = _decoder()
+    report = stream_decode(decode, latents, out, chunk_size=5)
+    assert report['chunks'] == 5 and report['skipped'] == 3 and report['decoded'] == 2
+    assert torch.cat(decode.rows).tolist() == list(range(15, 23)) # only the unfinished chunks are decoded
+    np.testing.assert_allclose(np.load(out), _expected(latents), rtol=1e-6)
+
+
+def test_changed_chunk_size_or_no_restart_decodes_all(latents, tmp_path):
+    out = str(tmp_path / 'fields.npy')
+    stream_decode(_decoder(), latents, out, chunk_size=5)
+    assert stream_decode(_decoder(), latents, out, chunk_size=5)['decoded'] == 0
+    assert stream_decode(_decoder(), latents, out, chunk_size=4)['decoded'] == 6
+    assert stream_decode(_decoder(), latents, out, chunk_size=4, restart=False)['skipped'] == 0
+
+
+def test_iterator_input_and_dtype(latents, tmp_path):
+    out = str(tmp_path / 'fields.npy')
+    parts = np.split(latents, [3, 4, 13]) # uneven arrays are re-chunked
+    report = stream_decode(_decoder(), iter(parts), out, n=len(latents), chunk_size=6, dtype=np.float16)
+    assert report['decoded'] == 4
+    fields = np.load(out)
+    assert fields.dtype == np.float16
+    np.testing.assert_allclose(fields, _expected(latents).astype(np.float16))
+
+
+def test_worker_processes(latents, tmp_path):
+    out = str(tmp_path / 'fields.npy')
+    report = stream_decode(_decoder(), latents, out, chunk_size=4, workers=2)
+    assert report['decoded'] == 6
+    np.testing.assert_allclose(np.load(out), _expected(latents), rtol=1e-6)
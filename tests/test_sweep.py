@@ -0,0 +1,100 @@
+'''
+trial management of helper_sweep, with a stand-in for the training script
+
+    python -m pytest tests/test_sweep.py
+'''
+import os
+import csv
+import sys
+import json
+import time
+import subprocess
+
+import pytest
+
+from vae_geom import helper_sweep
+from vae_geom.helper_sweep import parse_param, grid_trials, random_trials, run_sweep, _trial
+
+# reads ./config_cluster.json and logs test_recon_loss = beta / (epoch + 1); ignores SIGTERM when
+# model_params.stubborn is set, like a run stuck in a collective or a data loader worker
+FAKE_TRAIN = '''
+import json, signal, time
+with open('config_cluster.json') as f:
+    config = json.load(f)
+params = config['model_params']
+if params.get('stubborn'):
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+with open(config['instrumentation']['log_file'], 'a') as log:
+    for epoch in range(4):
+        time.sleep(0.05)
+        log.write(json.dumps({'epoch': epoch, 'test_recon_loss': params['beta'] / (epoch + 1)}) + '\\n')
+        log.flush()
+if params.get('stubborn'):
+    time.sleep(60)
+'''
+
+
+@pytest.fixture
+def base_config(tmp_path, monkeypatch):
+    with open(tmp_path / 'fake_train.py', 'w') as f:
+        f.write(FAKE_TRAIN)
+    monkeypatch.setattr(helper_sweep, 'TRAIN_MODULE', 'fake_train')
+    monkeypatch.setenv('PYTHONPATH', str(tmp_path))
+    path = str(tmp_path / 'config_cluster.json')
+    with open(path, 'w') as f:
+        json.dump({'Path': {'train_data_path': 'train.npy', 'test_data_path': 'test.npy'},
+                   'model_params': {'beta': 1.}}, f)
+    return path
+
+
+def test_parameter_spaces():
+    assert parse_param('model_params.decoder=upsample,"legacy",4') == ('model_params.decoder', ['upsample', 'legacy', 4])
+    assert parse_param('model_params.beta=loguniform:1:100') == ('model_params.beta', ('loguniform', 1., 100.))
+    with pytest.raises(ValueError):
+        parse_param('model_params.beta')
+    space = {'a.x': [1, 2], 'a.y': [3, 4, 5]}
+    assert len(grid_trials(space)) == 6
+    trials = random_trials({'a.x': [1, 2], 'a.b': ('loguniform', 1., 100.), 'a.n': ('randint', 2, 4)}, 20)
+    assert all(1. <= t['a.b'] <= 100. and t['a.n'] in (2, 3, 4) for t in trials)
+    with pytest.raises(ValueError):
+        grid_trials({'a.b': ('uniform', 0., 1.)})
+
+
+def test_median_stopping_kills_stubborn_trial(base_config, tmp_path):
+    trials = [{'model_params.beta': b} for b in (1., 2., 3.)]
+    trials.append({'model_params.beta': 10., 'model_params.stubborn': True})
+    out = str(tmp_path / 'sweep')
+    t0 = time.time()
+    table = run_sweep(trials, base_config, out, cores=[os.sched_getaffinity(0).pop()], poll=0.05,
+                      stop_timeout=1., verbose=False) # one slot, the trials run one after the other
+    assert time.time() - t0 < 30 # the ignored SIGTERM is followed by SIGKILL
+    status = {row['trial']: row['status'] for row in table}
+    assert status == {0: 'completed', 1: 'completed', 2: 'completed', 3: 'stopped'}
+    assert [row['trial'] for row in table] == [0, 1, 2, 3] and table[0]['best_test_recon_loss'] == 0.25
+    with open(os.path.join(out, 'results.csv')) as f:
+        rows = list(csv.DictReader(f))
+    assert [row['status'] for row in rows] == ['completed'] * 3 + ['stopped']
+    assert rows[0]['model_params.stubborn'] == '' and rows[3]['model_params.stubborn'] == 'True'
+    with open(os.path.join(out, 'trial_3', 'config_cluster.json')) as f:
+        config = json.load(f)
+    assert config['Path']['train_data_path'] == str(tmp_path / 'train.npy')
+    assert config['data_loader']['mmap'] is True
+
+
+def test_empty_sweep_writes_header(base_config, tmp_path):
+    out = str(tmp_path / 'new' / 'sweep')
+    assert run_sweep([], base_config, out, verbose=False) == []
+    with open(os.path.join(out, 'results.csv')) as f:
+        header = f.readline().strip().split(',')
+    assert header[:2] == ['trial', 'status'] and 'best_test_recon_loss' in header
+
+
+def test_stop_escalates_to_kill(tmp_path):
+    trial = _trial(0, {}, str(tmp_path))
+    code = 'import signal, time; signal.signal(signal.SIGTERM, signal.SIG_IGN); print(1, flush=True); time.sleep(60)'
+    trial.process = subprocess.Popen([sys.executable, '-c', code], stdout=subprocess.PIPE)
+    trial.process.stdout.readline() # SIGTERM is ignored from here on
+    t0 = time.time()
+    trial.stop(timeout=0.5)
+    assert trial.process.returncode == -9 and time.time() - t0 < 10
+    trial.process.stdout.close()